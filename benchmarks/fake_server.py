@@ -0,0 +1,242 @@
+from __future__ import division, print_function
+import MDSplus as mds
+import numpy as np
+import re
+import threading
+import time
+import zlib
+"""
+Module fake_server
+==================
+Defines FakeServer, a stand-in for an MDSplus server that lives in the benchmark process.
+FakeServer.connect takes the place of MDSplus.Connection (see ConnectionPool.connection_factory)
+and serves a synthetic signal for every node it is asked for.  The signals are deterministic,
+so every run fetches the same data, and requests are slowed down by a configurable latency
+and bandwidth to look like a server across the network.
+"""
+
+_dim_of_y = re.compile(r'^\(_piscope_y = (.*); make_signal\(data\(_piscope_y\), \*, (data\()?dim_of\(_piscope_y\)\)?\)\)$',
+                       re.DOTALL)
+_window = re.compile(r'^\(_piscope_wy = (.*?); _piscope_wt = (.*?); _piscope_wm = (.*?); make_signal\(', re.DOTALL)
+_window_start = re.compile(r'_piscope_wt >= ([-+0-9.eED]+)\)')
+_window_end = re.compile(r'_piscope_wt <= ([-+0-9.eED]+)\)')
+_window_step = re.compile(r'mod\(data\(0 : size\(_piscope_wt\) - 1\), (\d+)\)')
+_data_of = re.compile(r'^data\((.*)\)$', re.DOTALL)
+_dim_of = re.compile(r'^dim_of\((.*)\)$', re.DOTALL)
+
+
+def _tdi_float(literal):
+    # 0.1D0 and 1D-05 are double precision literals
+    return float(literal.replace('D', 'e'))
+
+
+class FakeServer(object):
+    """
+    Serves synthetic signals to FakeConnections with a simulated network cost
+
+    Every request (a get, an openTree or the execute of a GetMany) waits latency seconds plus
+    the time to send its result at bandwidth bytes per second.  At most concurrency requests
+    are served at once, the rest queue up like on a busy server.
+
+    Example::
+
+        import source.data.mdsplus_helpers as mdsh
+        from benchmarks.fake_server import FakeServer
+        from source.config.parser import config_parser
+        config, _, tree, _, _, _ = config_parser('Configs/discharge.ini')
+        server = FakeServer(n_points=100000, latency=0.02)
+        mdsh.connection_pool.connection_factory = server.connect
+        try:
+            data = mdsh.retrieve_all_data('fake', tree, 12345, config)
+        finally:
+            mdsh.connection_pool.clear()
+            mdsh.connection_pool.connection_factory = None
+
+    Attributes:
+        n_points (int): number of points in every signal
+        latency (float): seconds added to every request
+        bandwidth (float): bytes per second, None for no transfer cost
+        current_shot (int): shot returned for $SHOT and opened for shot 0
+        requests (int): number of requests served
+        bytes_sent (int): bytes of array data served
+    """
+
+    def __init__(self, n_points=100000, latency=0.02, bandwidth=None, concurrency=8, current_shot=12345):
+        self.n_points = int(n_points)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.current_shot = current_shot
+        self.requests = 0
+        self.bytes_sent = 0
+        self._slots = threading.Semaphore(concurrency) if concurrency else None
+        self._lock = threading.Lock()
+        self._time = np.linspace(0.0, 1.0, self.n_points)
+        self._signals = dict()
+
+    def connect(self, address):
+        """
+        Returns:
+            FakeConnection: new connection to this server, takes the place of MDSplus.Connection(address)
+        """
+        return FakeConnection(self)
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def signal(self, shot_number, expression):
+        """
+        Returns:
+            np.ndarray: synthetic data for a node, the same every time for the same shot and node
+        """
+        key = (shot_number, expression.strip().lower())
+        with self._lock:
+            data = self._signals.get(key, None)
+        if data is None:
+            rng = np.random.RandomState(zlib.crc32(('%d:%s' % key).encode('utf-8')) & 0x7fffffff)
+            frequency = rng.uniform(1.0, 50.0)
+            data = np.sin(2 * np.pi * frequency * self._time + rng.uniform(0, 2 * np.pi))
+            data += 0.05 * rng.standard_normal(self.n_points)
+            # a few arcs, which a plain stride is likely to miss
+            data[rng.randint(0, self.n_points, 5)] += rng.uniform(2.0, 5.0, 5)
+            with self._lock:
+                self._signals[key] = data
+        return data
+
+    def evaluate(self, shot_number, expression):
+        """
+        Evaluates the kinds of TDI expressions PiScope sends, anything else is taken to be a node name
+
+        Returns:
+            MDSplus.Data: the result the real server would send
+        """
+        expression = expression.strip()
+        if expression == '1':
+            return mds.Int32(1)
+        if expression == '$SHOT':
+            return mds.Int32(self.current_shot)
+
+        match = _dim_of_y.match(expression)
+        if match is not None:
+            # record and its dimension in one request, see retrieve_data
+            return self._as_signal(self.evaluate(shot_number, match.group(1)))
+
+        match = _window.match(expression)
+        if match is not None:
+            return self._windowed(shot_number, match)
+
+        match = _data_of.match(expression)
+        if match is not None:
+            return mds.Float64Array(self.evaluate(shot_number, match.group(1)).data())
+
+        match = _dim_of.match(expression)
+        if match is not None:
+            return mds.Float64Array(self._time)
+
+        return mds.Signal(mds.Float64Array(self.signal(shot_number, expression)), None,
+                          mds.Float64Array(self._time))
+
+    def _as_signal(self, value):
+        if isinstance(value, mds.Signal):
+            return value
+        return mds.Signal(value, None, mds.Float64Array(self._time))
+
+    def _windowed(self, shot_number, match):
+        mask = np.ones(self.n_points, dtype=bool)
+        start = _window_start.search(match.group(3))
+        end = _window_end.search(match.group(3))
+        step = _window_step.search(match.group(3))
+        if start is not None:
+            mask &= self._time >= _tdi_float(start.group(1))
+        if end is not None:
+            mask &= self._time <= _tdi_float(end.group(1))
+        if step is not None:
+            mask &= np.arange(self.n_points) % int(step.group(1)) == 0
+
+        data = self.evaluate(shot_number, match.group(1)).data()
+        return mds.Signal(mds.Float64Array(data[mask]), None, mds.Float64Array(self._time[mask]))
+
+    def serve(self, results):
+        """
+        Waits as long as sending results would take over the network
+
+        Args:
+            results (list): MDSplus.Data objects being sent
+        """
+        nbytes = 0
+        for value in results:
+            nbytes += np.asarray(value.data()).nbytes
+            if isinstance(value, mds.Signal):
+                nbytes += np.asarray(value.dim_of().data()).nbytes
+
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            delay = self.latency
+            if self.bandwidth:
+                delay += nbytes / self.bandwidth
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+
+
+class FakeConnection(object):
+    """
+    The part of MDSplus.Connection that PiScope uses, answered by a FakeServer
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.shot_number = None
+
+    def openTree(self, tree, shot_number):
+        self.server.serve([])
+        self.shot_number = self.server.current_shot if shot_number == 0 else shot_number
+
+    def get(self, expression):
+        value = self.server.evaluate(self.shot_number, expression)
+        self.server.serve([value])
+        return value
+
+    def getMany(self):
+        return FakeGetMany(self)
+
+    def disconnect(self):
+        pass
+
+
+class FakeGetMany(object):
+    """
+    The part of MDSplus.GetMany that PiScope uses
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._expressions = []
+        self._results = dict()
+        self._errors = dict()
+
+    def append(self, name, expression):
+        self._expressions.append((name, expression))
+
+    def execute(self):
+        server = self.connection.server
+        for name, expression in self._expressions:
+            try:
+                self._results[name] = server.evaluate(self.connection.shot_number, expression)
+            except Exception as e:
+                self._errors[name] = str(e)
+        server.serve(list(self._results.values()))
+
+    def get(self, name):
+        return self._results[name]
+
+    def error(self, name):
+        return self._errors.get(name, None)
@@ -0,0 +1,357 @@
+from __future__ import division, print_function
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import matplotlib
+# the plotting benchmarks draw without a display, the GUI benchmark has its own canvas
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from source.config import parser as config_parser
+from source.data import mdsplus_helpers as mdsh
+from source.plotting import data_plotter
+from source.logging.piscope_logging import create_logger
+from .fake_server import FakeServer
+"""
+Module run_benchmarks
+=====================
+Runs the PiScope benchmarks against a FakeServer and writes the timings to a JSON file.
+
+    python -m benchmarks.run_benchmarks --points 100000 --latency 0.02
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/baseline.json
+
+Every configuration in Configs/ is fetched, decimated, plotted and shown in a PiScope window,
+with synthetic signals in place of the nodes it names.  Each benchmark is run --repeat times
+and the min, median, mean and max are recorded along with the requests and bytes the server
+served per run.  With --compare, benchmarks whose median got slower than --threshold times
+the baseline are listed and the script exits with status 1.
+"""
+
+batch_modes = (None, 'subplot', 'config')
+groups = ('retrieve', 'downsample', 'plot', 'gui')
+
+
+class BenchmarkRunner(object):
+    """
+    Times callables against a FakeServer and collects the results
+
+    Attributes:
+        server (FakeServer): server the MDSplus requests go to
+        repeat (int): number of timed runs of each benchmark
+        results (list): one dict per benchmark, see measure
+    """
+
+    def __init__(self, server, repeat=5):
+        self.server = server
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, fn, setup=None, **info):
+        """
+        Times fn repeat times, calling setup untimed before each run
+
+        Args:
+            name (str): unique name of the benchmark, used to compare runs
+            fn (callable): code to time
+            setup (callable, optional): run before every call of fn, e.g. to empty the caches
+            **info: extra fields stored with the result
+
+        Returns:
+            dict: the result, None if fn raised
+        """
+        times = []
+        requests = 0
+        nbytes = 0
+        try:
+            for _ in range(self.repeat):
+                if setup is not None:
+                    setup()
+                self.server.reset_counters()
+                start = timeit.default_timer()
+                fn()
+                times.append(timeit.default_timer() - start)
+                requests += self.server.requests
+                nbytes += self.server.bytes_sent
+        except Exception as e:
+            print("%-60s failed: %s: %s" % (name, type(e).__name__, e))
+            self.results.append(dict(name=name, error="%s: %s" % (type(e).__name__, e), **info))
+            return None
+
+        times = np.array(times)
+        result = dict(name=name, min=float(times.min()), median=float(np.median(times)),
+                      mean=float(times.mean()), max=float(times.max()), n=len(times),
+                      requests=requests / len(times), bytes=nbytes / len(times), **info)
+        self.results.append(result)
+        print("%-60s %9.4f s  (min %.4f s, %d requests)" % (name, result['median'], result['min'],
+                                                             result['requests']))
+        return result
+
+
+def load_config(filename):
+    """
+    Returns:
+        tuple: (name, config, server, tree, col_setup, locs) of a configuration file
+    """
+    config, server, tree, _, col_setup, locs = config_parser.config_parser(filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return name, config, server, tree, col_setup, locs
+
+
+def bench_retrieve(runner, name, server, tree, locs, shot_number):
+    """
+    retrieve_all_data for every batch mode, from an empty cache and from the signal cache
+    """
+    for batch in batch_modes:
+        label = 'retrieve_all_data/%s/batch=%s' % (name, batch or 'none')
+        runner.measure(label + '/cold', lambda: mdsh.retrieve_all_data(server, tree, shot_number, locs, batch=batch),
+                       setup=mdsh.empty_lru_cache, group='retrieve', config=name)
+        runner.measure(label + '/cached', lambda: mdsh.retrieve_all_data(server, tree, shot_number, locs, batch=batch),
+                       group='retrieve', config=name)
+
+
+def bench_downsample(runner, name, col_setup, locs, data, downsampling):
+    """
+    DataDisplayDownsampler.decimate in every mode, and update through set_xlim like a zoom does
+    """
+    figure, axs, _ = data_plotter.create_figure(col_setup)
+    try:
+        down_samplers = [d for d in data_plotter.plot_all_data(axs, locs, data, downsampling=downsampling)
+                         if d is not None and d.lines]
+        if not down_samplers:
+            return
+
+        views = dict()
+        for down_sampler in down_samplers:
+            xstart, xend = down_sampler.ax.get_xlim()
+            width = xend - xstart
+            views[down_sampler] = dict(full=(xstart, xend),
+                                       zoom=(xstart + 0.45 * width, xstart + 0.55 * width))
+
+        def decimate_all(view):
+            for down_sampler in down_samplers:
+                down_sampler.decimate(*views[down_sampler][view], refine=False)
+
+        for mode, aligned in (('stride', False), ('envelope', False), ('stride', True)):
+            label = 'aligned' if aligned else mode
+            for down_sampler in down_samplers:
+                down_sampler.mode = mode
+                down_sampler.aligned = aligned
+            for view in ('full', 'zoom'):
+                runner.measure('downsample/%s/%s/%s' % (name, label, view), lambda: decimate_all(view),
+                               group='downsample', config=name, mode=label, view=view)
+
+        for down_sampler in down_samplers:
+            down_sampler.mode = 'stride'
+            down_sampler.aligned = False
+        steps = [0]
+
+        def pan():
+            # alternate between two views so the limits always change, update re-decimates in place
+            steps[0] += 1
+            for down_sampler in down_samplers:
+                xstart, xend = views[down_sampler]['zoom']
+                shift = 0.1 * (xend - xstart) * (steps[0] % 2)
+                down_sampler.ax.set_xlim(xstart + shift, xend + shift)
+
+        runner.measure('update/%s/pan' % name, pan, group='downsample', config=name)
+    finally:
+        plt.close(figure)
+
+
+def bench_plot(runner, name, col_setup, locs, data, downsampling):
+    """
+    plot_all_data into a new figure, with and without drawing it
+    """
+    def plot(draw):
+        figure, axs, _ = data_plotter.create_figure(col_setup)
+        try:
+            data_plotter.plot_all_data(axs, locs, data, downsampling=downsampling)
+            if draw:
+                figure.canvas.draw()
+        finally:
+            plt.close(figure)
+
+    runner.measure('plot_all_data/%s' % name, lambda: plot(False), group='plot', config=name)
+    runner.measure('plot_all_data/%s/draw' % name, lambda: plot(True), group='plot', config=name)
+
+
+def bench_gui(runner, filenames, shot_number, downsampling, timeout=300.0):
+    """
+    A full fetch and plot cycle of a PiScope window ending in handle_mdsplus_data, and a replot
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtCore, QtWidgets
+    from source.gui.piscope import PiScope
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    def wait(window):
+        deadline = timeit.default_timer() + timeout
+        while window.acquiring_data:
+            if timeit.default_timer() > deadline:
+                raise RuntimeError("shot %d still not in after %.0f s" % (shot_number, timeout))
+            app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+        # queued redraws
+        app.processEvents()
+
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        mdsh.empty_lru_cache()
+        try:
+            window = PiScope(filename, shot_number)
+        except Exception as e:
+            print("%-60s failed: %s: %s" % ('piscope/%s' % name, type(e).__name__, e))
+            continue
+
+        try:
+            window.downsampling_points = downsampling
+            wait(window)
+
+            def cycle():
+                window.fetch_data(shot_number)
+                wait(window)
+
+            runner.measure('piscope/%s/fetch/cold' % name, cycle, setup=mdsh.empty_lru_cache, group='gui',
+                           config=name)
+            runner.measure('piscope/%s/fetch/cached' % name, cycle, group='gui', config=name)
+            runner.measure('piscope/%s/handle_mdsplus_data' % name, lambda: window.handle_mdsplus_data(window.data),
+                           group='gui', config=name)
+        finally:
+            if window.prefetcher is not None:
+                window.prefetcher.stop()
+            window.close()
+            window.deleteLater()
+            app.processEvents()
+
+
+def git_commit():
+    """
+    Returns:
+        str: commit the benchmarks ran on, None outside of a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Lists the benchmarks whose median got slower than threshold times the one in baseline
+
+    Args:
+        results (list): results of this run
+        baseline (list): results of an earlier run
+        threshold (float): allowed ratio of medians
+
+    Returns:
+        list: (name, baseline median, median) of every regression
+    """
+    before = dict((result['name'], result) for result in baseline if 'median' in result)
+    regressions = []
+    for result in results:
+        old = before.get(result['name'], None)
+        if old is None or 'median' not in result or old['median'] <= 0:
+            continue
+        ratio = result['median'] / old['median']
+        if ratio > threshold:
+            regressions.append((result['name'], old['median'], result['median']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PiScope against a local stand-in for the MDSplus server.")
+    parser.add_argument("--configs", type=str, default=os.path.join("Configs", "*.ini"),
+                        help="Glob of the configuration files to benchmark")
+    parser.add_argument("--only", type=str, nargs='+', default=list(groups), choices=groups,
+                        help="Benchmarks to run")
+    parser.add_argument("--shot", type=int, default=12345, help="Shot number to fetch")
+    parser.add_argument("--points", type=int, default=100000, help="Number of points in every signal")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Transfer rate in MB/s, 0 for no limit")
+    parser.add_argument("--server-concurrency", type=int, default=8,
+                        help="Requests the server handles at once, 0 for no limit")
+    parser.add_argument("--downsampling", type=int, default=10000, help="Number of points displayed per signal")
+    parser.add_argument("--repeat", "-r", type=int, default=5, help="Timed runs of every benchmark")
+    parser.add_argument("--output", "-o", type=str, default=None,
+                        help="JSON file to write, default benchmarks/results/results-<time>.json")
+    parser.add_argument("--compare", type=str, default=None, help="JSON file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown of the median against --compare counted as a regression")
+    parser.add_argument("--logging", "-L", type=str, default=None, help="Log file name for debug logging")
+    args = parser.parse_args()
+
+    if args.logging:
+        logger = create_logger(name='pi-scope-logger', filename=args.logging, useNull=False)
+    else:
+        logger = create_logger(name='pi-scope-logger', useNull=True)
+
+    server = FakeServer(n_points=args.points, latency=args.latency, bandwidth=args.bandwidth * 1024**2 or None,
+                        concurrency=args.server_concurrency, current_shot=args.shot)
+    mdsh.connection_pool.connection_factory = server.connect
+    mdsh.connection_pool.clear()
+    runner = BenchmarkRunner(server, repeat=args.repeat)
+
+    filenames = sorted(glob.glob(args.configs))
+    if not filenames:
+        parser.error("no configuration files match %s" % args.configs)
+
+    for filename in filenames:
+        try:
+            name, config, mds_server, tree, col_setup, locs = load_config(filename)
+        except Exception as e:
+            print("Skipping %s: %s" % (filename, e))
+            continue
+
+        mdsh.configure_from_setup(config['setup'])
+        if 'retrieve' in args.only:
+            bench_retrieve(runner, name, mds_server, tree, locs, args.shot)
+
+        if 'downsample' in args.only or 'plot' in args.only:
+            data = mdsh.retrieve_all_data(mds_server, tree, args.shot, locs)
+            if 'downsample' in args.only:
+                bench_downsample(runner, name, col_setup, locs, data, args.downsampling)
+            if 'plot' in args.only:
+                bench_plot(runner, name, col_setup, locs, data, args.downsampling)
+
+    if 'gui' in args.only:
+        bench_gui(runner, filenames, args.shot, args.downsampling)
+
+    output = args.output
+    if output is None:
+        output = os.path.join('benchmarks', 'results',
+                              'results-%s.json' % datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+
+    meta = dict(date=datetime.datetime.now().isoformat(), commit=git_commit(), python=platform.python_version(),
+                platform=platform.platform(), numpy=np.__version__, matplotlib=matplotlib.__version__,
+                points=args.points, latency=args.latency, bandwidth=args.bandwidth,
+                server_concurrency=args.server_concurrency, downsampling=args.downsampling, repeat=args.repeat,
+                shot=args.shot, configs=filenames)
+    with open(output, 'w') as f:
+        json.dump(dict(meta=meta, results=runner.results), f, indent=2)
+    print("Results written to %s" % output)
+
+    failed = [result['name'] for result in runner.results if 'error' in result]
+    if failed:
+        print("%d benchmarks failed" % len(failed))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(runner.results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print("Regression %-60s %9.4f s -> %9.4f s (x%.2f)" % (name, before, after, after / before))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s" % args.compare)
+
+    sys.exit(1 if failed else 0)
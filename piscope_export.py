@@ -0,0 +1,58 @@
+from __future__ import print_function, division
+import argparse
+import os.path as path
+import sys
+from source.batch import export
+from source.config import parser as config_parser
+from source.data import mdsplus_helpers
+from source.logging.piscope_logging import create_logger
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export PiScope plots or signals for many shots without the GUI.")
+    parser.add_argument("shots", type=str, nargs='+',
+                        help="Shots to export, e.g. 1200-1250 1300,1302 (0 for the current shot)")
+    parser.add_argument("--config", "-c", type=str, required=True, help="Config File to Load.")
+    parser.add_argument("--output", "-o", type=str, default=".", help="Directory to write the files to")
+    parser.add_argument("--format", "-f", type=str, default="png", choices=export.formats,
+                        help="Image format, or npz for the raw arrays")
+    parser.add_argument("--processes", "-p", type=int, default=4, help="Number of shots exported at once")
+    parser.add_argument("--points", type=int, default=10000, help="Number of points drawn per signal")
+    parser.add_argument("--size", type=float, nargs=2, default=(16.0, 9.0), metavar=("WIDTH", "HEIGHT"),
+                        help="Figure size in inches")
+    parser.add_argument("--dpi", type=int, default=100, help="Resolution of png images")
+    parser.add_argument("--logging", "-L", type=str, default=None,
+                        help="Log file name for debug logging")
+    parser.add_argument("--disk-cache", "-d", type=str, default=None,
+                        help="Directory for caching past shots on disk between sessions")
+    parser.add_argument("--disk-cache-size", type=float, default=10 * 1024,
+                        help="Size cap in MB for the disk cache")
+    args = parser.parse_args()
+
+    if args.logging:
+        logger = create_logger(name='pi-scope-logger', filename=args.logging, useNull=False)
+    else:
+        logger = create_logger(name='pi-scope-logger', useNull=True)
+
+    config, server, tree, _, col_setup, locs = config_parser.config_parser(args.config)
+    setup = dict(config['setup'])
+    if args.disk_cache:
+        # every process opens the same cache directory
+        setup['disk_cache'] = args.disk_cache
+        setup['disk_cache_size'] = args.disk_cache_size
+    batch = mdsplus_helpers.configure_from_setup(setup)
+
+    prefix = path.splitext(path.basename(args.config))[0]
+    exporter = export.Exporter(server, tree, col_setup, locs, output=args.output, prefix=prefix, fmt=args.format,
+                               batch=batch, downsampling=args.points, size=tuple(args.size), dpi=args.dpi)
+    shots = config_parser.parse_shots(args.shots)
+
+    failed = 0
+    for result in export.export_shots(exporter, shots, setup=setup, processes=args.processes):
+        if result.filename is not None:
+            print("Shot %d: %s" % (result.shot_number, result.filename))
+        else:
+            failed += 1
+            print("Shot %d: failed %s" % (result.shot_number, result.error or "(could not open the tree)"))
+
+    print("Exported %d of %d shots" % (len(shots) - failed, len(shots)))
+    sys.exit(1 if failed else 0)
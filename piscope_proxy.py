@@ -0,0 +1,37 @@
+from __future__ import print_function, division
+import argparse
+from source.data import proxy
+from source.logging.piscope_logging import create_logger
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a caching proxy that PiScopes fetch MDSplus data through.")
+    parser.add_argument("--host", type=str, default="localhost",
+                        help="Interface to listen on, 0.0.0.0 for every machine on the network (needs --authkey)")
+    parser.add_argument("--port", "-p", type=int, default=proxy.default_port, help="Port to listen on")
+    parser.add_argument("--authkey", "-k", type=str, default=proxy.default_authkey.decode(),
+                        help="Key the PiScopes have to present, see proxy_authkey in the README.  Required to listen "
+                             "on anything but localhost")
+    parser.add_argument("--cache-size", type=float, default=2 * 1024, help="Memory budget in MB for cached signals")
+    parser.add_argument("--connections", type=int, default=8, help="Most connections open to the MDSplus servers")
+    parser.add_argument("--logging", "-L", type=str, default=None,
+                        help="Log file name for debug logging")
+    args = parser.parse_args()
+
+    if args.logging:
+        logger = create_logger(name='pi-scope-logger', filename=args.logging, useNull=False)
+    else:
+        logger = create_logger(name='pi-scope-logger', useNull=True)
+
+    try:
+        server = proxy.ProxyServer((args.host, args.port), authkey=args.authkey.encode(),
+                                   cache_bytes=args.cache_size * 1024**2, connections=args.connections)
+    except ValueError as e:
+        parser.error(str(e))
+    print("PiScope proxy listening on %s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(server.info())
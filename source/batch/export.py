@@ -0,0 +1,199 @@
+from __future__ import division, print_function
+import matplotlib
+# no display is needed, and the Qt backend would need an application
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from ..data import mdsplus_helpers as mdsh
+from ..plotting import data_plotter
+from ..logging.piscope_logging import log, time_log
+from collections import namedtuple
+import concurrent.futures
+import logging
+import numpy as np
+import os
+"""
+Module export
+=============
+Defines one class, Exporter, and the helpers to run it over many shots.
+An Exporter renders the subplots of a PiScope configuration for one shot into an
+image file, or dumps the signals into an .npz file, without a GUI.  export_shots
+runs an Exporter over a list of shots in several processes, each of which fetches
+its shots with retrieve_all_data like the GUI does.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+formats = ('png', 'pdf', 'svg', 'npz')
+
+ExportResult = namedtuple('ExportResult', ['shot_number', 'filename', 'error'])
+
+
+class Exporter(object):
+    """
+    Fetches the signals of a configuration for a shot and writes them to a file
+
+    The figure is laid out, decimated and labeled the same way as in the GUI, and lines
+    of windowed subplots are refined to the limits of the subplot before saving.  With
+    the npz format the full resolution arrays are written instead, as '<subplot>/<signal>/time'
+    and '<subplot>/<signal>/data'.
+
+    Exporters only hold plain values so they can be sent to the worker processes.
+
+    Example::
+
+        from source.config.parser import config_parser
+        from source.batch.export import Exporter
+        config, server, tree, _, col_setup, locs = config_parser('Configs/discharge.ini')
+        exporter = Exporter(server, tree, col_setup, locs, output='plots', prefix='discharge')
+        filename = exporter.export(12345)  # plots/discharge_12345.png
+
+    Attributes:
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        col_setup (list): number of subplots in each column
+        locs (dict): subplot locations mapped to their signal configurations
+        output (str): directory to write to
+        prefix (str): start of the file names, followed by the shot number
+        fmt (str): one of formats
+        batch (str): batch mode for retrieve_all_data
+        downsampling (int): number of points to draw per signal
+        size (tuple): figure size in inches
+        dpi (int): resolution of raster images
+    """
+
+    def __init__(self, server, tree, col_setup, locs, output='.', prefix='piscope', fmt='png', batch=None,
+                 downsampling=10000, size=(16.0, 9.0), dpi=100):
+        if fmt not in formats:
+            raise ValueError("fmt must be one of %s, not %r" % (formats, fmt))
+
+        self.server = server
+        self.tree = tree
+        self.col_setup = col_setup
+        self.locs = locs
+        self.output = output
+        self.prefix = prefix
+        self.fmt = fmt
+        self.batch = batch
+        self.downsampling = downsampling
+        self.size = size
+        self.dpi = dpi
+
+    def filename(self, shot_number):
+        """
+        Returns:
+            str: path of the file written for shot_number
+        """
+        return os.path.join(self.output, '%s_%d.%s' % (self.prefix, shot_number, self.fmt))
+
+    @time_log(logger)
+    def export(self, shot_number):
+        """
+        Fetches the signals of shot_number and writes them to a file
+
+        Args:
+            shot_number (int): shot to export, 0 for the current shot
+
+        Returns:
+            str: name of the file written, None if the tree could not be opened
+        """
+        result = mdsh.fetch_shot(self.server, self.tree, shot_number, self.locs, batch=self.batch)
+        if result.data is None:
+            logger.warning("Could not open shot %d for export" % shot_number)
+            return None
+
+        filename = self.filename(result.shot_number)
+        if self.fmt == 'npz':
+            self.save_arrays(filename, result.data)
+        else:
+            self.save_figure(filename, result.shot_number, result.data)
+        return filename
+
+    def save_figure(self, filename, shot_number, data):
+        """
+        Plots data like the GUI would and saves the figure
+
+        Args:
+            filename (str): file to write, the format follows from the extension
+            shot_number (int): shot number for the title
+            data (dict): subplot locations mapped to lists of Data, from retrieve_all_data
+        """
+        figure, axs, _ = data_plotter.create_figure(self.col_setup)
+        try:
+            figure.set_size_inches(*self.size)
+            down_samplers = data_plotter.plot_all_data(axs, self.locs, data, downsampling=self.downsampling)
+            for down_sampler in down_samplers:
+                if down_sampler is None:
+                    continue
+                # the lines are decimated for their full range, redo it for the limits from the config
+                xstart, xend = down_sampler.ax.get_xlim()
+                down_sampler.apply(down_sampler.generation, down_sampler.decimate(xstart, xend))
+
+            figure.suptitle("Shot {0:d}".format(shot_number))
+            figure.tight_layout(rect=(0, 0, 1, 0.96))
+            figure.savefig(filename, dpi=self.dpi)
+        finally:
+            # create_figure always asks pyplot for the same figure
+            plt.close(figure)
+
+    def save_arrays(self, filename, data):
+        """
+        Saves the time and data arrays of every signal into one .npz file
+
+        Args:
+            filename (str): file to write
+            data (dict): subplot locations mapped to lists of Data, from retrieve_all_data
+        """
+        arrays = dict()
+        for loc, signals in data.items():
+            for d in signals:
+                if d is None:
+                    continue
+                arrays['%s/%s/time' % (loc, d.name)] = d.time
+                arrays['%s/%s/data' % (loc, d.name)] = d.data
+        np.savez(filename, **arrays)
+
+
+def _init_worker(setup):
+    # runs once in every worker process
+    mdsh.configure_from_setup(setup)
+
+
+def _export(exporter, shot_number):
+    try:
+        return ExportResult(shot_number, exporter.export(shot_number), None)
+    except Exception as e:
+        logger.exception("Export of shot %d failed" % shot_number)
+        return ExportResult(shot_number, None, "%s: %s" % (type(e).__name__, e))
+
+
+@log(logger)
+def export_shots(exporter, shots, setup=None, processes=4):
+    """
+    Exports every shot in shots, several at a time in separate processes
+
+    Each process fetches one shot at a time with its own connections and retrieval
+    workers, so plotting one shot overlaps with fetching the others.
+
+    Args:
+        exporter (Exporter): exporter to run
+        shots (list): shot numbers
+        setup (dict, optional): setup section of the configuration, applied in every process
+        processes (int): number of processes, 1 exports in this process
+
+    Yields:
+        ExportResult: (shot number, file written or None, error message or None) in order of completion
+    """
+    if not os.path.isdir(exporter.output):
+        os.makedirs(exporter.output)
+
+    if processes <= 1:
+        _init_worker(setup or dict())
+        for shot_number in shots:
+            yield _export(exporter, shot_number)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                                initargs=(setup or dict(),)) as pool:
+        futures = [pool.submit(_export, exporter, shot_number) for shot_number in shots]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
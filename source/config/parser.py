@@ -6,6 +6,10 @@ default_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
                   '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                   '#bcbd22', '#17becf']
 
+# keys in a subplot section that are settings, everything else is a signal
+subplot_options = ['legend', 'xlabel', 'ylabel', 'xlim', 'ylim', 'color', 'noresample', 'xshare', 'resample',
+                   'window', 'decimate']
+
 
 def config_parser(filename):
     print(filename)
@@ -39,6 +43,30 @@ def config_parser(filename):
     return config, server, tree, event_name, col_setup, data_locs
 
 
+def parse_shots(specs):
+    """
+    Turns shot specifications like '1200-1250' or '1300,1302' into a sorted list of shot numbers
+
+    Args:
+        specs (iterable): strings of comma separated shot numbers and inclusive ranges
+
+    Returns:
+        list: shot numbers without duplicates
+    """
+    shots = set()
+    for spec in specs:
+        for item in str(spec).split(','):
+            item = item.strip()
+            if not item:
+                continue
+            if '-' in item.lstrip('-'):
+                start, end = (int(x) for x in item.split('-', 1))
+                shots.update(range(min(start, end), max(start, end) + 1))
+            else:
+                shots.add(int(item))
+    return sorted(shots)
+
+
 def get_data_locs(config):
     data_locs = {}
     for key in config.keys():
@@ -61,11 +89,10 @@ def parse_data_colors(config, key):
     local_config = config[key]
     keys = [x for x in local_config.keys()]
     keys.sort()
-    top_ignore = ['xlabel', 'ylabel', 'xlim', 'ylim', 'legend', 'noresample', 'xshare']
     j = 0
     #print(keys)
     for k in keys:
-        if k not in top_ignore:
+        if k not in subplot_options:
             # this is a signal
             # time to check if it has a color picked already
             if 'color' not in local_config[k].keys():
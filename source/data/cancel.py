@@ -0,0 +1,51 @@
+from __future__ import division, print_function
+import threading
+"""
+Module cancel
+=============
+Defines one class, CancelToken.
+A CancelToken is handed to a fetch so that whoever started it can tell it to stop.
+The fetch checks the token between steps, cancels its pending requests and returns
+early once the token is cancelled.
+"""
+
+
+class CancelToken(object):
+    """
+    Thread-safe flag that tells a running fetch to give up
+
+    >>> from source.data.cancel import CancelToken
+    >>> token = CancelToken()
+    >>> token.cancel()
+    >>> print(token.is_set())
+    True
+
+    It can be passed wherever a threading.Event is expected to be set for cancellation.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """
+        Marks the fetch as cancelled
+        """
+        self._event.set()
+
+    def is_set(self):
+        """
+        Returns:
+            bool: True once cancel has been called
+        """
+        return self._event.is_set()
+
+    cancelled = property(is_set)
+
+    def wait(self, timeout=None):
+        """
+        Waits up to timeout seconds for the token to be cancelled
+
+        Returns:
+            bool: True if the token is cancelled
+        """
+        return self._event.wait(timeout)
@@ -0,0 +1,241 @@
+from __future__ import division, print_function
+import MDSplus as mds
+from ..logging.metrics import metrics, CONNECT, OPEN_TREE
+import threading
+import logging
+import time
+from contextlib import contextmanager
+"""
+Module connection_pool
+======================
+Defines one class, ConnectionPool.
+A ConnectionPool hands out open MDSplus connections keyed by (server, tree, shot)
+so that the workers fetching signals for a shot reuse connections instead of
+connecting and opening the tree once per signal.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of open MDSplus connections
+
+    A connection is only ever used by one thread at a time.  It is checked out with
+    :meth:`connection` and handed back when the with block exits.  Connections that
+    raise an MdsIpException are thrown away instead of being returned to the pool,
+    other errors (e.g. a tree that can't be opened) leave the connection in it.
+
+    Example::
+
+        from source.data.connection_pool import ConnectionPool
+        pool = ConnectionPool(max_size=4)
+        with pool.connection('skywalker.physics.wisc.edu', 'wipal', 12345) as con:
+            shot = con.get('$SHOT')
+
+    Attributes:
+        max_size (int): Maximum number of connections open at once
+        health_check_interval (float): Idle time in seconds after which a connection is
+            pinged before it is reused
+    """
+
+    def __init__(self, max_size=8, health_check_interval=30.0, connection_factory=None):
+        """
+        Args:
+            max_size (int): maximum number of open connections
+            health_check_interval (float): seconds of idle time before a connection is pinged
+            connection_factory (callable, optional): called with the server address to
+                create a new connection, defaults to MDSplus.Connection
+        """
+        self.max_size = max(int(max_size), 1)
+        self.health_check_interval = health_check_interval
+        self.connection_factory = connection_factory
+        self._idle = []  # list of (key, connection, last_used) with the most recently used last
+        self._n_open = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def connection(self, server, tree, shot_number):
+        """
+        Context manager that checks out a connection with tree opened at shot_number
+
+        Args:
+            server (str): MDSplus server address
+            tree (str): MDSplus tree name
+            shot_number (int): shot number to open
+
+        Yields:
+            an MDSplus.Connection with the tree already opened
+        """
+        key = (server, tree, shot_number)
+        con = self.acquire(key)
+        try:
+            yield con
+        except mds.MdsIpException:
+            self.discard(con)
+            raise
+        except BaseException:
+            self.release(key, con)
+            raise
+        else:
+            self.release(key, con)
+
+    def acquire(self, key):
+        """
+        Checks out a connection for key, blocking if max_size connections are in use
+
+        Args:
+            key (tuple): (server, tree, shot_number)
+
+        Returns:
+            an MDSplus.Connection with the tree already opened
+
+        If opening the tree fails with anything but an MdsIpException, the connection goes back
+        into the pool without a tree open and the error is raised.
+        """
+        server, tree, shot_number = key
+        with self._cond:
+            while True:
+                entry = self._pop_idle(lambda k: k == key)
+                if entry is not None:
+                    break
+
+                # Reopening the tree on an idle connection to the same server is cheaper than connecting
+                entry = self._pop_idle(lambda k: k[0] == server)
+                if entry is not None:
+                    break
+
+                if self._n_open < self.max_size:
+                    self._n_open += 1
+                    break
+
+                entry = self._pop_idle(lambda k: True)
+                if entry is not None:
+                    break
+
+                self._cond.wait()
+
+        con = None
+        try:
+            if entry is not None:
+                old_key, con, last_used = entry
+                if old_key[0] != server:
+                    self._close(con)
+                    con = None
+                elif old_key == key and shot_number != 0:
+                    # shot 0 is reopened every time so that it follows the current shot
+                    if time.time() - last_used <= self.health_check_interval or self._healthy(con):
+                        return con
+                    logger.debug("Stale connection to %s, reconnecting" % server)
+                    self._close(con)
+                    con = None
+
+            if con is None:
+                factory = self.connection_factory or mds.Connection
+                with metrics.timer(CONNECT):
+                    con = factory(server)
+            with metrics.timer(OPEN_TREE):
+                con.openTree(tree, shot_number)
+            return con
+        except mds.MdsIpException:
+            if con is not None:
+                self._close(con)
+            self._forget()
+            raise
+        except Exception:
+            if con is None:
+                self._forget()
+            else:
+                # a tree error (e.g. a shot that doesn't exist yet), the connection itself is fine
+                self.release((server, None, None), con)
+            raise
+        except BaseException:
+            if con is not None:
+                self._close(con)
+            self._forget()
+            raise
+
+    def release(self, key, con):
+        """
+        Returns a healthy connection to the pool
+
+        Args:
+            key (tuple): (server, tree, shot_number) that con currently has open
+            con (MDSplus.Connection): connection to return
+        """
+        with self._cond:
+            if self._n_open > self.max_size:
+                # pool was shrunk while this connection was checked out
+                self._n_open -= 1
+                self._close(con)
+            else:
+                self._idle.append((key, con, time.time()))
+            self._cond.notify()
+
+    def discard(self, con):
+        """
+        Closes a broken connection and frees its slot in the pool
+
+        Args:
+            con (MDSplus.Connection): connection to throw away
+        """
+        self._close(con)
+        self._forget()
+
+    def resize(self, max_size):
+        """
+        Changes the maximum number of open connections, closing idle ones if needed
+
+        Args:
+            max_size (int): new maximum number of open connections
+        """
+        with self._cond:
+            self.max_size = max(int(max_size), 1)
+            while self._n_open > self.max_size and self._idle:
+                _, con, _ = self._idle.pop(0)
+                self._close(con)
+                self._n_open -= 1
+            self._cond.notify_all()
+
+    def clear(self):
+        """
+        Closes all idle connections
+        """
+        with self._cond:
+            n_idle = len(self._idle)
+            for _, con, _ in self._idle:
+                self._close(con)
+            self._n_open -= n_idle
+            self._idle = []
+            self._cond.notify_all()
+        logger.debug("Closed %d idle connections" % n_idle)
+
+    def _pop_idle(self, match):
+        # search from the most recently used end of the list
+        for idx in range(len(self._idle) - 1, -1, -1):
+            if match(self._idle[idx][0]):
+                return self._idle.pop(idx)
+        return None
+
+    def _forget(self):
+        with self._cond:
+            self._n_open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _healthy(con):
+        try:
+            con.get('1')
+            return True
+        except mds.MdsIpException:
+            return False
+
+    @staticmethod
+    def _close(con):
+        disconnect = getattr(con, 'disconnect', None)
+        if disconnect is None:
+            return
+        try:
+            disconnect()
+        except mds.MdsIpException:
+            pass
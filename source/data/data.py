@@ -1,5 +1,8 @@
 from __future__ import division, print_function
 import numpy as np
+from .pyramid import MinMaxPyramid
+import os
+import tempfile
 """
 Module Data
 ==============
@@ -9,6 +12,15 @@ for plotting purposes
 """
 
 
+def _readonly(array):
+    """
+    Returns a read-only view of array without copying it (lists and tuples are converted)
+    """
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
 class Data:
     """
     Class for holding time series data
@@ -23,10 +35,21 @@ class Data:
     >>> print(bool(data_signal))
     True
 
+    Arrays are not copied.  Data keeps read-only views of the arrays it is given, so
+    the same buffers (including np.memmap files) can be shared between Data objects,
+    caches and plots.
+
+    Signals fetched only in part (see mdsplus_helpers.windowed_config) carry the part that
+    was fetched in window, and a refine callable that fetches another part of the same record.
+
     Attributes:
         name (str): Name of the signal
         color (str): Color of signal when plotted
+        window (ServerWindow): (start, end, step) fetched from the server, None for the whole record
+        refine (callable): refine(start, end, step) fetches Data for another window, None if not possible
     """
+    # records shorter than this are cheap enough to scan and don't get a pyramid
+    pyramid_min_length = 65536
 
     def __init__(self, name, time, data, color):
         """
@@ -36,28 +59,139 @@ class Data:
             data (iterable): data signal
             color (str): color to plot with
         """
-        self._time = np.array(time)
-        self._data = np.array(data)
+        self._time = _readonly(time)
+        self._data = _readonly(data)
+        self._monotonic = None
+        self._pyramid = None
         self.name = name
         self.color = color
+        self.window = None
+        self.refine = None
+
+    @classmethod
+    def from_npy(cls, name, time_file, data_file, color):
+        """
+        Creates Data backed by memory mapped .npy files, nothing is read until it is used
+
+        Args:
+            name (str): Name of signal
+            time_file (str): .npy file with the time signal
+            data_file (str): .npy file with the data signal
+            color (str): color to plot with
+
+        Returns:
+            Data
+        """
+        return cls(name, np.load(time_file, mmap_mode='r'), np.load(data_file, mmap_mode='r'), color)
+
+    def relabel(self, name, color):
+        """
+        Returns a new Data with a different name and color that shares this one's arrays
+
+        Args:
+            name (str): Name of signal
+            color (str): color to plot with
+
+        Returns:
+            Data
+        """
+        data = Data(name, self._time, self._data, color)
+        data._monotonic = self._monotonic
+        data._pyramid = self._pyramid
+        data.window = self.window
+        data.refine = self.refine
+        return data
+
+    def to_memmap(self, directory=None):
+        """
+        Moves the arrays into memory mapped files so they don't have to stay resident
+
+        The files are unlinked once mapped where the OS allows it, so they disappear
+        when the returned Data is garbage collected.
+
+        Args:
+            directory (str, optional): directory for the files, defaults to the system temp directory
+
+        Returns:
+            Data backed by np.memmap arrays
+        """
+        filenames = []
+        for array in (self._time, self._data):
+            fd, filename = tempfile.mkstemp(suffix='.npy', prefix='piscope-', dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            filenames.append(filename)
+
+        data = Data.from_npy(self.name, filenames[0], filenames[1], self.color)
+
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except OSError:
+                # e.g. Windows won't remove a mapped file, leave it for the temp directory cleanup
+                pass
+
+        return data
 
     @property
     def time(self):
-        """np.ndarray: time array"""
+        """np.ndarray: read-only time array"""
         return self._time
 
     @time.setter
     def time(self, val):
-        self._time = np.array(val)
+        self._time = _readonly(val)
+        self._monotonic = None
+        self._pyramid = None
 
     @property
     def data(self):
-        """np.ndarray: data array"""
+        """np.ndarray: read-only data array"""
         return self._data
 
     @data.setter
     def data(self, val):
-        self._data = np.array(val)
+        self._data = _readonly(val)
+        self._pyramid = None
+
+    @property
+    def monotonic(self):
+        """bool: True if the time array never decreases, checked once and remembered"""
+        if self._monotonic is None:
+            self._monotonic = bool(self._time.ndim == 1 and np.all(self._time[1:] >= self._time[:-1]))
+        return self._monotonic
+
+    @property
+    def pyramid(self):
+        """MinMaxPyramid: min/max pyramid for fast decimation, None for short or unsorted signals"""
+        if self._pyramid is None:
+            self.build_pyramid()
+        return self._pyramid or None
+
+    def build_pyramid(self):
+        """
+        Builds the min/max pyramid used for decimating zoomed views of long signals
+
+        Call this right after retrieval (e.g. in a worker thread) so it isn't built on the first zoom.
+
+        Returns:
+            MinMaxPyramid or None if the signal is short, unsorted or time and data don't match
+        """
+        if self._pyramid is None:
+            if (len(self._time) >= self.pyramid_min_length and len(self._time) == len(self._data)
+                    and self._data.ndim == 1 and self.monotonic):
+                self._pyramid = MinMaxPyramid(self._time, self._data)
+            else:
+                self._pyramid = False  # remember that there is no pyramid
+        return self._pyramid or None
+
+    @property
+    def nbytes(self):
+        """int: bytes held by the time and data arrays and the pyramid if it has been built"""
+        nbytes = self._time.nbytes + self._data.nbytes
+        if self._pyramid:
+            nbytes += self._pyramid.nbytes
+        return nbytes
 
     def __repr__(self):
         if self._time is None or self._data is None:
@@ -0,0 +1,187 @@
+from __future__ import division, print_function
+import numpy as np
+from .data import Data
+import hashlib
+import logging
+import os
+import threading
+"""
+Module disk_cache
+=================
+Defines one class, DiskCache.
+A DiskCache keeps retrieved signals on local disk as pairs of .npy files so that
+past shots can be reopened in a later PiScope session without asking the MDSplus
+server for them again.  Files are memory mapped when read back.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+
+class DiskCache(object):
+    """
+    On-disk cache of signal arrays shared between PiScope sessions
+
+    Every entry is stored as <digest>.time.npy and <digest>.data.npy in directory, where
+    digest is a hash of the cache key.  The modification time of the files is bumped
+    on every read and the least recently used entries are deleted once the directory
+    grows past max_bytes.  The size of the directory is read once and then kept up to
+    date as entries are written, so it is only scanned again when it goes over the cap.
+
+    >>> import numpy as np
+    >>> from source.data.data import Data
+    >>> from source.data.disk_cache import DiskCache
+    >>> cache = DiskCache('/tmp/piscope-cache', max_bytes=1024**3)
+    >>> key = ('skywalker.physics.wisc.edu', 'wipal', 12345, 'dim_of(x)', 'x')
+    >>> cache.put(key, Data('My Signal', np.arange(10.0), np.arange(10.0), 'red'))
+    >>> print(len(cache.get(key, 'My Signal', 'red')))
+    10
+
+    Attributes:
+        directory (str): directory holding the cache files
+        max_bytes (int): size cap for the cache directory
+        nbytes (int): size of the cache files, not counting what other sessions wrote since the last scan
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024**3):
+        """
+        Args:
+            directory (str): directory for the cache files, created if it does not exist
+            max_bytes (int): size cap in bytes
+        """
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.nbytes = sum(size for size, _ in self._scan().values())
+
+    def get(self, key, name, color):
+        """
+        Loads the signal stored under key
+
+        Args:
+            key (tuple): cache key
+            name (str): name to give the returned Data
+            color (str): color to give the returned Data
+
+        Returns:
+            Data backed by memory mapped files, or None if key is not cached
+        """
+        time_file, data_file = self._filenames(key)
+        try:
+            data = Data.from_npy(name, time_file, data_file, color)
+        except (IOError, OSError, ValueError):
+            # missing, half written by another session or corrupt
+            return None
+
+        for filename in (time_file, data_file):
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+
+        return data
+
+    def put(self, key, data):
+        """
+        Stores the arrays of data under key and removes old entries if over the size cap
+
+        Args:
+            key (tuple): cache key
+            data (Data): signal to store
+        """
+        if data is None or data.time.dtype.hasobject or data.data.dtype.hasobject:
+            return
+
+        if data.nbytes > self.max_bytes:
+            return
+
+        suffix = '.%d.%d.tmp' % (os.getpid(), threading.current_thread().ident)
+        added = 0
+        try:
+            for filename, array in zip(self._filenames(key), (data.time, data.data)):
+                replaced = _size(filename)
+                # write then rename so that other sessions never read a partial file
+                with open(filename + suffix, 'wb') as f:
+                    np.save(f, array, allow_pickle=False)
+                    written = f.tell()
+                os.replace(filename + suffix, filename)
+                added += written - replaced
+        except (IOError, OSError) as e:
+            logger.warning('Unable to write to the disk cache: %s' % e)
+            return
+
+        with self._lock:
+            self.nbytes += added
+            over = self.nbytes > self.max_bytes
+        if over:
+            self.cleanup()
+
+    def cleanup(self):
+        """
+        Deletes the least recently used entries until the cache is under 90% of max_bytes
+
+        The headroom keeps a full cache from being scanned again on every write.
+        """
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for size, _ in entries.values())
+            self.nbytes = total
+            if total <= self.max_bytes:
+                return
+
+            for digest, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+                for kind in ('time', 'data'):
+                    try:
+                        os.remove(os.path.join(self.directory, '%s.%s.npy' % (digest, kind)))
+                    except OSError:
+                        pass
+                total -= size
+                if total <= 0.9 * self.max_bytes:
+                    break
+            self.nbytes = total
+
+        logger.debug("Disk cache trimmed to %d bytes" % total)
+
+    def clear(self):
+        """
+        Deletes every entry in the cache
+        """
+        with self._lock:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.npy'):
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass
+            self.nbytes = 0
+
+    def _scan(self):
+        """
+        Returns:
+            dict: digest of every entry mapped to (bytes, last modification time)
+        """
+        entries = dict()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            digest = filename.split('.')[0]
+            size, mtime = entries.get(digest, (0, 0))
+            entries[digest] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        return entries
+
+    def _filenames(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return (os.path.join(self.directory, digest + '.time.npy'),
+                os.path.join(self.directory, digest + '.data.npy'))
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
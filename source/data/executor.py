@@ -0,0 +1,178 @@
+from __future__ import division, print_function
+from collections import deque
+import concurrent.futures
+import logging
+import threading
+import time
+"""
+Module executor
+===============
+Defines one class, AdaptiveExecutor.
+An AdaptiveExecutor is a long-lived thread pool for MDSplus requests that changes
+how many of them it runs at once based on how the server is coping.  It starts
+with a few concurrent requests, adds more while latency stays flat, and backs off
+when latency climbs or the server starts failing requests.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+
+class AdaptiveExecutor(object):
+    """
+    Thread pool whose concurrency limit follows the latency and errors of the tasks it runs
+
+    Latency is averaged over rounds of about limit tasks and compared to the best round
+    seen so far (which is slowly forgotten).  The limit is then adjusted additive-increase/
+    multiplicative-decrease style:
+
+    - a round whose latency stays within latency_tolerance times the best one raises the
+      limit by one, since more requests at once are getting through without queueing
+    - a slower round means requests queue up on the server, and lowers the limit by a quarter
+    - a reported error halves the limit, at most once per round so that one burst of
+      failed requests only counts once
+
+    The limit never goes below min_workers or above max_workers.  Tasks over the limit wait
+    in a queue and can be cancelled from there.
+
+    >>> from source.data.executor import AdaptiveExecutor
+    >>> executor = AdaptiveExecutor(max_workers=8)
+    >>> future = executor.submit(pow, 2, 10)
+    >>> print(future.result())
+    1024
+
+    Attributes:
+        max_workers (int): most tasks run at once
+        min_workers (int): fewest tasks run at once, however bad the server gets
+        limit (float): current number of tasks allowed to run at once
+        latency_tolerance (float): short/long-term latency ratio treated as the server slowing down
+    """
+
+    def __init__(self, max_workers=8, min_workers=1, initial_workers=2, latency_tolerance=2.0):
+        """
+        Args:
+            max_workers (int): upper bound on concurrent tasks
+            min_workers (int): lower bound on concurrent tasks
+            initial_workers (int): concurrent tasks before anything has been measured
+            latency_tolerance (float): short/long-term latency ratio that causes a back off
+        """
+        self.max_workers = max(int(max_workers), 1)
+        self.min_workers = min(max(int(min_workers), 1), self.max_workers)
+        self.limit = float(min(max(initial_workers, self.min_workers), self.max_workers))
+        self.latency_tolerance = latency_tolerance
+        self._best_latency = None
+        self._round = []  # latencies of the tasks finished in this round
+        self._last_backoff = 0.0
+        self._active = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) to run once the concurrency limit allows it
+
+        Returns:
+            concurrent.futures.Future: future of the call, cancellable until it starts
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._queue.append((future, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def report_error(self):
+        """
+        Tells the executor that the server failed a request because of load, halving the limit
+        """
+        with self._lock:
+            self._backoff(0.5, 'server error')
+
+    def resize(self, max_workers):
+        """
+        Changes the upper bound on concurrent tasks
+
+        Args:
+            max_workers (int): new upper bound
+        """
+        with self._lock:
+            self.max_workers = max(int(max_workers), 1)
+            self.min_workers = min(self.min_workers, self.max_workers)
+            self.limit = min(self.limit, self.max_workers)
+            old_threads = self._threads
+            self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        # tasks already running on the old threads finish there
+        old_threads.shutdown(wait=False)
+        self._dispatch()
+
+    def shutdown(self, wait=True):
+        """
+        Cancels the queued tasks and stops the threads
+
+        Args:
+            wait (bool): wait for the running tasks to finish
+        """
+        with self._lock:
+            queue = list(self._queue)
+            self._queue.clear()
+        for future, _, _, _ in queue:
+            future.cancel()
+        self._threads.shutdown(wait=wait)
+
+    @property
+    def active(self):
+        """int: number of tasks running right now"""
+        with self._lock:
+            return self._active
+
+    def _dispatch(self):
+        with self._lock:
+            while self._queue and self._active < int(self.limit):
+                future, fn, args, kwargs = self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    # cancelled while it was queued
+                    continue
+                self._active += 1
+                self._threads.submit(self._run, future, fn, args, kwargs)
+
+    def _run(self, future, fn, args, kwargs):
+        start = time.time()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._measure(time.time() - start)
+            self._dispatch()
+
+    def _measure(self, latency):
+        # called with the lock held
+        self._round.append(latency)
+        if len(self._round) < max(int(self.limit), 2):
+            return
+
+        mean = sum(self._round) / len(self._round)
+        self._round = []
+        if self._best_latency is None or mean < self._best_latency:
+            self._best_latency = mean
+        else:
+            # forget the best round slowly, the server or the signals may have changed
+            self._best_latency *= 1.02
+
+        if mean > self.latency_tolerance * self._best_latency:
+            self._backoff(0.75, 'latency %.3f s against %.3f s' % (mean, self._best_latency))
+        else:
+            self.limit = min(self.limit + 1.0, self.max_workers)
+
+    def _backoff(self, factor, reason):
+        # called with the lock held
+        now = time.time()
+        if now - self._last_backoff < (self._best_latency or 0.0):
+            return
+        self._last_backoff = now
+        self._round = []
+        self.limit = max(self.limit * factor, self.min_workers)
+        logger.debug("Backing off to %d concurrent requests (%s)" % (int(self.limit), reason))
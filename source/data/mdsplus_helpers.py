@@ -1,17 +1,266 @@
 from __future__ import division, print_function
 import MDSplus as mds
 from .data import Data
+from .connection_pool import ConnectionPool
+from .timebase import TimebaseRegistry
+from .signal_cache import SignalCache
+from .disk_cache import DiskCache
+from .executor import AdaptiveExecutor
+from .proxy import ProxyConnection, default_authkey
 from ..logging.piscope_logging import log, time_log
+from ..logging.metrics import metrics, SHOT, SIGNAL, BATCH, GET, CONVERT, BYTES, REQUESTS
+from ..logging.tracing import tracer
+from ..config.parser import subplot_options, default_colors
+from collections import namedtuple
 import logging
-from functools import lru_cache
 import concurrent.futures
+import functools
+import re
+import threading
+import time
 
 logger = logging.getLogger('pi-scope-logger')
 
-ignore_items = ['legend', 'xlabel', 'ylabel', 'xlim', 'ylim', 'color', 'noresample', 'xshare']
+ignore_items = subplot_options
 
+# Shared by all of the retrieval workers, see configure_connection_pool
+connection_pool = ConnectionPool(max_size=8)
+
+# host:port of the caching proxy the connections go through, None to connect to the servers directly
+proxy_address = None
+
+# Runs the signal requests of every fetch, see configure_executor
+executor = AdaptiveExecutor(max_workers=8)
+
+# Number of times a signal fetch is retried on a fresh connection after an MdsIpException
+connection_retries = 1
+
+# Largest number of signals packed into one GetMany request when batching the whole config
+max_batch_size = 64
+
+# Retrieved signals, bounded by the bytes held, see configure_signal_cache
+signal_cache = SignalCache(max_bytes=2 * 1024**3, negative_ttl=30.0)
+
+# Optional cache on local disk shared between sessions, see configure_disk_cache
+disk_cache = None
+
+# Newest shot seen on each server and tree, (server, tree) -> (shot number, time.time() it was read).
+# Only shots before it are written to the disk cache, see _is_final
+current_shots = dict()
+current_shot_ttl = 60.0
+_current_shot_refresh = threading.Lock()
+
+# Records at least this many bytes are moved into memory mapped files, see configure_memmap
+memmap_threshold = None
+memmap_directory = None
+
+# Identical time bases (e.g. signals from the same digitizer) share one array
+timebases = TimebaseRegistry()
+
+# Seconds to wait for the tree to open before giving up on a fetch, see probe_shot
+probe_timeout = 10.0
+
+# Runs the tree probes so they can be waited on with a timeout
+_probe_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+FetchResult = namedtuple('FetchResult', ['shot_number', 'data'])
+
+# Part of a record to fetch: the points between start and end (None for open ends), every step-th
+ServerWindow = namedtuple('ServerWindow', ['start', 'end', 'step'])
+
+_dim_of_pattern = re.compile(r'^\s*dim_of\s*\(\s*(.+?)\s*\)\s*$', re.IGNORECASE)
+
+
+@time_log(logger)
+@metrics.timed(SHOT)
+def fetch_shot(server, tree, shot_number, config, progress_signal=None, batch=None, partial_signal=None,
+               timeout=None, cancel=None):
+    """
+    Opens the tree for shot_number and then retrieves every signal in config
+
+    Meant to run in a worker thread so that neither a slow server nor the tree check hold up
+    the GUI.  The tree is opened on a pooled connection that then goes on to retrieve the data.
+
+    Args:
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        shot_number (int): shot number to retrieve, 0 for the current shot
+        config (dict): subplot locations mapped to their signal configurations
+        progress_signal (QtCore.pyqtSignal, optional): see retrieve_all_data
+        batch (str, optional): see retrieve_all_data
+        partial_signal (QtCore.pyqtSignal, optional): see retrieve_all_data
+        timeout (float, optional): seconds to wait for the tree to open, probe_timeout by default
+        cancel (CancelToken, optional): cancel to give up on the fetch
+
+    Returns:
+        FetchResult: shot_number is the shot that was opened (the current shot for 0) and data is the
+            dictionary from retrieve_all_data, or None if the tree could not be opened
+    """
+    opened_shot = probe_shot(server, tree, shot_number, timeout=timeout, cancel=cancel)
+    if opened_shot is None or (cancel is not None and cancel.is_set()):
+        return FetchResult(shot_number, None)
+
+    # shot 0 is retrieved by its number so the signals can't straddle two shots, and can be cached
+    data = retrieve_all_data(server, tree, opened_shot, config, progress_signal=progress_signal, batch=batch,
+                             partial_signal=partial_signal, cancel=cancel)
+    if cancel is not None and cancel.is_set():
+        return FetchResult(opened_shot, None)
+    return FetchResult(opened_shot, data)
+
+
+@time_log(logger)
+@metrics.timed(SHOT)
+def fetch_shots(server, tree, shot_numbers, config, progress_signal=None, batch=None, partial_signal=None,
+                timeout=None, cancel=None):
+    """
+    Like fetch_shot for the first shot in shot_numbers, with the signals of the other shots overlaid
+
+    The trees are opened and the shots retrieved side by side, so all of their signals share
+    the retrieval executor.  Signals that are cached are not fetched again, and shots that
+    turn out to be the same (e.g. 0 and the current shot) are only retrieved once.  The
+    signals of the overlaid shots are renamed and recolored with overlay_data.
+
+    Args:
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        shot_numbers (list): shot to show followed by the shots to overlay on it, 0 for the current shot
+        config (dict): subplot locations mapped to their signal configurations
+        progress_signal (QtCore.pyqtSignal, optional): emitted with the percent of all signals retrieved
+        batch (str, optional): see retrieve_all_data
+        partial_signal (QtCore.pyqtSignal, optional): see retrieve_all_data
+        timeout (float, optional): seconds to wait for each tree to open, probe_timeout by default
+        cancel (CancelToken, optional): cancel to give up on the fetch
+
+    Returns:
+        FetchResult: shot_number is the shot opened for shot_numbers[0] and data has the signals of every shot
+            that could be opened, or is None if the first shot could not be opened
+    """
+    shot_numbers = list(shot_numbers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shot_numbers)) as pool:
+        probe = metrics.carry(lambda shot_number: probe_shot(server, tree, shot_number, timeout=timeout, cancel=cancel))
+        opened = list(pool.map(probe, shot_numbers))
+        if opened[0] is None or (cancel is not None and cancel.is_set()):
+            return FetchResult(shot_numbers[0], None)
+
+        shots = []
+        for shot_number in opened:
+            if shot_number is not None and shot_number not in shots:
+                shots.append(shot_number)
+
+        progress = _CombinedProgress(progress_signal, len(shots))
+        futures = [pool.submit(metrics.carry(retrieve_all_data), server, tree, shot_number, config,
+                               progress_signal=progress.part(idx), batch=batch,
+                               partial_signal=_OverlaySignal(partial_signal, shot_number, idx), cancel=cancel)
+                   for idx, shot_number in enumerate(shots)]
+        results = [future.result() for future in futures]
+
+    if cancel is not None and cancel.is_set():
+        return FetchResult(opened[0], None)
+
+    data = results[0]
+    for idx, (shot_number, overlay) in enumerate(zip(shots[1:], results[1:])):
+        for loc, signals in overlay.items():
+            data[loc].extend(overlay_data(d, shot_number, idx + 1) for d in signals)
+    return FetchResult(opened[0], data)
+
+
+def overlay_data(data, shot_number, index):
+    """
+    Returns the Data of an overlaid shot renamed after its shot and recolored so it stands out
+
+    Args:
+        data (Data): signal, None is passed through
+        shot_number (int): shot the signal is from
+        index (int): position of the shot among the overlaid shots, 0 for the shot that is not overlaid
+
+    Returns:
+        Data or None
+    """
+    if data is None or index == 0:
+        return data
+
+    if data.color in default_colors:
+        color = default_colors[(default_colors.index(data.color) + index) % len(default_colors)]
+    else:
+        color = default_colors[index % len(default_colors)]
+    return data.relabel("%s (%d)" % (data.name, shot_number), color)
+
+
+class _OverlaySignal(object):
+    """
+    Stands in for the partial_signal of retrieve_all_data and passes on the signals of an overlaid shot
+    """
+    def __init__(self, signal, shot_number, index):
+        self.signal = signal
+        self.shot_number = shot_number
+        self.index = index
+
+    def emit(self, item):
+        if self.signal is not None:
+            loc, data = item
+            self.signal.emit((loc, overlay_data(data, self.shot_number, self.index)))
+
+
+class _CombinedProgress(object):
+    """
+    Turns the progress of several retrievals running side by side into one percentage
+    """
+    def __init__(self, signal, n_parts):
+        self.signal = signal
+        self.values = [0] * n_parts
+        self.lock = threading.Lock()
+
+    def part(self, idx):
+        return _ProgressPart(self, idx)
+
+    def emit_part(self, idx, value):
+        if self.signal is None:
+            return
+        with self.lock:
+            self.values[idx] = value
+            total = sum(self.values) // len(self.values)
+        self.signal.emit(int(total))
+
+
+class _ProgressPart(object):
+    def __init__(self, combined, idx):
+        self.combined = combined
+        self.idx = idx
+
+    def emit(self, value):
+        self.combined.emit_part(self.idx, value)
+
+
+def retrieve_all_data(server, tree, shot_number, config, progress_signal=None, batch=None, partial_signal=None,
+                      cancel=None):
+    """
+    Retrieves every signal in config for shot_number using a pool of worker threads
+
+    Subplots with a window or decimate option only get part of each record, see windowed_config.
+
+    Args:
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        shot_number (int): shot number to retrieve
+        config (dict): subplot locations mapped to their signal configurations
+        progress_signal (QtCore.pyqtSignal, optional): emitted with the percent of signals retrieved
+        batch (str, optional): None to fetch every signal separately, 'subplot' to fetch each subplot
+            with one request or 'config' to pack the whole config into as few requests as possible
+        partial_signal (QtCore.pyqtSignal, optional): emitted with (subplot location, Data or None) as soon
+            as each signal is retrieved so it can be plotted before the rest arrive
+        cancel (CancelToken, optional): once it is cancelled, signals that haven't been requested yet are
+            dropped and nothing more is emitted
+
+    Returns:
+        dict: subplot locations mapped to lists of Data (None for signals that could not be retrieved),
+            missing the signals that were dropped if the fetch was cancelled
+    """
+    if batch:
+        return retrieve_all_data_batched(server, tree, shot_number, config, progress_signal=progress_signal,
+                                         batch=batch, partial_signal=partial_signal, cancel=cancel)
+
+    config = windowed_config(config)
 
-def retrieve_all_data(server, tree, shot_number, config, progress_signal=None):
     signals_to_grab = []
     data = dict()
 
@@ -24,26 +273,291 @@ def retrieve_all_data(server, tree, shot_number, config, progress_signal=None):
 
     n_items = len(signals_to_grab)
     n = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        future_to_signal = {executor.submit(retrieve_signal, shot_number, config[x][y], x, y, server, tree): (x, y)
-                            for (x, y) in signals_to_grab}
+    future_to_signal = dict()
+    for (x, y) in signals_to_grab:
+        # cached signals don't need a worker, and would throw off the latency measured by the executor
+        hit, cached = cached_signal(shot_number, config[x][y], y, server, tree)
+        if not hit:
+            future = executor.submit(metrics.carry(_fetch_new_signal), shot_number, server, tree, config[x][y], y)
+            future_to_signal[future] = (x, y)
+            continue
+
+        data[x].append(cached)
+        if partial_signal:
+            partial_signal.emit((x, cached))
+        n += 1
+        if progress_signal:
+            progress_signal.emit(int(n / n_items * 100.0))
+
+    for future in _as_completed(future_to_signal, cancel):
+        subplot, name = future_to_signal[future]
+        data[subplot].append(future.result())
+        if partial_signal:
+            partial_signal.emit((subplot, data[subplot][-1]))
+        n += 1
+        if progress_signal:
+            progress_signal.emit(int(n / n_items * 100.0))
+
+    return data
+
+
+def _as_completed(futures, cancel=None):
+    """
+    Yields futures as they complete like concurrent.futures.as_completed, until cancel is set
+
+    Once cancel is set the futures that haven't started are cancelled and nothing more is yielded.
+    Requests already sent are left to finish in the background.
+    """
+    pending = set(futures)
+    while pending:
+        if cancel is None:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        else:
+            # wake up now and then to check for cancellation
+            done, pending = concurrent.futures.wait(pending, timeout=0.1,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if cancel is not None and cancel.is_set():
+                break
+            yield future
+
+        if cancel is not None and cancel.is_set():
+            for future in pending:
+                future.cancel()
+            return
+
+
+def retrieve_all_data_batched(server, tree, shot_number, config, progress_signal=None, batch='subplot',
+                              partial_signal=None, cancel=None):
+    """
+    Retrieves every signal in config with a few GetMany requests instead of two requests per signal
+
+    See retrieve_all_data for the arguments.
+    """
+    config = windowed_config(config)
+    data = dict((subplot_name, list()) for subplot_name in config)
+
+    # Only the signals that aren't cached are fetched
+    missing = dict()
+    for subplot_name, subplot in config.items():
+        missing[subplot_name] = dict()
+        for signal_name in subplot:
+            if signal_name in ignore_items:
+                continue
+            hit, cached = cached_signal(shot_number, subplot[signal_name], signal_name, server, tree)
+            if hit:
+                data[subplot_name].append(cached)
+                if partial_signal:
+                    partial_signal.emit((subplot_name, cached))
+            else:
+                missing[subplot_name][signal_name] = subplot[signal_name]
+
+    groups = group_signals(missing, batch)
+    n_items = sum(len(group) for group in groups)
+    n = 0
+    fetch = metrics.carry(retrieve_batch)
+    futures = [executor.submit(fetch, shot_number, group, server, tree) for group in groups]
 
-        for future in concurrent.futures.as_completed(future_to_signal):
-            subplot, name = future_to_signal[future]
-            data[subplot].append(future.result())
+    for future in _as_completed(futures, cancel):
+        for subplot, item in future.result():
+            data[subplot].append(item)
+            if partial_signal:
+                partial_signal.emit((subplot, item))
             n += 1
-            if progress_signal:
-                progress_signal.emit(int(n / n_items * 100.0))
+        if progress_signal:
+            progress_signal.emit(int(n / n_items * 100.0))
 
     return data
 
 
+def group_signals(config, batch):
+    """
+    Splits the signals in config into groups that are fetched with one request each
+
+    Args:
+        config (dict): subplot locations mapped to their signal configurations
+        batch (str): 'subplot' for one group per subplot, 'config' for groups of up to max_batch_size signals,
+            which keep the signals of a subplot together if they fit in one group
+
+    Returns:
+        list: lists of (subplot location, signal name, signal info) tuples
+    """
+    if batch not in ('subplot', 'config'):
+        raise ValueError("batch must be 'subplot' or 'config', not %r" % batch)
+
+    groups = []
+    for subplot_name, subplot in config.items():
+        signals = [(subplot_name, signal_name, subplot[signal_name])
+                   for signal_name in subplot if signal_name not in ignore_items]
+        if not signals:
+            continue
+        if batch == 'subplot':
+            groups.append(signals)
+        elif groups and len(groups[-1]) + len(signals) <= max_batch_size:
+            groups[-1].extend(signals)
+        else:
+            # a subplot with more than max_batch_size signals is split across groups
+            groups.extend(signals[idx:idx + max_batch_size] for idx in range(0, len(signals), max_batch_size))
+
+    return groups
+
+
+def configure_signal_cache(max_bytes):
+    """
+    Sets the memory budget of the signal cache
+
+    Args:
+        max_bytes (int): memory budget in bytes
+    """
+    signal_cache.resize(max_bytes)
+    logger.debug("Signal cache budget set to %d bytes" % signal_cache.max_bytes)
+
+
+def configure_disk_cache(directory, max_bytes=10 * 1024**3):
+    """
+    Turns on the on-disk signal cache shared between PiScope sessions
+
+    Args:
+        directory (str): directory for the cache files, None turns the disk cache off
+        max_bytes (int): size cap in bytes for the cache directory
+    """
+    global disk_cache
+    if directory is None:
+        disk_cache = None
+        logger.debug("Disk cache turned off")
+    else:
+        disk_cache = DiskCache(directory, max_bytes=max_bytes)
+        logger.debug("Disk cache in %s with a %d byte cap" % (disk_cache.directory, disk_cache.max_bytes))
+
+
+def configure_memmap(threshold, directory=None):
+    """
+    Sets the size above which retrieved records are kept in memory mapped files instead of in memory
+
+    Args:
+        threshold (int): size in bytes, None keeps every record in memory
+        directory (str, optional): directory for the files, defaults to the system temp directory
+    """
+    global memmap_threshold, memmap_directory
+    memmap_threshold = threshold
+    memmap_directory = directory
+
+
+def configure_executor(max_workers):
+    """
+    Sets the most signal requests that are sent to the server at once
+
+    The executor starts below this and only goes up to it while the server keeps up.
+
+    Args:
+        max_workers (int): upper bound on concurrent requests
+    """
+    executor.resize(max_workers)
+    logger.debug("Retrieval executor limited to %d workers" % executor.max_workers)
+
+
+def configure_connection_pool(max_size):
+    """
+    Sets the maximum number of MDSplus connections shared by the retrieval workers
+
+    Args:
+        max_size (int): maximum number of open connections
+    """
+    connection_pool.resize(max_size)
+    logger.debug("Connection pool size set to %d" % connection_pool.max_size)
+
+
+def configure_proxy(address, authkey=None):
+    """
+    Sends every MDSplus request through a caching proxy (see source.data.proxy) instead of to the server
+
+    Args:
+        address (str): host:port of the proxy, None to connect to the servers directly
+        authkey (str, optional): key the proxy was started with, if not the default
+    """
+    global proxy_address
+    proxy_address = address
+    if address is None:
+        connection_pool.connection_factory = None
+        logger.debug("Connecting to the MDSplus servers directly")
+    else:
+        authkey = authkey.encode() if authkey else default_authkey
+        connection_pool.connection_factory = functools.partial(ProxyConnection, address, authkey=authkey)
+        logger.debug("Connecting to the MDSplus servers through the proxy at %s" % address)
+    # connections opened before go to the wrong place
+    connection_pool.clear()
+
+
+def configure_from_setup(setup):
+    """
+    Applies the retrieval settings in the [setup] section of a configuration file
+
+    See the Performance Settings in the README for the keys.
+
+    Args:
+        setup (dict): setup section of a configuration
+
+    Returns:
+        str: batch mode to pass to retrieve_all_data, None to fetch signals one at a time
+    """
+    if 'connections' in setup:
+        configure_connection_pool(int(setup['connections']))
+
+    if 'workers' in setup:
+        configure_executor(int(setup['workers']))
+
+    if 'cache_size' in setup:
+        configure_signal_cache(float(setup['cache_size']) * 1024**2)
+
+    if 'disk_cache' in setup:
+        disk_cache_size = float(setup.get('disk_cache_size', 10 * 1024))
+        configure_disk_cache(setup['disk_cache'], max_bytes=disk_cache_size * 1024**2)
+
+    if 'memmap_threshold' in setup:
+        configure_memmap(float(setup['memmap_threshold']) * 1024**2)
+
+    # only touched when it changes, so a connection factory set elsewhere (e.g. the benchmarks) stays
+    if setup.get('proxy', None) != proxy_address:
+        configure_proxy(setup.get('proxy', None), setup.get('proxy_authkey', None))
+
+    batch = setup.get('batch', None)
+    if batch not in (None, 'subplot', 'config'):
+        logger.warning("Unknown batch mode %s, fetching signals one at a time" % batch)
+        batch = None
+    return batch
+
+
+def _note_current_shot(server, tree, shot_number):
+    current_shots[(server, tree)] = (shot_number, time.time())
+
+
+def _is_final(shot_number, server, tree):
+    """
+    Checks whether the server has moved on past shot_number, so that its data won't change any more
+
+    The current shot is still being written, so signals fetched from it may be missing or partial.
+    The newest shot seen is read again when it is older than current_shot_ttl and would make
+    shot_number the current shot, by one thread at a time.
+    """
+    entry = current_shots.get((server, tree), None)
+    if entry is not None and shot_number < entry[0]:
+        return True
+
+    if (entry is None or time.time() - entry[1] > current_shot_ttl) and _current_shot_refresh.acquire(False):
+        try:
+            get_current_shot(server, tree)
+        finally:
+            _current_shot_refresh.release()
+        entry = current_shots.get((server, tree), None)
+    return entry is not None and shot_number < entry[0]
+
+
 @log(logger)
 def get_current_shot(server, tree):
     try:
-        con = mds.Connection(server)
-        con.openTree(tree, 0)
-        current_shot = int(con.get("$SHOT"))
+        with connection_pool.connection(server, tree, 0) as con:
+            current_shot = int(con.get("$SHOT"))
+        _note_current_shot(server, tree, current_shot)
         return current_shot
     except mds.mdsExceptions.TreeNOCURRENT as e:
         logger.warning('TreeNOCURRENT in get_current_shot')
@@ -67,18 +581,87 @@ def check_data_dictionary(data_dict):
     return False
 
 
+def probe_shot(server, tree, shot_number, timeout=None, cancel=None):
+    """
+    Checks that the tree can be opened for shot_number without waiting longer than timeout
+
+    The tree is opened on a pooled connection, which is then ready for the signal retrieval.
+    For shot 0 the current shot number is read on the same connection.
+
+    Args:
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        shot_number (int): shot number to open, 0 for the current shot
+        timeout (float, optional): seconds to wait, probe_timeout by default
+        cancel (CancelToken, optional): stop waiting once it is cancelled
+
+    Returns:
+        int: shot number that was opened, None if the tree can't be opened in time
+    """
+    if timeout is None:
+        timeout = probe_timeout
+
+    future = _probe_executor.submit(metrics.carry(_open_shot), server, tree, shot_number)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            # wake up now and then to check for cancellation
+            return future.result(timeout=max(min(deadline - time.time(), 0.1), 0.0))
+        except concurrent.futures.TimeoutError:
+            if cancel is not None and cancel.is_set():
+                logger.debug('Opening shot %d was cancelled' % shot_number)
+                return
+            if time.time() >= deadline:
+                # the connection stays with the probe thread until the server answers
+                logger.warning('Timed out opening shot %d after %.1f s' % (shot_number, timeout))
+                return
+
+
+@tracer.traced('open_shot', 'fetch')
+def _open_shot(server, tree, shot_number):
+    key = (server, tree, shot_number)
+    try:
+        con = connection_pool.acquire(key)
+    except (mds.MdsIpException, mds.TreeFOPENR, mds.TdiMISS_ARG, mds.mdsExceptions.TreeNOCURRENT) as e:
+        logger.warning('Error opening shot %d' % shot_number)
+        return
+
+    opened_shot = shot_number
+    try:
+        if shot_number == 0:
+            try:
+                opened_shot = int(con.get("$SHOT"))
+                _note_current_shot(server, tree, opened_shot)
+            except (mds.mdsExceptions.TreeNOCURRENT, mds.TdiMISS_ARG, ValueError):
+                logger.warning('Unable to read the current shot number')
+    except mds.MdsIpException:
+        connection_pool.discard(con)
+        logger.warning('Error opening shot %d' % shot_number)
+        return
+    except BaseException:
+        connection_pool.release(key, con)
+        raise
+
+    # The tree stays open at the shot 0 resolved to, so the connection goes back into the pool under that
+    # number, ready for the signal retrieval of fetch_shot
+    connection_pool.release((server, tree, opened_shot), con)
+    return opened_shot
+
+
 @log(logger)
+@tracer.traced('check_open_tree', 'fetch')
 def check_open_tree(shot_number, server, tree):
     try:
-        con = mds.Connection(server)
-        con.openTree(tree, shot_number)
-        return True
+        # The connection goes back into the pool ready for the signal retrieval
+        with connection_pool.connection(server, tree, shot_number):
+            return True
     except (mds.MdsIpException, mds.TreeFOPENR, mds.TdiMISS_ARG) as e:
         logger.warning('Error opening shot %d' % shot_number)
         return False
 
 
 @log(logger)
+@tracer.traced('retrieve_signal', 'fetch')
 def retrieve_signal(shot_number, signal_info, loc_name, signal_name, server, tree):
     xstring = signal_info['x']
     ystring = signal_info['y']
@@ -92,68 +675,504 @@ def retrieve_signal(shot_number, signal_info, loc_name, signal_name, server, tre
     # return loc_name, signal_name, data
 
 
-@lru_cache(maxsize=512)
+def cached_signal(shot_number, signal_info, signal_name, server, tree):
+    """
+    Looks up a signal in the signal cache without fetching it
+
+    Args:
+        shot_number (int): shot number
+        signal_info (dict): signal configuration with x, y and color
+        signal_name (str): name of the signal
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+
+    Returns:
+        tuple: (True, Data or None) if the signal is cached, (False, None) otherwise
+    """
+    key = _cache_key(shot_number, server, tree, signal_info['x'], signal_info['y'])
+    hit, cached = signal_cache.get(key)
+    if hit and cached is not None:
+        cached = cached.relabel(signal_name, signal_info['color'])
+    elif not hit and disk_cache is not None and shot_number > 0:
+        cached = disk_cache.get(key, signal_name, signal_info['color'])
+        if cached is not None:
+            hit = True
+            cached.build_pyramid()
+            signal_cache.put(key, cached)
+    return hit, _refinable(cached, shot_number, server, tree, signal_info)
+
+
+def _cache_key(shot_number, server, tree, xstring, ystring):
+    # name and color are only for display, recoloring a signal shouldn't refetch it
+    return server, tree, shot_number, _clean_expression(xstring), _clean_expression(ystring)
+
+
+def _store_signal(shot_number, server, tree, xstring, ystring, data):
+    """
+    Caches a retrieved signal and returns the Data to hand out, memory mapped if it is very long
+    """
+    key = _cache_key(shot_number, server, tree, xstring, ystring)
+
+    # past shots don't change, so they can be kept on disk for later sessions.  The current shot may still be
+    # being written, its signals are only kept in memory
+    persist = (disk_cache is not None and shot_number > 0 and data is not None
+               and _is_final(shot_number, server, tree))
+    if persist:
+        disk_cache.put(key, data)
+
+    if data is not None and memmap_threshold is not None and data.nbytes >= memmap_threshold:
+        # very long records are served from files instead of staying resident
+        mapped = disk_cache.get(key, data.name, data.color) if persist else None
+        data = mapped if mapped is not None else data.to_memmap(memmap_directory)
+
+    if data is not None:
+        # built here in the worker thread instead of on the first zoom
+        data.build_pyramid()
+
+    # shot 0 is whichever shot is current on the server, so it can't be cached
+    if shot_number != 0:
+        signal_cache.put(key, data)
+
+    return data
+
+
+def warm_cache(shot_number, signal_info, signal_name, server, tree):
+    """
+    Fetches a signal into the signal cache (and disk cache) unless it is already there
+
+    Unlike retrieve_signal, a failed retrieval is not cached, since the shot may still be
+    being written and the signal should be fetched normally once it is asked for.  Errors
+    are not reported to the executor either, so background fetches don't slow down the
+    foreground ones.
+
+    Args:
+        shot_number (int): shot number, must not be 0
+        signal_info (dict): signal configuration with x, y and color
+        signal_name (str): name of the signal
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+
+    Returns:
+        bool: True if the signal is in the cache now
+    """
+    hit, cached = cached_signal(shot_number, signal_info, signal_name, server, tree)
+    if hit:
+        return cached is not None
+
+    ystring = signal_info['y']
+    if isinstance(ystring, list):
+        ystring = ','.join(ystring)
+    data = _fetch_signal(shot_number, server, tree, signal_info['x'], ystring, signal_name, signal_info['color'],
+                         report_errors=False)
+    if data is None:
+        return False
+
+    _store_signal(shot_number, server, tree, signal_info['x'], ystring, data)
+    return True
+
+
 def _retrieve_signal(shot_number, server, tree, xstring, ystring, name, color):
-    try:
-        con = mds.Connection(server)
-        con.openTree(tree, shot_number)
-        logger.debug("Retrieving data for %s" % name)
-        data = retrieve_data(con, xstring, ystring, name, color)
-        return data
+    signal_info = {'x': xstring, 'y': ystring, 'color': color}
+    hit, cached = cached_signal(shot_number, signal_info, name, server, tree)
+    if hit:
+        return cached
 
-    except (mds.MdsIpException, mds.TreeFOPENR, mds.TdiMISS_ARG) as e:
-        logger.warning('Random MDSplus error in retrieve_signal')
-        return
+    return _fetch_new_signal(shot_number, server, tree, signal_info, name)
+
+
+def _fetch_new_signal(shot_number, server, tree, signal_info, name):
+    ystring = signal_info['y']
+    if isinstance(ystring, list):
+        ystring = ','.join(ystring)
+    data = _fetch_signal(shot_number, server, tree, signal_info['x'], ystring, name, signal_info['color'])
+    data = _store_signal(shot_number, server, tree, signal_info['x'], ystring, data)
+    return _refinable(data, shot_number, server, tree, signal_info)
+
+
+def _fetch_signal(shot_number, server, tree, xstring, ystring, name, color, report_errors=True):
+    # report_errors=False keeps background fetches (see warm_cache) from backing off the executor that the
+    # foreground fetches run on
+    for attempt in range(connection_retries + 1):
+        try:
+            with metrics.timer(SIGNAL, signal=name, shot=shot_number, attempt=attempt):
+                with connection_pool.connection(server, tree, shot_number) as con:
+                    logger.debug("Retrieving data for %s" % name)
+                    data = retrieve_data(con, xstring, ystring, name, color)
+            return data
+
+        except mds.MdsIpException as e:
+            # the broken connection was thrown away by the pool, try again on a new one
+            logger.warning('MdsIpException in retrieve_signal for %s (attempt %d)' % (name, attempt + 1))
+            if report_errors:
+                executor.report_error()
+        except (mds.TreeFOPENR, mds.TdiMISS_ARG) as e:
+            logger.warning('Random MDSplus error in retrieve_signal')
+            return
 
 
 def empty_lru_cache():
-    size_before_empty = _retrieve_signal.cache_info().currsize
-    _retrieve_signal.cache_clear()
-    logger.debug("Cache had %d items before clearing" % size_before_empty)
+    cache_info = signal_cache.info()
+    signal_cache.clear()
+    connection_pool.clear()
+    timebases.clear()
+    logger.debug("Cache had %d items (%d bytes) before clearing" % (cache_info.items, cache_info.nbytes))
 
 
 def log_lru_cache():
-    cache_info = _retrieve_signal.cache_info()
-    hits = cache_info.hits
-    misses = cache_info.misses
-    maxsize = cache_info.maxsize
-    currsize = cache_info.currsize
+    cache_info = signal_cache.info()
 
     logger.debug(
-        "Cache has %d hits, %d misses with %d items out of the maximum %d items" % (hits, misses, currsize, maxsize)
+        "Cache has %d hits, %d misses with %d items using %.1f MB out of the maximum %.1f MB" %
+        (cache_info.hits, cache_info.misses, cache_info.items, cache_info.nbytes / 1024**2,
+         cache_info.max_bytes / 1024**2)
     )
 
 
+@log(logger)
+def retrieve_batch(shot_number, signals, server, tree):
+    """
+    Retrieves a group of signals from one shot with a single GetMany request
+
+    Args:
+        shot_number (int): shot number to retrieve
+        signals (list): (subplot location, signal name, signal info) tuples
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+
+    Returns:
+        list: (subplot location, Data or None) for every signal
+    """
+    for attempt in range(connection_retries + 1):
+        try:
+            with metrics.timer(BATCH, signals=len(signals), shot=shot_number, attempt=attempt):
+                with connection_pool.connection(server, tree, shot_number) as con:
+                    logger.debug("Retrieving %d signals in one request" % len(signals))
+                    results = retrieve_many(con, signals)
+
+            return [(loc_name, _refinable(_store_signal(shot_number, server, tree, signal_info['x'],
+                                                        signal_info['y'], data),
+                                          shot_number, server, tree, signal_info))
+                    for (_, _, signal_info), (loc_name, data) in zip(signals, results)]
+
+        except mds.MdsIpException as e:
+            logger.warning('MdsIpException in retrieve_batch (attempt %d)' % (attempt + 1))
+            executor.report_error()
+        except (mds.TreeFOPENR, mds.TdiMISS_ARG) as e:
+            logger.warning('Random MDSplus error in retrieve_batch')
+            break
+
+    return [(loc_name, None) for (loc_name, _, _) in signals]
+
+
 @time_log(logger)
-def retrieve_data(connection, xstr, ystr, name, color):
-    try:
-        if "\n" in ystr:
-            ystring = ystr.splitlines()
-            ystring = " ".join(ystring)
+def retrieve_many(connection, signals):
+    """
+    Packs the x and y expressions of signals into one GetMany request and unpacks the results
+
+    Args:
+        connection (MDSplus.Connection): connection with the tree already opened
+        signals (list): (subplot location, signal name, signal info) tuples
+
+    Returns:
+        list: (subplot location, Data or None) for every signal
+    """
+    request = connection.getMany()
+    x_names = dict()
+    for idx, (_, _, signal_info) in enumerate(signals):
+        ystring = _clean_expression(signal_info['y'])
+        xstring = _clean_expression(signal_info['x'])
+        if is_dim_of(xstring, ystring):
+            # one record gives both the data and its dimension
+            request.append('y%d' % idx, '(_piscope_y = %s; make_signal(data(_piscope_y), *, dim_of(_piscope_y)))'
+                           % ystring)
         else:
-            ystring = ystr
+            request.append('y%d' % idx, ystring)
+            if xstring not in x_names:
+                x_names[xstring] = 'x%d' % len(x_names)
+                request.append(x_names[xstring], xstring)
+    _execute(request)
 
-        if "\n" in xstr:
-            xstring = xstr.splitlines()
-            xstring = " ".join(xstring)
+    values = []
+    dimensions = dict()
+    for idx, (loc_name, signal_name, signal_info) in enumerate(signals):
+        xstring = _clean_expression(signal_info['x'])
+        x_name = x_names.get(xstring)
+        error = request.error('y%d' % idx) or (x_name is not None and request.error(x_name))
+        if error:
+            logger.warning('Error in retrieve_many for %s: %s' % (signal_name, error))
+            values.append(None)
+            continue
+
+        data = request.get('y%d' % idx)
+        dim_name = None
+        if x_name is not None:
+            t = request.get(x_name)
+        elif isinstance(data, mds.Signal):
+            t = data.dim_of()
+            if not isinstance(t, mds.Array):
+                # dimension still references the tree (e.g. a digitizer clock), evaluate each one once
+                dim_name = dimensions.setdefault(str(t), 'd%d' % len(dimensions))
+        else:
+            t = None
+
+        if data is None or t is None:
+            values.append(None)
         else:
-            xstring = xstr
+            values.append((data, t, dim_name))
+
+    if dimensions:
+        request = connection.getMany()
+        for expression, dim_name in dimensions.items():
+            request.append(dim_name, 'data(%s)' % expression)
+        _execute(request)
+
+    with metrics.timer(CONVERT):
+        return _convert_many(request, signals, values)
+
+
+def _execute(request):
+    with metrics.timer(GET):
+        request.execute()
+    metrics.count(REQUESTS)
+
+
+def _convert_many(request, signals, values):
+    evaluated = dict()
+    results = []
+    for (loc_name, signal_name, signal_info), value in zip(signals, values):
+        if value is None:
+            results.append((loc_name, None))
+            continue
+
+        data, t, dim_name = value
+        if dim_name is None:
+            t = timebases.share(t.data())
+        elif request.error(dim_name):
+            logger.warning('Error in retrieve_many for the time base of %s: %s'
+                           % (signal_name, request.error(dim_name)))
+            results.append((loc_name, None))
+            continue
+        else:
+            if dim_name not in evaluated:
+                evaluated[dim_name] = timebases.share(request.get(dim_name).data())
+            t = evaluated[dim_name]
+
+        results.append((loc_name, Data(signal_name, t, data.data(), signal_info['color'])))
+        metrics.count(BYTES, results[-1][1].data.nbytes + t.nbytes)
+
+    return results
+
+
+def is_dim_of(xstring, ystring):
+    """
+    Checks if the x expression is just the dimension of the y expression, i.e. x = dim_of(y)
+
+    Args:
+        xstring (str): TDI expression for x
+        ystring (str): TDI expression for y
+
+    Returns:
+        bool: True if x is dim_of(y)
+    """
+    match = _dim_of_pattern.match(xstring)
+    if match is None:
+        return False
+
+    return match.group(1).replace(' ', '').lower() == ystring.replace(' ', '').lower()
+
+
+def subplot_window(subplot):
+    """
+    Reads the part of the records of a subplot that should be fetched from its options
+
+    window = True fetches the xlim range of the subplot, window = start, end any other time range.
+    decimate = n has the server send every n-th point.
+
+    Args:
+        subplot (dict): subplot configuration
+
+    Returns:
+        ServerWindow or None to fetch the whole records
+    """
+    start = end = None
+    window = subplot.get('window', None)
+    if isinstance(window, str) and window.strip().lower() in ('true', 'yes', 'on', '1'):
+        window = subplot.get('xlim', None)
+    if isinstance(window, (list, tuple)) and len(window) == 2:
+        start, end = sorted(float(value) for value in window)
+
+    step = max(int(subplot.get('decimate', 1)), 1)
+    if start is None and step == 1:
+        return None
+
+    return ServerWindow(start, end, step)
+
+
+def windowed_config(config):
+    """
+    Replaces the signals of subplots with a window or decimate option by requests for part of the record
+
+    The requested signals come back with their window set and can fetch more of the record
+    with refine, see Data.
+
+    Args:
+        config (dict): subplot locations mapped to their signal configurations
+
+    Returns:
+        dict: config with the signal configurations of windowed subplots replaced
+    """
+    windowed = dict()
+    for subplot_name, subplot in config.items():
+        window = subplot_window(subplot)
+        if window is None:
+            windowed[subplot_name] = subplot
+            continue
+
+        windowed[subplot_name] = dict((signal_name, signal_info if signal_name in ignore_items
+                                       else window_request(signal_info, window))
+                                      for signal_name, signal_info in subplot.items())
+    return windowed
+
+
+def window_request(signal_info, window):
+    """
+    Returns the configuration of a signal that is fetched only within window
+
+    The x and y expressions are combined into one expression that cuts the record down on
+    the server and returns it as a signal, so x and y come back with one request.  The
+    original configuration is kept under 'source'.
+
+    Args:
+        signal_info (dict): signal configuration with x, y and color
+        window (ServerWindow): part of the record to fetch
+
+    Returns:
+        dict: signal configuration
+    """
+    ystring = window_expression(signal_info['x'], signal_info['y'], window)
+    return {'x': 'dim_of(%s)' % ystring, 'y': ystring, 'color': signal_info['color'],
+            'window': window, 'source': signal_info}
+
+
+def window_expression(xstr, ystr, window):
+    """
+    Wraps x and y expressions into one TDI expression for the points of y within window
+
+    Args:
+        xstr (str): TDI expression for x
+        ystr (str): TDI expression for y
+        window (ServerWindow): part of the record to fetch
+
+    Returns:
+        str: TDI expression evaluating to a signal
+    """
+    ystring = _clean_expression(ystr)
+    xstring = _clean_expression(xstr)
+    if is_dim_of(xstring, ystring):
+        tstring = 'data(dim_of(_piscope_wy))'
+    else:
+        tstring = 'data(%s)' % xstring
+
+    mask = []
+    if window.start is not None:
+        mask.append('(_piscope_wt >= %s)' % _tdi_double(window.start))
+    if window.end is not None:
+        mask.append('(_piscope_wt <= %s)' % _tdi_double(window.end))
+    if window.step > 1:
+        mask.append('(mod(data(0 : size(_piscope_wt) - 1), %d) == 0)' % window.step)
+
+    return ('(_piscope_wy = %s; _piscope_wt = %s; _piscope_wm = %s; '
+            'make_signal(pack(data(_piscope_wy), _piscope_wm), *, pack(_piscope_wt, _piscope_wm)))'
+            % (ystring, tstring, ' && '.join(mask)))
+
+
+def _tdi_double(value):
+    """
+    Formats a float as a TDI double literal, plain literals are single precision
+    """
+    literal = repr(float(value))
+    if 'e' in literal:
+        return literal.replace('e', 'D')
+    return literal + 'D0'
+
+
+def refine_signal(shot_number, server, tree, signal_info, signal_name, start, end, step):
+    """
+    Fetches another window of a signal, used as Data.refine for windowed signals
+
+    Args:
+        shot_number (int): shot number
+        server (str): MDSplus server address
+        tree (str): MDSplus tree name
+        signal_info (dict): configuration of the whole signal
+        signal_name (str): name of the signal
+        start (float): start of the window, None for the start of the record
+        end (float): end of the window, None for the end of the record
+        step (int): keep every step-th point
+
+    Returns:
+        Data or None
+    """
+    request = window_request(signal_info, ServerWindow(start, end, max(int(step), 1)))
+    hit, cached = cached_signal(shot_number, request, signal_name, server, tree)
+    if hit:
+        return cached
+
+    logger.debug("Refining %s to %s" % (signal_name, request['window']))
+    return _fetch_new_signal(shot_number, server, tree, request, signal_name)
+
+
+def _refinable(data, shot_number, server, tree, signal_info):
+    """
+    Sets window and refine on Data retrieved for a windowed signal configuration
+    """
+    if data is not None and 'window' in signal_info:
+        data.window = signal_info['window']
+        data.refine = functools.partial(refine_signal, shot_number, server, tree, signal_info['source'],
+                                        data.name)
+    return data
+
+
+def _clean_expression(expression):
+    """
+    Joins multi-line (or list valued) TDI expressions from a config file into one line
+    """
+    if isinstance(expression, list):
+        expression = ','.join(expression)
+
+    if "\n" in expression:
+        expression = " ".join(expression.splitlines())
+
+    return expression
+
+
+@time_log(logger)
+def retrieve_data(connection, xstr, ystr, name, color):
+    try:
+        ystring = _clean_expression(ystr)
+        xstring = _clean_expression(xstr)
         print(ystring)
-        data = connection.get(ystring)
-        t = connection.get(xstring)
+        if is_dim_of(xstring, ystring):
+            # Fetch the record once and take the time base from its dimension
+            data = _get(connection, '(_piscope_y = %s; make_signal(data(_piscope_y), *, data(dim_of(_piscope_y))))'
+                        % ystring)
+            t = data.dim_of() if data is not None else None
+        else:
+            data = _get(connection, ystring)
+            t = _get(connection, xstring)
 
         # apparently you can get None without any errors
         if data is None or t is None:
             return None
 
-        data = data.data()
-        t = t.data()
+        with metrics.timer(CONVERT):
+            data = data.data()
+            t = timebases.share(t.data())
+        metrics.count(BYTES, data.nbytes + t.nbytes)
 
         return Data(name, t, data, color)
 
-    except mds.MdsIpException:
-        logger.warning('MdsIPException occurred in retrieve_data for %s' % name)
-        return
+    # MdsIpException is left for the caller so that the connection can be replaced
     except mds.TreeNODATA:
         logger.warning('TreeNODATA occurred in retrieve_data for %s' % name)
         return
@@ -163,3 +1182,10 @@ def retrieve_data(connection, xstr, ystr, name, color):
     except KeyError:
         logger.warning('KeyError occured in retrieve_data for %s' % name)
         return
+
+
+def _get(connection, expression):
+    with metrics.timer(GET):
+        value = connection.get(expression)
+    metrics.count(REQUESTS)
+    return value
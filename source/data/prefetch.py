@@ -0,0 +1,264 @@
+from __future__ import division, print_function
+from . import mdsplus_helpers as mdsh
+from ..config.parser import subplot_options
+from ..logging.metrics import metrics
+import logging
+import threading
+import time
+"""
+Module prefetch
+===============
+Defines one class, Prefetcher.
+A Prefetcher warms the signal cache with the shots around the one on display, and
+with the newest shot once it has settled on the server, so that stepping to them
+afterwards doesn't have to wait for the server.  It only works while no foreground
+fetch is running and fetches one signal at a time.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+
+class Prefetcher(threading.Thread):
+    """
+    Background thread that fetches neighbouring and new shots into the signal cache
+
+    The shots are fetched in order of how likely the user is to go to them next: the newest
+    shot first, then displayed shot + 1, displayed shot - 1, + 2, - 2 and so on up to depth.
+    Signals are fetched one at a time on a pooled connection with mdsh.warm_cache, so failed
+    signals of a shot that is still being written are not remembered.  The current shot on
+    the server moves on as soon as its tree is created, so it is only prefetched once it has
+    been current for settle seconds, and tried again every poll interval until all of it is
+    there.  A shot the server has moved past is done even if some signals are missing, and
+    any other incomplete shot is tried again after a delay that doubles up to max_retry_delay.
+
+    The thread waits while paused, which PiScope does for the duration of every foreground
+    fetch, and checks between signals so it never holds up a foreground fetch for more than
+    one request.
+
+    Example::
+
+        from source.data.prefetch import Prefetcher
+        prefetcher = Prefetcher(depth=2)
+        prefetcher.start()
+        prefetcher.configure('skywalker.physics.wisc.edu', 'wipal', config)
+        prefetcher.center(12345)  # starts fetching 12346, 12344, 12347 and 12343
+        ...
+        prefetcher.stop()
+
+    Attributes:
+        depth (int): number of shots prefetched on either side of the displayed shot
+        poll_interval (float): seconds between checks of the current shot, None to not check
+        settle (float): seconds the current shot has to stay current before it is prefetched
+        max_retry_delay (float): longest wait in seconds before an incomplete shot is tried again
+    """
+    max_retry_delay = 600.0
+
+    def __init__(self, depth=2, poll_interval=5.0, settle=30.0):
+        """
+        Args:
+            depth (int): number of shots to prefetch on either side of the displayed shot
+            poll_interval (float, optional): seconds between checks of the current shot on the server
+            settle (float): seconds the current shot has to stay current before it is prefetched
+        """
+        super(Prefetcher, self).__init__(name='piscope-prefetch')
+        self.daemon = True
+        self.depth = max(int(depth), 0)
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopped = threading.Event()
+        self._setup = None  # (server, tree, config)
+        self._shot = None  # displayed shot
+        self._current = None  # (current shot on the server, time.time() it was first seen)
+        self._newest = None  # newest shot on the server that has settled
+        self._done = set()  # shots that are fully cached for the current setup
+        self._not_before = dict()  # shot -> time to try again, for shots that aren't (fully) there yet
+        self._attempts = dict()  # shot -> failed attempts, for shots other than the current one
+        self._version = 0  # incremented whenever the queue has to be worked out again
+        self._last_poll = 0.0
+
+    def configure(self, server, tree, config):
+        """
+        Sets the server, tree and signals to prefetch, forgetting what was prefetched before
+
+        Args:
+            server (str): MDSplus server address
+            tree (str): MDSplus tree name
+            config (dict): subplot locations mapped to their signal configurations
+        """
+        with self._lock:
+            self._setup = (server, tree, mdsh.windowed_config(config))
+            self._done = set()
+            self._not_before = dict()
+            self._attempts = dict()
+            self._current = None
+            self._newest = None
+            self._version += 1
+        self._wake.set()
+
+    def center(self, shot_number):
+        """
+        Prefetches the shots around shot_number
+
+        Args:
+            shot_number (int): displayed shot
+        """
+        with self._lock:
+            self._shot = shot_number
+            # the displayed shot was just fetched in the foreground
+            self._done.add(shot_number)
+            self._version += 1
+        self._wake.set()
+
+    def pause(self):
+        """
+        Stops prefetching after the current request until resume is called
+        """
+        self._idle.clear()
+
+    def resume(self):
+        """
+        Lets prefetching continue
+        """
+        self._idle.set()
+        self._wake.set()
+
+    def stop(self):
+        """
+        Ends the thread after the current request
+        """
+        self._stopped.set()
+        self._idle.set()
+        self._wake.set()
+
+    def run(self):
+        # nothing prefetched counts towards the shot on display
+        with metrics.background():
+            self._run()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            self._idle.wait()
+            if self._stopped.is_set():
+                break
+
+            try:
+                while True:
+                    self._poll()
+                    if not self._prefetch_next():
+                        break
+            except Exception as e:
+                # never take down the thread, try again on the next wake up
+                logger.warning("Prefetching failed: %s" % e)
+
+    def queue(self):
+        """
+        Returns:
+            list: shot numbers still to be prefetched, most wanted first
+        """
+        with self._lock:
+            shots = []
+            if self._newest is not None:
+                shots.append(self._newest)
+            if self._shot:
+                for k in range(1, self.depth + 1):
+                    shots.extend([self._shot + k, self._shot - k])
+
+            newest = self._newest
+            # shots after the newest one are yet to come, and the current one may still be being written
+            current = self._current[0] if self._current is not None else None
+            now = time.time()
+            return [shot for shot in shots
+                    if shot > 0 and shot not in self._done and (newest is None or shot <= newest)
+                    and (current is None or shot < current or shot == newest)
+                    and self._not_before.get(shot, 0.0) <= now]
+
+    def _poll(self):
+        if self.poll_interval is None or time.time() - self._last_poll < self.poll_interval:
+            return
+
+        self._last_poll = time.time()
+        with self._lock:
+            setup = self._setup
+        if setup is None:
+            return
+
+        current_shot = mdsh.get_current_shot(setup[0], setup[1])
+        with self._lock:
+            if current_shot is None or self._setup is not setup:
+                return
+            if self._current is None or self._current[0] != current_shot:
+                self._current = (current_shot, time.time())
+                self._version += 1
+            if current_shot != self._newest and time.time() - self._current[1] >= self.settle:
+                logger.debug("Shot %d has settled on the server, prefetching it" % current_shot)
+                self._newest = current_shot
+                self._version += 1
+
+    def _prefetch_next(self):
+        """
+        Prefetches the first shot in the queue
+
+        Returns:
+            bool: True if there may be more to do right away
+        """
+        with self._lock:
+            setup = self._setup
+            version = self._version
+        shots = self.queue()
+        if setup is None or not shots:
+            return False
+
+        shot_number = shots[0]
+        server, tree, config = setup
+        self._idle.wait()
+        if mdsh.probe_shot(server, tree, shot_number) is None:
+            # not there (yet)
+            self._unfinished(shot_number, server, tree, version)
+            return True
+
+        complete = True
+        for subplot in config.values():
+            for signal_name, signal_info in subplot.items():
+                if signal_name in subplot_options:
+                    continue
+
+                # wait out the foreground fetch, and start over if the user moved on meanwhile
+                self._idle.wait()
+                if self._stopped.is_set() or self._version != version:
+                    return not self._stopped.is_set()
+
+                complete &= mdsh.warm_cache(shot_number, signal_info, signal_name, server, tree)
+
+        if complete:
+            self._finished(shot_number, version)
+        else:
+            # the signals that made it are cached
+            logger.debug("Some signals of shot %d could not be prefetched" % shot_number)
+            self._unfinished(shot_number, server, tree, version)
+        return True
+
+    def _finished(self, shot_number, version):
+        with self._lock:
+            if self._version == version:
+                self._done.add(shot_number)
+
+    def _unfinished(self, shot_number, server, tree, version):
+        if mdsh._is_final(shot_number, server, tree):
+            # the server has moved on, so whatever is missing (e.g. a diagnostic that wasn't digitized) stays missing
+            self._finished(shot_number, version)
+            return
+
+        with self._lock:
+            delay = self.poll_interval or 30.0
+            if self._current is None or shot_number != self._current[0]:
+                # only the shot that is being written is retried at the same pace until it is complete
+                attempts = self._attempts.get(shot_number, 0)
+                self._attempts[shot_number] = attempts + 1
+                delay = min(delay * 2**attempts, self.max_retry_delay)
+            self._not_before[shot_number] = time.time() + delay
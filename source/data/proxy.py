@@ -0,0 +1,607 @@
+from __future__ import division, print_function
+import MDSplus as mds
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+from .connection_pool import ConnectionPool
+from .signal_cache import SignalCache
+import io
+import ipaddress
+import json
+import logging
+import numpy as np
+import socket
+import threading
+import time
+"""
+Module proxy
+============
+Defines ProxyServer, a local data service that PiScope clients fetch through instead of the
+MDSplus server, and ProxyConnection, the client side of it.
+The proxy fetches every (server, tree, shot, expression) from the MDSplus server once, keeps
+the result in memory and serves it to every client that asks for it afterwards.  When several
+clients ask for the same expression at once (e.g. right after raw_data_ready), only the first
+request goes to the server and the others wait for its result.  Clients talk to the proxy over
+multiprocessing.connection sockets, which check the authkey with an HMAC challenge.  Only bytes are
+sent over them, never pickles: every message is a JSON header followed by the arrays it refers to
+in .npy format, loaded without allow_pickle.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
+
+default_port = 8765
+# public, so the proxy only accepts it on the loopback interface
+default_authkey = b'piscope'
+
+
+def parse_address(address):
+    """
+    Splits 'host:port' (or just 'host') into the (host, port) tuple multiprocessing.connection takes
+
+    Args:
+        address (str or tuple): proxy address
+
+    Returns:
+        tuple: (host, port)
+    """
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.strip().rpartition(':')
+    if not host:
+        return port or 'localhost', default_port
+    return host, int(port)
+
+
+def is_loopback(host):
+    """
+    Returns:
+        bool: True if host resolves to a loopback address, i.e. only this machine can connect to it
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (socket.error, ValueError):
+        return False
+
+
+class ProxyValue(object):
+    """
+    Result of a TDI expression as plain arrays, what the proxy caches and sends to its clients
+
+    Attributes:
+        data (np.ndarray): value of the expression
+        dim (np.ndarray): evaluated dimension if the value is a signal, None otherwise
+    """
+
+    def __init__(self, data, dim=None):
+        self.data = data
+        self.dim = dim
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.dim.nbytes if self.dim is not None else 0)
+
+    @classmethod
+    def from_mds(cls, con, value):
+        """
+        Converts a value returned by an MDSplus connection
+
+        Dimensions that still reference the tree (e.g. a digitizer clock) are evaluated on con.
+        """
+        if isinstance(value, mds.Signal):
+            dim = value.dim_of()
+            if not isinstance(dim, mds.Array):
+                dim = con.get('data(%s)' % str(dim))
+            return cls(_sendable(value.data()), _sendable(dim.data()))
+        return cls(_sendable(value.data()))
+
+    def to_mds(self):
+        """
+        Returns:
+            MDSplus.Data: the value as the MDSplus server would have returned it
+        """
+        if self.dim is None:
+            return mds.makeData(self.data)
+        return mds.Signal(mds.makeData(self.data), None, mds.makeData(self.dim))
+
+
+def _sendable(value):
+    array = np.asarray(value)
+    if array.dtype.hasobject:
+        # .npy can only hold these as pickles
+        raise TypeError("The proxy can't send %s arrays" % array.dtype)
+    return array
+
+
+class RemoteError(Exception):
+    """
+    Raised by a ProxyConnection for an error on the proxy that has no MDSplus exception class here
+    """
+    pass
+
+
+class _Flight(object):
+    # a fetch in progress that other requests for the same key wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+    def finish(self, result):
+        self.result = result
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        return self.result
+
+
+class _Session(object):
+    # what a client connection has selected, like the state of an MDSplus connection
+    def __init__(self):
+        self.server = None
+        self.tree = None
+        self.shot_number = None
+
+
+class ProxyServer(object):
+    """
+    Shares the signals fetched from MDSplus servers between every PiScope that connects to it
+
+    Each client connection selects a server and opens a tree and shot like an MDSplus connection,
+    then asks for expressions one at a time or in batches.  Results are cached by (server, tree,
+    shot, expression) in a SignalCache.  Shot 0 is resolved to the current shot when it is opened,
+    so the cache never serves a stale current shot.  Errors (e.g. a node that isn't written yet)
+    are passed on to the clients but not cached.
+
+    Example::
+
+        from source.data.proxy import ProxyServer
+        proxy = ProxyServer(('localhost', 8765), cache_bytes=4 * 1024**3)
+        proxy.serve_forever()
+
+    Attributes:
+        address (tuple): (host, port) to listen on
+        pool (ConnectionPool): connections to the MDSplus servers
+        cache (SignalCache): cached results
+        current_shot_ttl (float): seconds a resolved current shot is reused for
+        max_request_bytes (int): longest request accepted from a client
+        max_opened (int): shots remembered to open without asking the server again
+        requests (int): requests sent to the MDSplus servers
+        served (int): expressions served to clients
+    """
+    current_shot_ttl = 1.0
+    max_request_bytes = 16 * 1024**2
+    max_opened = 1024
+
+    def __init__(self, address=('localhost', default_port), authkey=default_authkey, cache_bytes=2 * 1024**3,
+                 connections=8, connection_factory=None):
+        """
+        Anyone who can connect with the authkey can make the proxy query the MDSplus servers, so it
+        only listens on other than the loopback interface with an authkey other than default_authkey.
+
+        Args:
+            address (tuple): (host, port) to listen on
+            authkey (bytes): key clients have to present
+            cache_bytes (int): memory budget for cached results
+            connections (int): most connections open to the MDSplus servers
+            connection_factory (callable, optional): creates MDSplus connections, see ConnectionPool
+        """
+        self.address = parse_address(address)
+        if authkey == default_authkey and not is_loopback(self.address[0]):
+            raise ValueError("Refusing to listen on %s with the default authkey, choose another one"
+                             % self.address[0])
+        self.authkey = authkey
+        self.pool = ConnectionPool(max_size=connections, connection_factory=connection_factory)
+        self.cache = SignalCache(max_bytes=cache_bytes)
+        self.requests = 0
+        self.served = 0
+        self.listener = None
+        self._lock = threading.Lock()  # never held while waiting on a server or the pool
+        self._counter_lock = threading.Lock()
+        self._flights = dict()  # key -> _Flight, ('$SHOT', server, tree) while resolving shot 0
+        self._current = dict()  # (server, tree) -> (current shot, time resolved)
+        self._opened = OrderedDict()  # (server, tree, shot) known to open -> None, least recently used first
+        self._closed = threading.Event()
+
+    def serve_forever(self):
+        """
+        Accepts clients until close is called, each one is served in its own thread
+        """
+        # every PiScope opens several connections at once when it starts fetching a shot
+        self.listener = Listener(self.address, backlog=64, authkey=self.authkey)
+        logger.debug("Proxy listening on %s:%d" % self.address)
+        while not self._closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except (OSError, IOError, EOFError) as e:
+                if self._closed.is_set():
+                    break
+                # most likely a client with the wrong authkey
+                logger.warning("Proxy refused a client: %s" % e)
+                continue
+            thread = threading.Thread(target=self._serve_client, args=(conn,), name='piscope-proxy-client')
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """
+        Stops accepting clients and closes the connections to the MDSplus servers
+        """
+        self._closed.set()
+        if self.listener is not None:
+            self.listener.close()
+        self.pool.clear()
+
+    def info(self):
+        """
+        Returns:
+            str: one line summary of the cache and the requests sent and served
+        """
+        cache_info = self.cache.info()
+        return ("%d expressions served with %d requests to the server, %d cached (%.1f MB), %d hits, %d misses"
+                % (self.served, self.requests, cache_info.items, cache_info.nbytes / 1024**2, cache_info.hits,
+                   cache_info.misses))
+
+    def _serve_client(self, conn):
+        session = _Session()
+        try:
+            while True:
+                try:
+                    message = json.loads(conn.recv_bytes(self.max_request_bytes).decode('utf-8'))
+                except ValueError as e:
+                    reply = _error(e)
+                else:
+                    reply = self.handle(session, message)
+
+                arrays = []
+                if reply[0] == 'ok' and isinstance(reply[1], dict):
+                    header = {'status': 'ok', 'values': dict((name, _encode(result, arrays))
+                                                             for name, result in reply[1].items())}
+                else:
+                    header = _encode(reply, arrays)
+                _send(conn, header, arrays)
+        except (EOFError, OSError, IOError):
+            # gone, or sent a request over max_request_bytes
+            pass
+        finally:
+            conn.close()
+
+    def handle(self, session, message):
+        """
+        Answers one message from a client
+
+        Args:
+            session (_Session): state of the client connection
+            message (dict): decoded JSON request, {'op': 'connect', 'server': server},
+                {'op': 'open', 'tree': tree, 'shot': shot}, {'op': 'get', 'expression': expression}
+                or {'op': 'getmany', 'expressions': [[name, expression], ...]}
+
+        Returns:
+            tuple: ('ok', value) or ('error', exception name, message), for getmany the value is a
+                dict of name to ('ok', ProxyValue) or ('error', exception name, message)
+        """
+        try:
+            op = message['op']
+            if op == 'connect':
+                session.server = str(message['server'])
+                return 'ok', None
+
+            if op == 'open':
+                tree = str(message['tree'])
+                shot_number = self._open(session.server, tree, int(message['shot']))
+                session.tree = tree
+                session.shot_number = shot_number
+                return 'ok', shot_number
+
+            if op == 'get':
+                expression = str(message['expression'])
+                return self._fetch(session, [expression])[expression]
+
+            if op == 'getmany':
+                expressions = [(str(name), str(expression)) for name, expression in message['expressions']]
+                results = self._fetch(session, [expression for _, expression in expressions])
+                return 'ok', dict((name, results[expression]) for name, expression in expressions)
+
+            return 'error', 'RemoteError', 'unknown request %r' % op
+        except Exception as e:
+            return _error(e)
+
+    def _count(self, requests=0, served=0):
+        with self._counter_lock:
+            self.requests += requests
+            self.served += served
+
+    def _open(self, server, tree, shot_number):
+        if shot_number == 0:
+            shot_number = self._current_shot(server, tree)
+
+        key = (server, tree, shot_number)
+        with self._lock:
+            opened = key in self._opened
+            if opened:
+                self._opened.move_to_end(key)
+        if not opened:
+            with self.pool.connection(server, tree, shot_number):
+                pass
+            self._count(requests=1)
+            with self._lock:
+                self._opened[key] = None
+                while len(self._opened) > self.max_opened:
+                    self._opened.popitem(last=False)
+        return shot_number
+
+    def _current_shot(self, server, tree):
+        """
+        Resolves shot 0, one client asks the server and the ones right behind it reuse the answer
+        """
+        key = ('$SHOT', server, tree)
+        with self._lock:
+            current, resolved = self._current.get((server, tree), (None, 0.0))
+            if current is not None and time.time() - resolved <= self.current_shot_ttl:
+                return current
+            flight = self._flights.get(key, None)
+            mine = flight is None
+            if mine:
+                flight = self._flights[key] = _Flight()
+
+        if mine:
+            try:
+                with self.pool.connection(server, tree, 0) as con:
+                    result = ('ok', int(con.get('$SHOT')))
+            except Exception as e:
+                result = ('error', e)
+            self._count(requests=2)
+            with self._lock:
+                if result[0] == 'ok':
+                    self._current[(server, tree)] = (result[1], time.time())
+                del self._flights[key]
+            flight.finish(result)
+        else:
+            result = flight.wait()
+
+        if result[0] == 'error':
+            raise result[1]
+        return result[1]
+
+    def _fetch(self, session, expressions):
+        """
+        Looks up expressions in the cache and fetches the missing ones from the server in one request
+
+        Returns:
+            dict: expression to ('ok', ProxyValue) or ('error', exception name, message)
+        """
+        if session.tree is None:
+            raise RemoteError('no tree is open')
+
+        results = dict()
+        mine = []
+        theirs = dict()
+        with self._lock:
+            for expression in set(expressions):
+                local = self._local(session, expression)
+                if local is not None:
+                    results[expression] = ('ok', local)
+                    continue
+
+                key = (session.server, session.tree, session.shot_number, expression)
+                hit, value = self.cache.get(key)
+                if hit:
+                    results[expression] = ('ok', value)
+                elif key in self._flights:
+                    theirs[expression] = self._flights[key]
+                else:
+                    self._flights[key] = _Flight()
+                    mine.append(expression)
+
+        if mine:
+            fetched = self._fetch_upstream(session, mine)
+            for expression in mine:
+                key = (session.server, session.tree, session.shot_number, expression)
+                result = fetched[expression]
+                if result[0] == 'ok':
+                    self.cache.put(key, result[1])
+                with self._lock:
+                    flight = self._flights.pop(key)
+                flight.finish(result)
+                results[expression] = result
+
+        for expression, flight in theirs.items():
+            results[expression] = flight.wait()
+
+        self._count(served=len(expressions))
+        return results
+
+    @staticmethod
+    def _local(session, expression):
+        # answered without asking the server, e.g. the connection health check
+        if expression == '1':
+            return ProxyValue(np.array(1, dtype=np.int32))
+        if expression == '$SHOT':
+            return ProxyValue(np.array(session.shot_number, dtype=np.int32))
+        return None
+
+    def _fetch_upstream(self, session, expressions):
+        for attempt in range(2):
+            try:
+                with self.pool.connection(session.server, session.tree, session.shot_number) as con:
+                    return self._request(con, expressions)
+            except mds.MdsIpException as e:
+                # the broken connection was thrown away by the pool, try again on a new one
+                logger.warning("MdsIpException in the proxy (attempt %d)" % (attempt + 1))
+                error = _error(e)
+            except Exception as e:
+                error = _error(e)
+                break
+        return dict((expression, error) for expression in expressions)
+
+    def _request(self, con, expressions):
+        logger.debug("Proxy fetching %d expressions from the server" % len(expressions))
+        results = dict()
+        if len(expressions) == 1:
+            self._count(requests=1)
+            try:
+                results[expressions[0]] = ('ok', ProxyValue.from_mds(con, con.get(expressions[0])))
+            except mds.MdsIpException:
+                raise
+            except Exception as e:
+                results[expressions[0]] = _error(e)
+            return results
+
+        request = con.getMany()
+        for idx, expression in enumerate(expressions):
+            request.append('e%d' % idx, expression)
+        request.execute()
+        self._count(requests=1)
+
+        for idx, expression in enumerate(expressions):
+            error = request.error('e%d' % idx)
+            if error:
+                results[expression] = ('error', 'RemoteError', str(error))
+                continue
+            try:
+                results[expression] = ('ok', ProxyValue.from_mds(con, request.get('e%d' % idx)))
+            except mds.MdsIpException:
+                raise
+            except Exception as e:
+                results[expression] = _error(e)
+        return results
+
+
+def _error(e):
+    return 'error', type(e).__name__, str(e)
+
+
+def _encode(result, arrays):
+    # JSON for a ('ok', value) or ('error', name, message) result, with its arrays appended to arrays
+    if result[0] == 'error':
+        return {'status': 'error', 'error': result[1], 'message': result[2]}
+    value = result[1]
+    if not isinstance(value, ProxyValue):
+        return {'status': 'ok', 'value': value}
+    arrays.append(value.data)
+    encoded = {'data': len(arrays) - 1, 'dim': None}
+    if value.dim is not None:
+        arrays.append(value.dim)
+        encoded['dim'] = len(arrays) - 1
+    return {'status': 'ok', 'value': encoded}
+
+
+def _decode(encoded, arrays):
+    # ProxyValue of an 'ok' result encoded by _encode
+    dim = encoded['dim']
+    return ProxyValue(arrays[encoded['data']], arrays[dim] if dim is not None else None)
+
+
+def _send(conn, header, arrays=()):
+    conn.send_bytes(json.dumps(dict(header, arrays=len(arrays))).encode('utf-8'))
+    for array in arrays:
+        buf = io.BytesIO()
+        np.save(buf, array, allow_pickle=False)
+        conn.send_bytes(buf.getvalue())
+
+
+def _recv(conn):
+    header = json.loads(conn.recv_bytes().decode('utf-8'))
+    arrays = [np.load(io.BytesIO(conn.recv_bytes()), allow_pickle=False) for _ in range(header.pop('arrays'))]
+    return header, arrays
+
+
+def _raise(name, message):
+    cls = getattr(mds, name, None)
+    if cls is None:
+        cls = getattr(getattr(mds, 'mdsExceptions', None), name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        raise RemoteError('%s: %s' % (name, message))
+    try:
+        error = cls(message)
+    except Exception:
+        error = cls()
+    raise error
+
+
+class ProxyConnection(object):
+    """
+    Connection to a ProxyServer that stands in for an MDSplus.Connection to server
+
+    It has the parts of MDSplus.Connection that PiScope uses (openTree, get, getMany and
+    disconnect) and returns the same kinds of MDSplus objects, so it can be handed out by
+    the ConnectionPool in place of a direct connection, see mdsplus_helpers.configure_proxy.
+    Losing the proxy raises MDSplus.MdsIpException like losing the server would.
+
+    Example::
+
+        from source.data.proxy import ProxyConnection
+        con = ProxyConnection('localhost:8765', 'skywalker.physics.wisc.edu')
+        con.openTree('wipal', 0)
+        shot = int(con.get('$SHOT'))
+    """
+
+    def __init__(self, proxy_address, server, authkey=default_authkey):
+        """
+        Args:
+            proxy_address (str or tuple): address of the ProxyServer
+            server (str): MDSplus server the proxy should fetch from
+            authkey (bytes): key of the ProxyServer
+        """
+        try:
+            self._conn = Client(parse_address(proxy_address), authkey=authkey)
+        except (OSError, IOError, EOFError) as e:
+            raise mds.MdsIpException('Unable to connect to the proxy at %s: %s' % (proxy_address, e))
+        self.server = server
+        self._call(op='connect', server=server)
+
+    def _call(self, **message):
+        """
+        Sends a request to the proxy
+
+        Returns:
+            tuple: (JSON header of the reply, arrays it refers to)
+        """
+        try:
+            self._conn.send_bytes(json.dumps(message).encode('utf-8'))
+            header, arrays = _recv(self._conn)
+        except (OSError, IOError, EOFError) as e:
+            raise mds.MdsIpException('Lost the connection to the proxy: %s' % e)
+        if header['status'] == 'error':
+            _raise(header['error'], header['message'])
+        return header, arrays
+
+    def openTree(self, tree, shot_number):
+        self._call(op='open', tree=tree, shot=int(shot_number))
+
+    def get(self, expression):
+        header, arrays = self._call(op='get', expression=expression)
+        return _decode(header['value'], arrays).to_mds()
+
+    def getMany(self):
+        return ProxyGetMany(self)
+
+    def disconnect(self):
+        self._conn.close()
+
+
+class ProxyGetMany(object):
+    """
+    The part of MDSplus.GetMany that PiScope uses, sent to the proxy as one request
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._expressions = []
+        self._results = dict()
+        self._arrays = []
+
+    def append(self, name, expression):
+        self._expressions.append((name, expression))
+
+    def execute(self):
+        header, self._arrays = self.connection._call(op='getmany', expressions=self._expressions)
+        self._results = header['values']
+
+    def get(self, name):
+        result = self._results[name]
+        return _decode(result['value'], self._arrays).to_mds() if result['status'] == 'ok' else None
+
+    def error(self, name):
+        result = self._results.get(name, None)
+        if result is None or result['status'] == 'ok':
+            return None
+        return '%s: %s' % (result['error'], result['message'])
@@ -0,0 +1,95 @@
+from __future__ import division, print_function
+import numpy as np
+"""
+Module pyramid
+==============
+Defines one class, MinMaxPyramid.
+A MinMaxPyramid holds successively coarser min/max envelopes of a signal so that
+the points visible in any x range can be found at a resolution close to the
+screen's without scanning the full record.
+"""
+
+
+def _minmax_indices(ydata, bin_size):
+    """
+    Indices of the min and max point of every bin of bin_size points, in increasing order
+    """
+    n = len(ydata)
+    n_full = (n // bin_size) * bin_size
+    blocks = [(ydata[:n_full].reshape(-1, bin_size), 0)]
+    if n_full < n:
+        blocks.append((ydata[n_full:].reshape(1, -1), n_full))
+
+    indices = []
+    for bins, offset in blocks:
+        starts = offset + bins.shape[1] * np.arange(bins.shape[0])
+        pairs = np.stack([starts + np.argmin(bins, axis=1), starts + np.argmax(bins, axis=1)], axis=1)
+        pairs.sort(axis=1)
+        indices.append(pairs.ravel())
+
+    return np.concatenate(indices)
+
+
+class MinMaxPyramid(object):
+    """
+    Multi-resolution min/max envelope of a signal with a sorted time base
+
+    Level 0 is the raw signal.  Every following level keeps the min and max of bins of
+    2 * factor points of the level below, so it has factor times fewer points while
+    still containing every extreme of the raw signal.
+
+    >>> import numpy as np
+    >>> from source.data.pyramid import MinMaxPyramid
+    >>> time = np.linspace(0, 1, 1000000)
+    >>> pyramid = MinMaxPyramid(time, np.sin(1000 * time))
+    >>> x, y = pyramid.view(0.2, 0.3, 1000)
+    >>> print(1000 <= len(x) < 8 * 1000 + 2)
+    True
+
+    Attributes:
+        levels (list): (x, y) arrays of every level, finest first
+    """
+
+    def __init__(self, time, data, factor=8, min_points=1024):
+        """
+        Args:
+            time (np.ndarray): sorted time base
+            data (np.ndarray): signal values
+            factor (int): reduction in points from one level to the next
+            min_points (int): no level coarser than this many points is built
+        """
+        self.factor = int(factor)
+        self.levels = [(time, data)]
+
+        x, y = time, data
+        while len(y) // self.factor >= min_points:
+            indices = _minmax_indices(y, 2 * self.factor)
+            x, y = x[indices], y[indices]
+            self.levels.append((x, y))
+
+    @property
+    def nbytes(self):
+        """int: bytes held by the levels above the raw signal"""
+        return sum(x.nbytes + y.nbytes for x, y in self.levels[1:])
+
+    def view(self, xstart, xend, n_points):
+        """
+        Returns the points between xstart and xend from the coarsest level that has at least n_points there
+
+        One point on either side of the range is included so the line isn't cut off at the edges.
+
+        Args:
+            xstart (float): start of the x range
+            xend (float): end of the x range
+            n_points (int): number of points wanted in the range
+
+        Returns:
+            tuple: (x, y) views into the chosen level
+        """
+        for x, y in reversed(self.levels):
+            i0 = np.searchsorted(x, xstart, side='left')
+            i1 = np.searchsorted(x, xend, side='right')
+            if i1 - i0 >= n_points or x is self.levels[0][0]:
+                i0 = max(i0 - 1, 0)
+                i1 = min(i1 + 1, len(x))
+                return x[i0:i1], y[i0:i1]
@@ -0,0 +1,132 @@
+from __future__ import division, print_function
+from collections import OrderedDict, namedtuple
+import threading
+import time
+"""
+Module signal_cache
+===================
+Defines one class, SignalCache.
+A SignalCache holds retrieved Data objects and evicts the least recently used
+ones once the arrays it holds go over a memory budget.  Failed retrievals (None)
+are only remembered for a short time so that they are retried later.
+"""
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'items', 'nbytes', 'max_bytes'])
+
+
+class SignalCache(object):
+    """
+    Thread-safe LRU cache of Data objects bounded by the number of bytes held
+
+    >>> import numpy as np
+    >>> from source.data.data import Data
+    >>> from source.data.signal_cache import SignalCache
+    >>> cache = SignalCache(max_bytes=1024**2)
+    >>> cache.put('key', Data('My Signal', np.arange(10.0), np.arange(10.0), 'red'))
+    >>> hit, data = cache.get('key')
+    >>> print(hit, data.nbytes)
+    True 160
+
+    Attributes:
+        max_bytes (int): memory budget for the cached arrays
+        negative_ttl (float): seconds that a failed retrieval (None) stays cached
+        hits (int): number of lookups found in the cache
+        misses (int): number of lookups not found in the cache
+        nbytes (int): bytes currently held by the cached arrays
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3, negative_ttl=30.0):
+        """
+        Args:
+            max_bytes (int): memory budget in bytes
+            negative_ttl (float): seconds to keep None results
+        """
+        self.max_bytes = int(max_bytes)
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes, time stored), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks up key in the cache
+
+        Args:
+            key (hashable): cache key
+
+        Returns:
+            tuple: (True, cached value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, nbytes, stored = entry
+                if value is None and time.time() - stored > self.negative_ttl:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """
+        Stores value under key and evicts least recently used entries if over budget
+
+        Values larger than the whole budget are not stored.
+
+        Args:
+            key (hashable): cache key
+            value (Data or None): retrieved data, None for a failed retrieval
+        """
+        nbytes = value.nbytes if value is not None else 0
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, nbytes, time.time())
+            self.nbytes += nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """
+        Changes the memory budget, evicting entries if needed
+
+        Args:
+            max_bytes (int): new memory budget in bytes
+        """
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def info(self):
+        """
+        Returns:
+            CacheInfo: hits, misses, items, nbytes and max_bytes of the cache
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, len(self._entries), self.nbytes, self.max_bytes)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
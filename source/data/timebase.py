@@ -0,0 +1,74 @@
+from __future__ import division, print_function
+import numpy as np
+import threading
+import weakref
+"""
+Module timebase
+===============
+Defines one class, TimebaseRegistry.
+Signals recorded by the same digitizer have identical time bases.  The registry
+hands back one shared, read-only array for all of them so a time base is only
+stored once no matter how many signals use it.
+"""
+
+
+class TimebaseRegistry(object):
+    """
+    Interns time base arrays so identical time bases share memory
+
+    >>> import numpy as np
+    >>> from source.data.timebase import TimebaseRegistry
+    >>> registry = TimebaseRegistry()
+    >>> t1 = registry.share(np.linspace(0, 1, 100))
+    >>> t2 = registry.share(np.linspace(0, 1, 100))
+    >>> print(t1 is t2)
+    True
+
+    Arrays are only held through weak references, so a time base is forgotten once
+    no Data object uses it anymore.
+    """
+
+    def __init__(self):
+        self._arrays = dict()
+        self._lock = threading.Lock()
+
+    def share(self, array):
+        """
+        Returns a read-only array equal to array, reusing a registered one if possible
+
+        Args:
+            array (iterable): time base
+
+        Returns:
+            np.ndarray: shared read-only time base
+        """
+        array = np.asarray(array)
+        if array.ndim != 1 or len(array) == 0:
+            return array
+
+        # cheap key to find candidates, the full comparison is only done on a match
+        key = (array.dtype.str, len(array), array[0].item(), array[-1].item())
+        with self._lock:
+            refs = [ref for ref in self._arrays.get(key, []) if ref() is not None]
+            for ref in refs:
+                candidate = ref()
+                if candidate is not None and np.array_equal(candidate, array):
+                    self._arrays[key] = refs
+                    return candidate
+
+            array.flags.writeable = False
+            refs.append(weakref.ref(array))
+            self._arrays[key] = refs
+
+        return array
+
+    def clear(self):
+        """
+        Forgets every registered time base
+        """
+        with self._lock:
+            self._arrays = dict()
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for refs in self._arrays.values() for ref in refs if ref() is not None)
@@ -0,0 +1,46 @@
+from __future__ import division, print_function
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from ..plotting.blit import BlitManager
+from ..logging.metrics import metrics, DRAW
+
+"""
+This module contains the :class:`PiScopeCanvas`, the matplotlib canvas of the PiScope window
+"""
+
+
+class PiScopeCanvas(FigureCanvasQTAgg):
+    """
+    Qt canvas that only redraws the lines while the view is being panned
+
+    A pan gesture with the navigation toolbar calls draw_idle on every mouse move.  Between
+    the press and the release of the mouse button those draws go to a BlitManager that redraws
+    the lines over a cached background, and the lines are re-decimated once on release.
+
+    Attributes:
+        blit_manager (BlitManager): draws the lines during a gesture
+    """
+
+    def __init__(self, figure):
+        super(PiScopeCanvas, self).__init__(figure)
+        self.blit_manager = BlitManager(self)
+        # connected before the toolbar's handlers so these run first
+        self.mpl_connect('button_press_event', self._gesture_start)
+        self.mpl_connect('button_release_event', self._gesture_end)
+
+    def draw(self):
+        with metrics.timer(DRAW):
+            super(PiScopeCanvas, self).draw()
+
+    def draw_idle(self, *args, **kwargs):
+        if self.blit_manager.active:
+            self.blit_manager.update()
+        else:
+            super(PiScopeCanvas, self).draw_idle(*args, **kwargs)
+
+    def _gesture_start(self, event):
+        toolbar = self.toolbar
+        if toolbar is not None and toolbar.mode == 'pan/zoom' and event.inaxes is not None:
+            self.blit_manager.start()
+
+    def _gesture_end(self, event):
+        self.blit_manager.finish()
@@ -3,6 +3,7 @@ from PyQt5 import QtCore, QtWidgets, QtGui
 from distutils.util import strtobool
 from copy import deepcopy
 from .scientificspin import ScientificDoubleSpinBox
+from ..config.parser import subplot_options
 
 default_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
                   '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
@@ -49,6 +50,10 @@ class EditConfigDialog(QtWidgets.QDialog):
         self.ylim_low = ScientificDoubleSpinBox(self)
         self.ylim_high = ScientificDoubleSpinBox(self)
 
+        self.window_check = QtWidgets.QCheckBox(self)
+        self.decimate_label = QtWidgets.QLabel(self)
+        self.decimate_spin = QtWidgets.QSpinBox(self)
+
         self.signal_label = QtWidgets.QLabel(self)
         # self.signal_hbox
         self.xlabel = QtWidgets.QLineEdit(self)
@@ -56,6 +61,7 @@ class EditConfigDialog(QtWidgets.QDialog):
         self.label = QtWidgets.QLineEdit(self)
         self.legend = QtWidgets.QCheckBox(self)
         self.no_resample = QtWidgets.QCheckBox(self)
+        self.envelope = QtWidgets.QCheckBox(self)
         self.xshareable = QtWidgets.QCheckBox(self)
         self.xlab = QtWidgets.QLabel(self)
         self.ylab = QtWidgets.QLabel(self)
@@ -86,6 +92,7 @@ class EditConfigDialog(QtWidgets.QDialog):
         self.lab_box = QtWidgets.QHBoxLayout()
         self.xlim_box = QtWidgets.QHBoxLayout()
         self.ylim_box = QtWidgets.QHBoxLayout()
+        self.server_box = QtWidgets.QHBoxLayout()
         self.init_UI(xloc=xloc, yloc=yloc)
 
         self.combo.activated.connect(self.change_list_view)
@@ -109,6 +116,7 @@ class EditConfigDialog(QtWidgets.QDialog):
 
         self.legend.setText("Legend")
         self.no_resample.setText("No Resample")
+        self.envelope.setText("Min/Max Envelope")
         self.xshareable.setText("X shareable")
         self.xlab.setText("X Label: ")
         self.ylab.setText("Y Label: ")
@@ -124,6 +132,9 @@ class EditConfigDialog(QtWidgets.QDialog):
 
         self.xlim_check.setText("X Limits")
         self.ylim_check.setText("Y Limits")
+        self.window_check.setText("Fetch Only X Limits")
+        self.decimate_label.setText("Server Decimation: ")
+        self.decimate_spin.setRange(1, 1000000)
 
         self.color_label.setText("Color: ")
         self.color_chosen.setText("                     ")
@@ -154,6 +165,7 @@ class EditConfigDialog(QtWidgets.QDialog):
         self.options_box.addWidget(self.ylabel)
         self.toggle_hbox.addWidget(self.legend)
         self.toggle_hbox.addWidget(self.no_resample)
+        self.toggle_hbox.addWidget(self.envelope)
         self.toggle_hbox.addWidget(self.xshareable)
         self.toggle_hbox.addStretch()
 
@@ -173,11 +185,17 @@ class EditConfigDialog(QtWidgets.QDialog):
         self.ylim_box.addWidget(self.ylim_high, 1)
         self.ylim_box.addStretch()
 
+        self.server_box.addWidget(self.window_check)
+        self.server_box.addWidget(self.decimate_label)
+        self.server_box.addWidget(self.decimate_spin)
+        self.server_box.addStretch()
+
         self.vbox.addLayout(self.hbox)
         self.vbox.addLayout(self.options_box)
         self.vbox.addLayout(self.toggle_hbox)
         self.vbox.addLayout(self.xlim_box)
         self.vbox.addLayout(self.ylim_box)
+        self.vbox.addLayout(self.server_box)
         self.vbox.addWidget(self.signal_label)
         self.vbox.addWidget(self.item_list)
         self.vbox.addLayout(self.lab_box)
@@ -237,6 +255,11 @@ class EditConfigDialog(QtWidgets.QDialog):
         else:
             self.no_resample.setChecked(False)
 
+        if "resample" in keys and local_config['resample'] == 'envelope':
+            self.envelope.setChecked(True)
+        else:
+            self.envelope.setChecked(False)
+
         # try:
         #     print(local_config['xshare'])
         # except KeyError:
@@ -260,6 +283,16 @@ class EditConfigDialog(QtWidgets.QDialog):
             self.xlim_low.setEnabled(False)
             self.xlim_high.setEnabled(False)
 
+        if "window" in keys and (isinstance(local_config['window'], list) or strtobool(local_config['window'])):
+            self.window_check.setChecked(True)
+        else:
+            self.window_check.setChecked(False)
+
+        if "decimate" in keys:
+            self.decimate_spin.setValue(int(local_config['decimate']))
+        else:
+            self.decimate_spin.setValue(1)
+
         if "ylim" in keys:
             self.ylim_check.setChecked(True)
             self.ylim_low.setEnabled(True)
@@ -282,8 +315,7 @@ class EditConfigDialog(QtWidgets.QDialog):
         Returns:
 
         """
-        ignore_items = ['xlabel', 'ylabel', 'legend', 'xlim', 'ylim', 'color', 'noresample', 'xshare']
-        pos_items = [x for x in self.config[key] if x not in ignore_items]
+        pos_items = [x for x in self.config[key] if x not in subplot_options]
         pos_items.sort()
 
         self.item_list.addItem("New Signal")
@@ -388,9 +420,25 @@ class EditConfigDialog(QtWidgets.QDialog):
         if self.no_resample.isChecked():
             self.config[pos]['noresample'] = str(True)
 
+        if self.envelope.isChecked():
+            self.config[pos]['resample'] = 'envelope'
+        else:
+            self.config[pos].pop('resample', None)
+
         if not self.xshareable.isChecked():
             self.config[pos]['xshare'] = str(False)
 
+        if not self.window_check.isChecked():
+            self.config[pos].pop('window', None)
+        elif not isinstance(self.config[pos].get('window', None), list):
+            # an explicit time range from the config file is kept
+            self.config[pos]['window'] = str(True)
+
+        if self.decimate_spin.value() > 1:
+            self.config[pos]['decimate'] = str(self.decimate_spin.value())
+        else:
+            self.config[pos].pop('decimate', None)
+
         self.item_list.clear()
         self.populate_list_box(pos)
 
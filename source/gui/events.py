@@ -1,34 +1,288 @@
 from __future__ import print_function, division
 from MDSplus.event import Event
 from PyQt5 import QtCore
+from ..data import mdsplus_helpers as mdsh
+from ..logging.metrics import metrics
+from ..logging.tracing import tracer
+import logging
+import queue
+import threading
+import time
+"""
+Module events
+=============
+Defines MyEvent, the MDSplus event PiScope listens to for auto-update, ShotPoller, which watches
+the current shot on the server instead, and ShotListener, which runs them for the life of the
+window and queues the shot numbers they see for the GUI.
+"""
+
+logger = logging.getLogger('pi-scope-logger')
 
 
 class SenderObject(QtCore.QObject):
     """
-
+    Carries the shot number of an MDSplus event out of the event's thread
     """
     emitter = QtCore.pyqtSignal(int)
 
 
 class MyEvent(Event):
     """
+    MDSplus event that emits sender.emitter with its data (the shot number) every time it happens
 
+    The event keeps listening until cancel is called.
     """
     def __init__(self, event_name):
         """
 
         Args:
-            event_name:
+            event_name (str): name of the MDSplus event, e.g. raw_data_ready
         """
-        super(MyEvent, self).__init__(event_name)
         self.sender = SenderObject()
+        super(MyEvent, self).__init__(event_name)
 
     def run(self):
         """
+        Called by MDSplus on the event's thread every time the event happens
+        """
+        try:
+            shot_number = int(self.getData())
+        except Exception as e:
+            # an event without a shot number, keep listening for the next one
+            logger.warning("MDSplus event without a shot number: %s" % e)
+            return
+        self.sender.emitter.emit(shot_number)
+
+
+class ShotPoller(threading.Thread):
+    """
+    Background thread that asks the server for its current shot every interval seconds
+
+    A fallback for machines that can't receive MDSplus events (they only reach the private subnet
+    of the server).  Each check opens shot 0 and evaluates $SHOT on a pooled connection.  A new shot
+    is reported once it has been current for delay seconds, since $SHOT moves on as soon as the
+    tree is created, before the data is written.
+    """
+
+    def __init__(self, server, tree, callback, interval=5.0, delay=0.0):
+        """
+        Args:
+            server (str): MDSplus server address
+            tree (str): MDSplus tree name
+            callback (callable): called with the shot number of every new shot
+            interval (float): seconds between checks
+            delay (float): seconds a new shot has to be current before it is reported
+        """
+        super(ShotPoller, self).__init__(name='piscope-shot-poller')
+        self.daemon = True
+        self.server = server
+        self.tree = tree
+        self.callback = callback
+        self.interval = interval
+        self.delay = delay
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """
+        Ends the thread after the current check
+        """
+        self._stopped.set()
+
+    def run(self):
+        with metrics.background():
+            self._run()
+
+    def _run(self):
+        reported = None
+        seen = None  # (shot number, time first seen)
+        while True:
+            current_shot = mdsh.get_current_shot(self.server, self.tree)
+            if self._stopped.is_set():
+                break
+
+            if current_shot is not None:
+                if reported is None:
+                    # whatever is current when auto-update is turned on is already on screen or about to be
+                    reported = current_shot
+                elif current_shot != reported:
+                    if seen is None or seen[0] != current_shot:
+                        seen = (current_shot, time.time())
+                    if time.time() - seen[1] >= self.delay:
+                        reported = current_shot
+                        self.callback(current_shot)
+
+            wait = self.interval
+            if seen is not None and seen[0] != reported:
+                wait = min(wait, max(seen[1] + self.delay - time.time(), 0.0))
+            if self._stopped.wait(wait):
+                break
+
+
+class ShotListener(QtCore.QObject):
+    """
+    Listens for new shots for as long as auto-update is on and queues their shot numbers for the GUI
+
+    One MyEvent is kept for the life of the listener, instead of one per shot, so no event is missed
+    while PiScope is busy.  Optionally a ShotPoller watches $SHOT as well, or instead of the event.
+    Both put the shot numbers on a queue from their own threads and emit shot_ready, which Qt
+    delivers on the GUI thread.  The GUI then takes the newest shot with newest, so a burst of
+    shots ends up as one fetch of the last of them.
+
+    Example::
+
+        listener = ShotListener()
+        listener.shot_ready.connect(window.handle_incoming_mds_event)
+        listener.start('raw_data_ready', server, tree, poll_interval=5.0)
+
+    Attributes:
+        last_shot (int): shot number of the last notification, None before the first
+        last_time (float): time.time() of the last notification
+        received (int): number of notifications since start
+    """
+    shot_ready = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(ShotListener, self).__init__(parent)
+        self.last_shot = None
+        self.last_time = None
+        self.received = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._settings = None  # (event name, server, tree, poll interval, poll delay)
+        self._event = None
+        self._poller = None
+
+    @property
+    def running(self):
+        return self._settings is not None
+
+    def start(self, event_name, server=None, tree=None, poll_interval=None, poll_delay=0.0):
+        """
+        Starts listening, restarting if it was listening with other settings
+
+        Args:
+            event_name (str): MDSplus event to listen for, None to only poll
+            server (str, optional): MDSplus server to poll
+            tree (str, optional): MDSplus tree to poll
+            poll_interval (float, optional): seconds between checks of $SHOT, None to not poll
+            poll_delay (float): seconds a new shot has to be current before polling reports it
+        """
+        settings = (event_name, server, tree, poll_interval, poll_delay)
+        if settings == self._settings:
+            self.restart_dead()
+            return
+
+        self.stop()
+        self._settings = settings
+        self.received = 0
+        self.restart_dead()
+        logger.debug("Listening for new shots (event %s, polling every %s s)" % (event_name, poll_interval))
+
+    def stop(self):
+        """
+        Stops listening and forgets the shots that were not taken yet
+        """
+        if self._event is not None:
+            self._cancel_event(self._event)
+            self._event = None
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
+        self._settings = None
+        self.newest()
+
+    def restart_dead(self):
+        """
+        Starts the event and the poller, if they are wanted and not running
+
+        Returns:
+            bool: True if anything had to be (re)started
+        """
+        if self._settings is None:
+            return False
+
+        event_name, server, tree, poll_interval, poll_delay = self._settings
+        restarted = False
+        if event_name and (self._event is None or not self._event.is_alive()):
+            if self._event is not None:
+                logger.warning("MDSplus event %s stopped listening, starting it again" % event_name)
+                self._cancel_event(self._event)
+            self._event = MyEvent(event_name)
+            # put runs on the event's thread, shot_ready takes it to the GUI
+            self._event.sender.emitter.connect(self._put_event, QtCore.Qt.DirectConnection)
+            restarted = True
+
+        if poll_interval and (self._poller is None or not self._poller.is_alive()):
+            self._poller = ShotPoller(server, tree, self._put_poll, interval=poll_interval, delay=poll_delay)
+            self._poller.start()
+            restarted = True
+        return restarted
+
+    def put(self, shot_number, source='event'):
+        """
+        Queues shot_number for the GUI and wakes it up, can be called from any thread
+
+        Args:
+            shot_number (int): new shot
+            source (str): where it came from, for logging and the trace
+        """
+        with self._lock:
+            if source == 'poll' and self.last_shot is not None and shot_number <= self.last_shot:
+                # the event got there first
+                return
+            self.last_shot = shot_number
+            self.last_time = time.time()
+            self.received += 1
+        logger.debug("New shot %d from the %s" % (shot_number, source))
+        tracer.instant('shot_queued', 'events', shot=shot_number, source=source)
+        self._queue.put(shot_number)
+        self.shot_ready.emit()
+
+    def newest(self):
+        """
+        Takes every queued shot number
 
         Returns:
+            int: the newest of them, None if there were none
+        """
+        newest = None
+        while True:
+            try:
+                shot_number = self._queue.get_nowait()
+            except queue.Empty:
+                return newest
+            newest = shot_number if newest is None else max(newest, shot_number)
 
+    def status(self):
+        """
+        Returns:
+            str: what is listening and when the last shot came in, for the log
         """
-        print("Event happened!")
-        self.sender.emitter.emit(self.getData())
+        if self._settings is None:
+            return "not listening"
+
+        parts = []
+        if self._event is not None:
+            parts.append("event %s %s" % (self._settings[0], "alive" if self._event.is_alive() else "dead"))
+        if self._poller is not None:
+            parts.append("poller %s" % ("alive" if self._poller.is_alive() else "dead"))
+        if self.last_shot is None:
+            parts.append("no shots yet")
+        else:
+            parts.append("%d shots, last %d %.0f s ago" % (self.received, self.last_shot, time.time() - self.last_time))
+        parts.append("%d queued" % self._queue.qsize())
+        return ", ".join(parts)
+
+    def _put_event(self, shot_number):
+        self.put(shot_number, 'event')
+
+    def _put_poll(self, shot_number):
+        self.put(shot_number, 'poll')
 
+    @staticmethod
+    def _cancel_event(event):
+        try:
+            event.cancel()
+        except Exception as e:
+            # MDSplus raises SsSUCCESS on a successful cancel
+            logger.debug("Cancelling MDSplus event: %s" % e)
@@ -0,0 +1,147 @@
+from __future__ import division, print_function
+from PyQt5 import QtCore, QtWidgets, QtGui
+from ..logging.metrics import metrics, stages, GET, BYTES, REQUESTS
+from ..data import mdsplus_helpers as mdsh
+
+
+class PerformanceDialog(QtWidgets.QDialog):
+    """
+    Window that shows the fetch and render metrics (see source.logging.metrics) while PiScope runs
+
+    The table lists every stage with its count, mean, median, 95th percentile and maximum in
+    milliseconds, and how much time the last shot spent in it.  Below it are the requests and
+    bytes the server sent, the throughput while waiting on it, and the signal cache hits.
+    The dialog is not modal and refreshes itself every interval milliseconds while it is shown.
+    """
+    columns = ("Stage", "Count", "Mean (ms)", "Median (ms)", "95% (ms)", "Max (ms)", "Last Shot (s)")
+
+    def __init__(self, registry=None, interval=1000, xloc=None, yloc=None):
+        """
+
+        Args:
+            registry (MetricsRegistry, optional): metrics to show, the application's by default
+            interval (int): milliseconds between refreshes
+            xloc (int): x location on screen to open dialog box
+            yloc (int): y location on screen to open dialog box
+        """
+        super(PerformanceDialog, self).__init__()
+        self.setWindowIcon(QtGui.QIcon("Icons/application-wave.png"))
+        self.registry = registry if registry is not None else metrics
+
+        self.table = QtWidgets.QTableWidget(len(stages), len(self.columns), self)
+        self.shot_label = QtWidgets.QLabel(self)
+        self.transfer_label = QtWidgets.QLabel(self)
+        self.cache_label = QtWidgets.QLabel(self)
+        self.reset_button = QtWidgets.QPushButton("Reset", self)
+        self.buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close)
+
+        self.vbox = QtWidgets.QVBoxLayout()
+        self.hbox = QtWidgets.QHBoxLayout()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+
+        self.init_UI(xloc=xloc, yloc=yloc)
+
+        self.buttons.rejected.connect(self.close)
+        self.reset_button.clicked.connect(self.reset)
+        self.timer.timeout.connect(self.refresh)
+
+    def init_UI(self, xloc=None, yloc=None):
+        """
+        Initializes the user interface
+
+        Args:
+            xloc (int): x location to open the dialog box
+            yloc (int): y location to open the dialog box
+        """
+        if xloc is None:
+            xloc = 200
+        if yloc is None:
+            yloc = 200
+
+        self.setWindowTitle("Performance")
+
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        for row, stage in enumerate(stages):
+            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(stage))
+            for col in range(1, len(self.columns)):
+                item = QtWidgets.QTableWidgetItem("")
+                item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.table.setItem(row, col, item)
+        self.table.resizeColumnsToContents()
+
+        self.hbox.addWidget(self.reset_button)
+        self.hbox.addStretch(1)
+        self.hbox.addWidget(self.buttons)
+
+        self.vbox.addWidget(self.shot_label)
+        self.vbox.addWidget(self.table)
+        self.vbox.addWidget(self.transfer_label)
+        self.vbox.addWidget(self.cache_label)
+        self.vbox.addLayout(self.hbox)
+        self.setLayout(self.vbox)
+
+        self.setGeometry(xloc, yloc, 700, 450)
+        self.refresh()
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super(PerformanceDialog, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(PerformanceDialog, self).hideEvent(event)
+
+    def reset(self, checked=False):
+        """
+        Clears the metrics recorded so far
+        """
+        self.registry.reset()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Fills in the table and labels from a snapshot of the registry
+        """
+        snapshot = self.registry.snapshot()
+        for row, stage in enumerate(stages):
+            summary = snapshot.histograms.get(stage, None)
+            if summary is None:
+                values = [""] * 5
+            else:
+                values = [str(summary.count)] + [_milliseconds(x) for x in (summary.mean, summary.p50,
+                                                                           summary.p95, summary.max)]
+            count_total = snapshot.shot.get(stage, None)
+            values.append("" if count_total is None else "%.3f" % count_total[1])
+            for col, value in enumerate(values, 1):
+                self.table.item(row, col).setText(value)
+
+        if snapshot.shot_number is None:
+            self.shot_label.setText("No shot fetched yet")
+        else:
+            shot_requests = snapshot.shot.get(REQUESTS, (0, 0))[1]
+            shot_bytes = snapshot.shot.get(BYTES, (0, 0))[1]
+            self.shot_label.setText("Last Shot {0:d}: {1:d} requests, {2:.1f} MB".format(
+                snapshot.shot_number, int(shot_requests), shot_bytes / 1024**2))
+
+        requests = snapshot.counters.get(REQUESTS, 0)
+        nbytes = snapshot.counters.get(BYTES, 0)
+        get = snapshot.histograms.get(GET, None)
+        text = "Server: {0:d} requests, {1:.1f} MB".format(int(requests), nbytes / 1024**2)
+        if get is not None and get.total > 0:
+            # the server's evaluation time is in here too, so this is a lower bound on the network
+            text += ", {0:.1f} MB/s while waiting on it".format(nbytes / 1024**2 / get.total)
+        self.transfer_label.setText(text)
+
+        cache_info = mdsh.signal_cache.info()
+        self.cache_label.setText("Signal Cache: {0:d} hits, {1:d} misses, {2:d} signals using {3:.1f} MB".format(
+            cache_info.hits, cache_info.misses, cache_info.items, cache_info.nbytes / 1024**2))
+
+
+def _milliseconds(seconds):
+    if seconds is None:
+        return ""
+    return "%.2f" % (1000.0 * seconds)
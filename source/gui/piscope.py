@@ -1,21 +1,25 @@
 from __future__ import division, print_function
 from PyQt5 import QtCore, QtWidgets, QtGui
 from configobj import ConfigObj
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from .workers import Worker
+from .workers import FetchJobManager, DecimationScheduler
+from .canvas import PiScopeCanvas
 from ..data import mdsplus_helpers as mdsh
+from ..data.prefetch import Prefetcher
 from ..plotting import data_plotter
 from ..config import parser
-from .events import MyEvent
+from .events import ShotListener
 from .edit_configuration import EditConfigDialog
 from .new_configuration import NewConfigDialog
 from .downsample_dialog import EditDownsampleDialog
 from .edit_global import EditGlobalDialog
+from .performance_dialog import PerformanceDialog
 from distutils.util import strtobool
 import logging
 import MDSplus as mds
 from ..logging.piscope_logging import log
+from ..logging.metrics import metrics, LAYOUT
+from ..logging.tracing import tracer
 
 """
 This module contains the :class:`PiScope`.  It is the main GUI element
@@ -37,8 +41,10 @@ class PiScope(QtWidgets.QMainWindow):
         server (str): MDSplus server to retrieve data from.
         tree (str): MDSplus tree name, default is wipal.
         event_name (str): MDSplus event name to catch for auto-update.
+        shot_listener (ShotListener): queues the new shots while auto-update is on
 
-    Note: Auto-updating will only work if you are on the same subnet as your MDSplus server
+    Note: MDSplus events only reach machines on the same subnet as your MDSplus server, elsewhere set
+        shot_poll in the setup section to auto-update by polling the current shot instead
 
     """
 
@@ -60,13 +66,25 @@ class PiScope(QtWidgets.QMainWindow):
         self.server = None
         self.config = None
         self.tree = None
-        self.mds_update_event = None
+        self.shot_listener = ShotListener(self)  # one for the life of the window, see change_auto_update
+        self.shot_poll = None  # seconds between checks of the current shot while auto-updating, None to not poll
+        self.shot_poll_delay = 0.0
         self.config_filename = config_file
         self.threadpool = QtCore.QThreadPool()  # This is where the grabbing of data will take place to not lock the gui
-        self.down_samplers = None
+        self.fetch_jobs = FetchJobManager(self.threadpool)  # a new fetch cancels the one in flight
+        self.decimation_scheduler = DecimationScheduler()  # re-decimates on zoom/pan off the gui thread
+        self.down_samplers = None  # subplot location -> DataDisplayDownsampler, reused while the config is unchanged
+        self.streamed_plots = None  # subplots being filled in as signals arrive
+        self.redraw_pending = False
         self.downsampling_points = 10000
+        self.batch_mode = None
+        self.prefetcher = None
+        self.prefetch_depth = 2
+        self.overlay_shots = []  # shots drawn on top of self.shot_number, see open_overlay_dialog
+        self.performance_dialog = None
         self.node_locs = None
         self.data = None
+        self.current_shot = None  # shot number that shot 0 was resolved to by the last fetch
         self.gs = None
 
         # for the progress bar
@@ -93,6 +111,11 @@ class PiScope(QtWidgets.QMainWindow):
         self.edit_global_action = QtWidgets.QAction(QtGui.QIcon("Icons/gear--pencil.png"),
                                                     "Edit Global Settings...", self)
         self.empty_cache_action = QtWidgets.QAction("Empty Cache", self)
+        self.prefetch_action = QtWidgets.QAction("&Prefetch Shots", self)
+        self.overlay_action = QtWidgets.QAction("&Overlay Shots...", self)
+        self.performance_action = QtWidgets.QAction("Performance...", self)
+        self.trace_action = QtWidgets.QAction("Record &Trace", self)
+        self.export_trace_action = QtWidgets.QAction("Export Trace...", self)
 
         self.centralWidget = QtWidgets.QWidget()
         self.spinBox = QtWidgets.QSpinBox(self)
@@ -100,6 +123,8 @@ class PiScope(QtWidgets.QMainWindow):
 
         self.updateBtn = QtWidgets.QPushButton("Update", self)
         self.updateBtn.setIcon(QtGui.QIcon("Icons/arrow-circle-225.png"))
+        self.cancelBtn = QtWidgets.QPushButton("Cancel", self)
+        self.cancelBtn.setEnabled(False)
         self.status = QtWidgets.QLabel("Idle", self)
 
         self.hbox = QtWidgets.QHBoxLayout()
@@ -124,20 +149,15 @@ class PiScope(QtWidgets.QMainWindow):
             self.load_configuration(config_file)
 
             if shot_number is None:
-                self.shot_number = mdsh.get_current_shot(self.server, self.tree)
+                # Shot 0 is the current shot, its number is filled in once the tree is open
+                self.shot_number = 0
             else:
                 self.shot_number = shot_number
-
-            if self.shot_number is not None:
-                self.spinBox.setValue(self.shot_number)
                 self.shot_number_label.setText("Shot Number: {0:d}".format(self.shot_number))
-                self.updateBtn.setEnabled(False)
-                self.fetch_data(self.shot_number)
-            else:
-                # The only way this can happen is the user didn't enter a shot and we
-                # have failed to get a shot number from the server
-                self.spinBox.setValue(0)
-                self.status.setText("Error Accessing Server")
+
+            self.spinBox.setValue(self.shot_number)
+            self.updateBtn.setEnabled(False)
+            self.fetch_data(self.shot_number)
         else:
             self.shot_number = None
             self.updateBtn.setDisabled(True)
@@ -150,9 +170,15 @@ class PiScope(QtWidgets.QMainWindow):
 
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.check_alive)
-        self.timer.setInterval(10.0 * 1000)
+        self.shot_listener.shot_ready.connect(self.handle_incoming_mds_event)
+        self.timer.setInterval(10 * 1000)
         self.exit_action.setEnabled(True)
         self.updateBtn.clicked.connect(self.update_pressed)
+        self.cancelBtn.clicked.connect(self.cancel_fetch)
+        self.fetch_jobs.partial.connect(self.handle_partial_data)
+        self.fetch_jobs.result.connect(self.handle_fetch_result)
+        self.fetch_jobs.progress.connect(self.update_progress_bar)
+        self.fetch_jobs.error.connect(self.handle_fetch_error)
         self.shareX_action.triggered.connect(self.change_sharex)
         self.openPanelConfigAction.triggered.connect(self.open_edit_configuration_dialog)
         self.save_action.triggered.connect(self.save_configuration)
@@ -164,13 +190,20 @@ class PiScope(QtWidgets.QMainWindow):
         self.edit_global_action.triggered.connect(self.open_edit_global_settings)
         self.open_config_action.triggered.connect(self.open_config_dialog)
         self.empty_cache_action.triggered.connect(self.empty_data_cache)
+        self.prefetch_action.triggered.connect(self.change_prefetch)
+        self.overlay_action.triggered.connect(self.open_overlay_dialog)
+        self.performance_action.triggered.connect(self.open_performance_dialog)
+        self.trace_action.triggered.connect(self.change_tracing)
+        self.export_trace_action.triggered.connect(self.export_trace)
         self.show()
 
     def check_alive(self):
         """
-        Checks the status of the self.mds_update_event thread and writes to log.
+        Writes the status of self.shot_listener to the log and restarts its event or poller if they died.
         """
-        logger.debug("event watcher alive? % s" % str(self.mds_update_event.isAlive()))
+        logger.debug("shot listener: %s" % self.shot_listener.status())
+        if self.shot_listener.restart_dead():
+            logger.warning("Restarted the shot listener")
 
     def init_UI(self):
         """
@@ -184,6 +217,7 @@ class PiScope(QtWidgets.QMainWindow):
         # self.file_menu.addAction(self.openPanelConfigAction)
         self.file_menu.addAction(self.save_action)
         self.file_menu.addAction(self.save_as_action)
+        self.file_menu.addAction(self.export_trace_action)
         self.file_menu.addAction(self.exit_action)
 
         self.edit_menu.addAction(self.edit_global_action)
@@ -194,8 +228,16 @@ class PiScope(QtWidgets.QMainWindow):
         self.option_menu.addAction(self.shareX_action)
         self.option_menu.addAction(self.change_downsample)
         self.option_menu.addAction(self.empty_cache_action)
+        self.option_menu.addAction(self.prefetch_action)
+        self.option_menu.addAction(self.overlay_action)
+        self.option_menu.addAction(self.performance_action)
+        self.option_menu.addAction(self.trace_action)
 
         self.autoUpdate_action.setCheckable(True)
+        self.prefetch_action.setCheckable(True)
+        self.trace_action.setCheckable(True)
+        # tracing may have been turned on from the command line
+        self.trace_action.setChecked(tracer.enabled)
         self.shareX_action.setCheckable(True)
         self.spinBox.setRange(0, 999999)
         self.spinBox.setKeyboardTracking(False)
@@ -207,6 +249,7 @@ class PiScope(QtWidgets.QMainWindow):
         self.spinBox.setFont(self.font)
         self.status.setFont(self.font)
         self.updateBtn.setFont(self.font)
+        self.cancelBtn.setFont(self.font)
         self.shot_number_label.setFont(self.font)
         self.progess_bar.setFont(self.font)
         self.progess_bar.setTextVisible(False)
@@ -214,6 +257,7 @@ class PiScope(QtWidgets.QMainWindow):
         # Shot number and Status Stuff
         self.hbox.addWidget(self.spinBox)
         self.hbox.addWidget(self.updateBtn)
+        self.hbox.addWidget(self.cancelBtn)
         self.hbox.addWidget(self.progess_bar)
         self.hbox.addWidget(self.status)
         self.hbox.addStretch(1)
@@ -261,9 +305,10 @@ class PiScope(QtWidgets.QMainWindow):
             # self.node_locs = self.get_data_locs()
             self.node_locs = parser.get_data_locs(self.config)
             self.update_subplot_config(dlg.column_setup)
+            self.update_prefetcher()
 
             if self.shot_number is None:
-                self.shot_number = mdsh.get_current_shot(self.server, self.tree)
+                self.shot_number = 0
                 self.spinBox.setValue(self.shot_number)
             self.fetch_data(self.shot_number)
 
@@ -289,6 +334,9 @@ class PiScope(QtWidgets.QMainWindow):
                 self.change_sharex(False)
             else:
                 self.modify_shared_axes_list()
+            # subplot options may have changed, start from cleared axes
+            self.down_samplers = None
+            self.update_prefetcher()
             self.fetch_data(self.shot_number)
 
     @log(logger)
@@ -303,18 +351,19 @@ class PiScope(QtWidgets.QMainWindow):
             self.tree = dlg.tree
             self.config['setup']['server'] = self.server
             self.config['setup']['tree'] = self.tree
+            self.update_prefetcher()
 
     def _new_dialog_positions(self):
         """
         Helper function for finding the x and y location to open a dialog box at.
 
         Returns:
-            xloc (float): x location on the screen
-            yloc (float): y location on the screen
+            xloc (int): x location on the screen
+            yloc (int): y location on the screen
         """
         rect = self.geometry()
-        xloc = rect.x() + 0.1 * rect.width()
-        yloc = rect.y() + 0.1 * rect.height()
+        xloc = int(rect.x() + 0.1 * rect.width())
+        yloc = int(rect.y() + 0.1 * rect.height())
         return xloc, yloc
 
     @log(logger)
@@ -343,14 +392,10 @@ class PiScope(QtWidgets.QMainWindow):
             self.change_sharex(False)
 
             if self.shot_number is None:
-                self.shot_number = mdsh.get_current_shot(self.server, self.tree)
+                self.shot_number = 0
 
-            if self.shot_number is None:
-                self.spinBox.setValue(0)
-                self.status.setText("Error Accessing Server")
-            else:
-                self.spinBox.setValue(self.shot_number)
-                self.status.setText("Idle")
+            self.spinBox.setValue(self.shot_number)
+            self.status.setText("Idle")
             # Start up the new MDSplus event if it needs to be
             self.autoUpdate_action.setChecked(update_state)
             self.change_auto_update(update_state)
@@ -383,9 +428,19 @@ class PiScope(QtWidgets.QMainWindow):
         self.event_name = event_name
         self.node_locs = locs
 
+        self.batch_mode = mdsh.configure_from_setup(config['setup'])
+
+        self.shot_poll = float(config['setup'].get('shot_poll', 0)) or None
+        self.shot_poll_delay = float(config['setup'].get('shot_poll_delay', 0))
+
+        if 'prefetch' in config['setup']:
+            self.prefetch_depth = int(config['setup']['prefetch'])
+            self.prefetch_action.setChecked(self.prefetch_depth > 0)
+
         self.enable_actions_after_config()
         self.update_subplot_config(col_setup)
         self.modify_shared_axes_list()
+        self.change_prefetch(None)
 
     @log(logger)
     def update_subplot_config(self, col_setup):
@@ -405,6 +460,7 @@ class PiScope(QtWidgets.QMainWindow):
             self.figure = None
             self.toolbar = None
             self.canvas = None
+        self.down_samplers = None
 
         if self.axs is not None:
             for ax in self.axs:
@@ -416,7 +472,7 @@ class PiScope(QtWidgets.QMainWindow):
         cols = [x for x in col_setup if x > 0]
 
         self.figure, self.axs, self.gs = data_plotter.create_figure(cols)
-        self.canvas = FigureCanvas(self.figure)
+        self.canvas = PiScopeCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, self)
 
         self.vbox.addWidget(self.toolbar, 2)
@@ -425,38 +481,38 @@ class PiScope(QtWidgets.QMainWindow):
         self.vbox.addLayout(self.hbox)
 
     @log(logger)
+    @tracer.traced('fetch_data', 'gui')
     @QtCore.pyqtSlot(int)
     def fetch_data(self, shot_number):
         """
-        Starts a QThreadPool of Workers (workers.Worker) to fetch data if the tree can be opened.
+        Starts a Worker (workers.Worker) through self.fetch_jobs to fetch data if the tree can be opened.
 
-        Function exits immediately if self.acquiring_data is True
+        If data is already being acquired, that fetch is cancelled and anything it still sends is dropped, so the
+            newest request always wins.
 
         Next step is to count the number of signals to be fetched.
 
-        Before starting workers, we check to see if the tree can be opened for this shot number.  If not, we call
-            self.handle_mdsplus_data with data=None and exit.
-
-        If the tree is available, we start a QThreadPool with instances of Worker for fetching data.  Each Worker
-            fetches only one signal.
+        A Worker running mdsh.fetch_shot first checks that the tree can be opened for this shot number, then
+            fetches the signals with a pool of threads.  Neither step blocks the GUI, and the result goes to
+            self.handle_fetch_result.  Every signal is plotted by self.handle_partial_data as soon as it arrives,
+            on the line that showed the same signal for the last shot if there is one.
 
         Args:
             shot_number (int): Shot number to fetch data from
         """
 
         if self.acquiring_data:
-            # already grabbing data, do nothing
-            print('already acquiring')
-            logger.debug("User tried to grab more data when already acquiring.  Ignoring User request.")
-            return
+            logger.debug("Cancelling the fetch of shot %d for shot %d" % (self.shot_number, shot_number))
+            self.fetch_jobs.cancel()
 
         self.acquiring_data = True
         self.status.setText("Retrieving Data from Shot {0:d}".format(shot_number))
         self.shot_number = shot_number
+        metrics.begin_shot(shot_number)
 
         node_locs = self.node_locs
         keys = node_locs.keys()
-        ignore_items = ['legend', 'xlabel', 'ylabel', 'xlim', 'ylim', 'color', 'noresample', 'xshare']
+        ignore_items = parser.subplot_options
         self.data = dict()
         self.completion = 0
         self.n_positions = 0
@@ -471,31 +527,122 @@ class PiScope(QtWidgets.QMainWindow):
         # No data, turn acquring_data off, go back to event loop
         if self.n_positions == 0:
             self.status.setText('Idle')
+            metrics.end_shot()
             self.acquiring_data = False
+            self.streamed_plots = None
+            self.cancelBtn.setEnabled(False)
             return
 
-        # logger.debug("Asking if tree is available to be opened")
-        tree_available = mdsh.check_open_tree(shot_number, self.server, self.tree)
-        # print("is the tree available?", tree_available)
+        # Background prefetching waits until the shot on display is in
+        if self.prefetcher is not None:
+            self.prefetcher.pause()
+
+        # Signals are plotted one at a time as they arrive, onto the existing lines where possible
+        self.streamed_plots = data_plotter.start_all_plots(self.axs, node_locs, downsampling=self.downsampling_points,
+                                                           scheduler=self.decimation_scheduler,
+                                                           previous=self.down_samplers,
+                                                           aligned=bool(self.overlay_shots))
+        if self.streamed_plots != self.down_samplers:
+            # some axes were cleared
+            self.canvas.draw_idle()
+
+        # Trying to grab data using futures.  A cancelled fetch that is still finishing isn't counted for this shot
+        if self.overlay_shots:
+            self.fetch_jobs.submit(metrics.for_shot(mdsh.fetch_shots), self.server, self.tree,
+                                   [shot_number] + self.overlay_shots, node_locs, batch=self.batch_mode)
+        else:
+            self.fetch_jobs.submit(metrics.for_shot(mdsh.fetch_shot), self.server, self.tree, shot_number, node_locs,
+                                   batch=self.batch_mode)
+        self.cancelBtn.setEnabled(True)
 
-        # Can't open tree, set acquiring_data to false, call handle_mdplus_data(None)
-        if not tree_available:
-            # print('passing None to handle mdsplus data')
-            self.acquiring_data = False
-            logger.warning("tree was unable to be opened. shot = %d" % shot_number)
-            self.handle_mdsplus_data(None)
+    @log(logger)
+    def cancel_fetch(self, checked=False):
+        """
+        Cancels the fetch in flight and finishes the plots with the signals that arrived so far
+        """
+        if not self.acquiring_data:
             return
 
-        # Trying to grab data using futures
-        worker = Worker(mdsh.retrieve_all_data, self.server, self.tree, shot_number, node_locs)
-        worker.signals.result.connect(self.handle_mdsplus_data)
-        worker.signals.progress.connect(self.update_progress_bar)
-        self.threadpool.start(worker)
+        self.fetch_jobs.cancel()
+        logger.debug("User cancelled the fetch of shot %d" % self.shot_number)
+        self.handle_mdsplus_data(self.data)
+        self.status.setText("Cancelled Shot {0:d}".format(self.shot_number))
+
+    @log(logger)
+    def handle_fetch_error(self, error):
+        """
+        Cleans up after a fetch that raised an exception
+
+        Args:
+            error (tuple): (exctype, value, traceback.format_exc())
+        """
+        logger.error("Error fetching shot %d: %s" % (self.shot_number, error[1]))
+        self.handle_mdsplus_data(None)
 
     def update_progress_bar(self, value):
         self.progess_bar.setValue(value)
 
+    @tracer.traced('handle_partial_data', 'gui')
+    def handle_partial_data(self, item):
+        """
+        Plots one signal into its subplot as soon as it has been retrieved
+
+        The legend, labels and limits are left for handle_mdsplus_data once every signal is in.
+
+        Args:
+            item (tuple): (subplot location, Data or None)
+        """
+        if self.streamed_plots is None:
+            return
+
+        pos, d = item
+        down_sampler = self.streamed_plots.get(pos, None)
+        if down_sampler is None:
+            return
+        # kept in case the fetch is cancelled, see cancel_fetch
+        self.data[pos].append(d)
+
+        line = data_plotter.add_to_plot(down_sampler.ax, self.node_locs[pos], d, down_sampler)
+        if line is None:
+            return
+
+        if down_sampler.ax.get_autoscalex_on():
+            # new axis, the limits follow the data
+            down_sampler.ax.relim()
+            down_sampler.ax.autoscale_view()
+            self.canvas.draw_idle()
+        elif not self.redraw_pending:
+            # reused axis with fixed limits, only the inside needs redrawing
+            self.redraw_pending = True
+            QtCore.QTimer.singleShot(0, self.redraw_streamed_plots)
+
+    def redraw_streamed_plots(self):
+        """
+        Blits the subplots that got new data since the last redraw
+        """
+        self.redraw_pending = False
+        if self.streamed_plots is not None:
+            data_plotter.redraw_changed(self.canvas, self.streamed_plots.values())
+
     @log(logger)
+    def handle_fetch_result(self, result):
+        """
+        Takes the mdsh.FetchResult of a Worker started by self.fetch_data and plots its data
+
+        Args:
+            result (FetchResult): shot number that was opened and the data dictionary, None if the tree
+                could not be opened
+        """
+        if result.data is None:
+            logger.warning("tree was unable to be opened. shot = %d" % self.shot_number)
+        else:
+            self.current_shot = result.shot_number
+            # shot 0 shows as the number it resolved to, so stepping goes to its neighbours
+            self.shot_number = result.shot_number
+        self.handle_mdsplus_data(result.data)
+
+    @log(logger)
+    @tracer.traced('handle_mdsplus_data', 'gui')
     def handle_mdsplus_data(self, data):
         """
         Plots data if there is data to be plotted.  Otherwise, plot is cleared and function is exited.
@@ -504,7 +651,11 @@ class PiScope(QtWidgets.QMainWindow):
 
         If data is an empty dictionary, there wasn't any data in the tree.
 
-        Else, we can plot the data by calling data_plotter.plot_all_data
+        Else, the signals are put on the existing lines, or if the signals were already plotted as they
+        arrived (see handle_partial_data), only the legends, labels and limits are added.
+
+        The figure is only fully redrawn if an axis was cleared or its limits changed.  Otherwise only the inside
+        of the axes with new data is redrawn.
 
         Args:
             data (dict): data dictionary with all of the signals to be plotted
@@ -512,12 +663,13 @@ class PiScope(QtWidgets.QMainWindow):
         # Finished acquiring data
         self.data = data
         self.acquiring_data = False
+        self.cancelBtn.setEnabled(False)
+        streamed_plots = self.streamed_plots
+        self.streamed_plots = None
 
-        # Clear all the axes
         axs = self.axs
-        for axes in axs:
-            for ax in axes:
-                ax.cla()
+        previous = self.down_samplers
+        limits = data_plotter.view_limits(axs)
 
         # Check if data was actually passed to this function.  Plot if it is.
         if data is None:
@@ -525,8 +677,16 @@ class PiScope(QtWidgets.QMainWindow):
             logger.warning("No data for %d" % self.shot_number)
 
         elif mdsh.check_data_dictionary(self.data):
-            self.down_samplers = data_plotter.plot_all_data(axs, self.node_locs, data,
-                                                            downsampling=self.downsampling_points)
+            if streamed_plots is None:
+                # same data or new downsampling, put it on the existing lines
+                streamed_plots = data_plotter.start_all_plots(axs, self.node_locs,
+                                                              downsampling=self.downsampling_points,
+                                                              scheduler=self.decimation_scheduler, previous=previous,
+                                                              aligned=bool(self.overlay_shots))
+                for pos in self.node_locs:
+                    for d in data[pos]:
+                        data_plotter.add_to_plot(streamed_plots[pos].ax, self.node_locs[pos], d, streamed_plots[pos])
+            self.down_samplers = data_plotter.finish_all_plots(self.node_locs, streamed_plots)
             self.status.setText("Idle")
             logger.debug("There is data for %d, now plotting" % self.shot_number)
         else:
@@ -534,50 +694,100 @@ class PiScope(QtWidgets.QMainWindow):
             self.data = None
             logger.debug("No data was found for %d" % self.shot_number)
 
+        if self.data is None:
+            for axes in axs:
+                for ax in axes:
+                    ax.cla()
+            self.down_samplers = None
+
         # Handle MDSplus shot number being zero
-        if self.shot_number == 0:
-            current_shot = mdsh.get_current_shot(self.server, self.tree)
-            self.shot_number_label.setText("Shot {0:d}".format(current_shot))
+        if self.shot_number == 0 and self.current_shot is not None:
+            # resolved by the last fetch, see handle_fetch_result
+            label = "Shot {0:d}".format(self.current_shot)
         else:
-            self.shot_number_label.setText("Shot {0:d}".format(self.shot_number))
+            label = "Shot {0:d}".format(self.shot_number)
+        if self.overlay_shots:
+            label += " vs {0}".format(", ".join(str(shot) for shot in self.overlay_shots))
+        self.shot_number_label.setText(label)
 
         # Redraw GUI elements
         self.spinBox.setValue(self.shot_number)
-        self.figure.tight_layout()
-        #self.gs.tight_layout(self.figure)
         self.toolbar.update()
         self.toolbar.push_current()
-        self.canvas.draw()
-        self.progess_bar.setValue(0.0)
+        reused = self.down_samplers is not None and self.down_samplers == previous
+        if reused and data_plotter.view_limits(axs) == limits:
+            data_plotter.redraw_changed(self.canvas, self.down_samplers.values())
+        else:
+            if not reused:
+                # the layout only changes when axes are cleared and replotted
+                with metrics.timer(LAYOUT):
+                    self.figure.tight_layout()
+                #self.gs.tight_layout(self.figure)
+            self.canvas.draw()
+            for down_sampler in (self.down_samplers or dict()).values():
+                down_sampler.changed = False
+        self.progess_bar.setValue(0)
         self.updateBtn.setEnabled(True)
+        # later redraws and zooms aren't part of fetching the shot
+        metrics.end_shot()
         mdsh.log_lru_cache()
 
+        if self.prefetcher is not None:
+            self.prefetcher.resume()
+            shown_shot = self.current_shot if self.shot_number == 0 else self.shot_number
+            if shown_shot:
+                self.prefetcher.center(shown_shot)
+
+    @log(logger)
+    def change_prefetch(self, state):
+        """
+        Starts or stops prefetching of the shots around the displayed one in the background
+
+        Args:
+            state (QState): state emitted from action, (not used)
+        """
+        if self.prefetch_action.isChecked():
+            if self.prefetcher is None:
+                logger.debug("Prefetching is now on")
+                self.prefetcher = Prefetcher(depth=self.prefetch_depth if self.prefetch_depth > 0 else 2)
+                self.prefetcher.start()
+            self.update_prefetcher()
+        elif self.prefetcher is not None:
+            logger.debug("Prefetching is now off")
+            self.prefetcher.stop()
+            self.prefetcher = None
+
+    def update_prefetcher(self):
+        """
+        Hands the current server, tree and signals to the prefetcher, if prefetching is on
+        """
+        if self.prefetcher is None or self.node_locs is None:
+            return
+
+        self.prefetcher.configure(self.server, self.tree, self.node_locs)
+        shown_shot = self.current_shot if self.shot_number == 0 else self.shot_number
+        if shown_shot and not self.acquiring_data:
+            self.prefetcher.center(shown_shot)
+
     @log(logger)
     def change_auto_update(self, state):
         """
-        Toggles auto-update functionality with MDSplus events
+        Toggles auto-update functionality with MDSplus events, and polling of the current shot if shot_poll is set
 
         Args:
             state (QState): state emitted from action, (not used)
         """
-        if self.event_name:
+        if self.event_name or self.shot_poll:
             # if state == QtCore.Qt.Checked:
             if self.autoUpdate_action.isChecked():
-                if self.mds_update_event is None:
-                    logger.debug("Auto update is now on")
-                    self.mds_update_event = MyEvent(self.event_name)
-                    self.mds_update_event.sender.emitter.connect(self.handle_incoming_mds_event)
-                    self.timer.start()
-            else:
-                if self.mds_update_event is not None and self.mds_update_event.isAlive():
-                    self.timer.stop()
-                    try:
-                        self.mds_update_event.cancel()
-                    except mds.mdsExceptions.SsSUCCESS as e:
-                        print(e)
-                        logger.error("STUPID MDSPLUS CANCEL ERROR, %s" % e.message)
-                    self.mds_update_event = None
-                    logger.debug("Auto update is now off.")
+                self.shot_listener.start(self.event_name, self.server, self.tree, poll_interval=self.shot_poll,
+                                         poll_delay=self.shot_poll_delay)
+                self.timer.start()
+                logger.debug("Auto update is now on")
+            elif self.shot_listener.running:
+                self.timer.stop()
+                self.shot_listener.stop()
+                logger.debug("Auto update is now off.")
 
     @log(logger)
     def change_sharex(self, checked):
@@ -609,7 +819,10 @@ class PiScope(QtWidgets.QMainWindow):
         Otherwise, the data is just replotted.
         """
         shot_number = self.spinBox.value()
-        if shot_number == self.shot_number and self.data is not None:
+        if shot_number == self.shot_number and self.acquiring_data:
+            # already on its way
+            return
+        elif shot_number == self.shot_number and self.data is not None:
             # No change, just replot
             self.handle_mdsplus_data(self.data)
         else:
@@ -671,6 +884,82 @@ class PiScope(QtWidgets.QMainWindow):
             else:
                 self.fetch_data(self.shot_number)
 
+    @log(logger)
+    def open_overlay_dialog(self, checked):
+        """
+        Asks for the shots to overlay on the displayed shot and refetches
+
+        Every subplot then shows its signals from the displayed shot and from each of these shots.
+        An empty list turns the overlay off.
+        """
+        current = ", ".join(str(shot) for shot in self.overlay_shots)
+        text, ok = QtWidgets.QInputDialog.getText(self, "Overlay Shots",
+                                                  "Shots to overlay (e.g. 1200-1203, 1210), empty for none:",
+                                                  text=current)
+        if not ok:
+            return
+
+        try:
+            shots = parser.parse_shots([text])
+        except ValueError:
+            self.status.setText("Not a list of shots: {0}".format(text))
+            return
+
+        self.overlay_shots = shots
+        logger.debug("Overlaying shots %s" % shots)
+        if self.node_locs is not None and self.shot_number is not None:
+            self.fetch_data(self.shot_number)
+
+    @log(logger)
+    def open_performance_dialog(self, checked):
+        """
+        Shows the PerformanceDialog with the fetch and render metrics, which updates itself while it is open
+        """
+        if self.performance_dialog is None:
+            xloc, yloc = self._new_dialog_positions()
+            self.performance_dialog = PerformanceDialog(xloc=xloc, yloc=yloc)
+        self.performance_dialog.show()
+        self.performance_dialog.raise_()
+
+    @log(logger)
+    def change_tracing(self, checked):
+        """
+        Starts or stops recording the shot pipeline for File -> Export Trace, see source.logging.tracing
+
+        Args:
+            checked (bool): state of the action
+        """
+        if self.trace_action.isChecked():
+            logger.debug("Tracing is now on")
+            tracer.start()
+        else:
+            logger.debug("Tracing is now off, %d spans recorded" % len(tracer))
+            tracer.stop()
+
+    @log(logger)
+    def export_trace(self, checked):
+        """
+        Saves the spans recorded so far as a Chrome trace, to open in chrome://tracing or https://ui.perfetto.dev
+        """
+        if len(tracer) == 0:
+            self.status.setText("Nothing traced yet, turn on Options -> Record Trace")
+            return
+
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Trace", "piscope-trace.json",
+                                                            "Chrome Trace (*.json)")
+        if not filename:
+            return
+
+        n_spans = tracer.export(filename)
+        logger.debug("Wrote %d spans to %s" % (n_spans, filename))
+        self.status.setText("Wrote {0:d} spans to {1}".format(n_spans, filename))
+
+    def closeEvent(self, event):
+        self.shot_listener.stop()
+        if self.performance_dialog is not None:
+            self.performance_dialog.close()
+        super(PiScope, self).closeEvent(event)
+
     @log(logger)
     def modify_shared_axes_list(self):
         """
@@ -685,22 +974,23 @@ class PiScope(QtWidgets.QMainWindow):
                 self.shared_axs.append(self.axs[j][i])
 
     @log(logger)
-    @QtCore.pyqtSlot(int)
-    def handle_incoming_mds_event(self, shot_number):
+    @QtCore.pyqtSlot()
+    def handle_incoming_mds_event(self):
         """
-        Cancels the old event, starts a new one, and calls fetch data on the incoming shot_number
+        Calls fetch data on the newest shot queued by self.shot_listener
 
-        Args:
-            shot_number (int): shot number from the MDSplus event
+        Shots that came in together (or while the GUI was busy) are coalesced into one fetch of the newest,
+        which takes over from a fetch in flight.
         """
-        try:
-            self.mds_update_event.cancel()
-            self.mds_update_event = None
-        except mds.mdsExceptions.SsSUCCESS as e:
-            print(e)
-            logger.error("STUPID MDSPLUS CANCEL ERROR in handle_incoming_mds_event, %s" % e.message)
-        self.mds_update_event = MyEvent(self.event_name)
-        self.mds_update_event.sender.emitter.connect(self.handle_incoming_mds_event)
+        shot_number = self.shot_listener.newest()
+        if shot_number is None:
+            # already taken by an earlier call
+            return
+
+        tracer.instant('mds_event', 'gui', shot=shot_number)
+        if self.acquiring_data and shot_number == self.shot_number:
+            # already on its way
+            return
         self.updateBtn.setEnabled(False)
         self.fetch_data(shot_number)
 
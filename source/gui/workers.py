@@ -1,8 +1,14 @@
 from __future__ import division, print_function
 import PyQt5.QtCore as QtCore
+from ..data.cancel import CancelToken
+from ..logging.tracing import tracer
+import logging
 import traceback
 import sys
 
+logger = logging.getLogger('pi-scope-logger')
+
+
 class WorkerSignals(QtCore.QObject):
     """
     Defines the signals available from a running worker thread.
@@ -21,11 +27,15 @@ class WorkerSignals(QtCore.QObject):
     progress
         `int` indicating % progress
 
+    partial
+        `object` part of the result that is ready before the processing is finished
+
     """
     finished = QtCore.pyqtSignal()
     error = QtCore.pyqtSignal(tuple)
     result = QtCore.pyqtSignal(object)
     progress = QtCore.pyqtSignal(int)
+    partial = QtCore.pyqtSignal(object)
 
 
 class Worker(QtCore.QRunnable):
@@ -55,7 +65,8 @@ class Worker(QtCore.QRunnable):
 
         # Retrieve args/kwargs here; and fire processing using them
         try:
-            result = self.fn(*self.args, **self.kwargs, progress_signal=self.signals.progress)
+            with tracer.span('worker', 'qt', fn=getattr(self.fn, '__name__', repr(self.fn))):
+                result = self.fn(*self.args, **self.kwargs, progress_signal=self.signals.progress)
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
@@ -66,4 +77,168 @@ class Worker(QtCore.QRunnable):
             self.signals.finished.emit()  # Done
 
 
+class FetchJobManager(QtCore.QObject):
+    """
+    Runs fetches in a QThreadPool one job at a time, where a new job preempts the one in flight
+
+    Every job gets a CancelToken passed to its function as cancel.  Submitting a new job cancels
+    the token of the running one, and whatever the old job emits afterwards (partial results,
+    progress, its result or an error) is dropped, so only the newest job reaches the slots
+    connected to this manager.
+
+    Signals:
+        partial: forwarded from WorkerSignals.partial of the current job
+        result: forwarded from WorkerSignals.result of the current job
+        progress: forwarded from WorkerSignals.progress of the current job
+        error: forwarded from WorkerSignals.error of the current job
+    """
+    partial = QtCore.pyqtSignal(object)
+    result = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+    error = QtCore.pyqtSignal(tuple)
+
+    def __init__(self, threadpool=None):
+        """
+
+        Args:
+            threadpool (QtCore.QThreadPool, optional): pool to run the jobs in, a new one by default
+        """
+        super(FetchJobManager, self).__init__()
+        self.threadpool = threadpool if threadpool is not None else QtCore.QThreadPool()
+        self._signals = None  # WorkerSignals of the current job
+        self._token = None
+
+    @property
+    def busy(self):
+        """bool: True while the current job is running"""
+        return self._signals is not None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Cancels the current job and starts fn(*args, cancel=token, partial_signal=..., **kwargs) in the pool
+
+        Args:
+            fn (callable): fetch to run, has to accept cancel, partial_signal and progress_signal keywords
+            *args: positional arguments for fn
+            **kwargs: keyword arguments for fn
+        """
+        self.cancel()
+
+        self._token = CancelToken()
+        worker = Worker(fn, *args, cancel=self._token, **kwargs)
+        worker.kwargs['partial_signal'] = worker.signals.partial
+        worker.signals.partial.connect(self._partial)
+        worker.signals.result.connect(self._result)
+        worker.signals.progress.connect(self._progress)
+        worker.signals.error.connect(self._error)
+        worker.signals.finished.connect(self._finished)
+        self._signals = worker.signals
+        self.threadpool.start(worker)
+
+    def cancel(self):
+        """
+        Cancels the current job, nothing it emits from now on is forwarded
+        """
+        if self._token is not None:
+            self._token.cancel()
+            logger.debug("Cancelled the running fetch")
+        self._token = None
+        self._signals = None
+
+    def _current(self):
+        return self._signals is not None and self.sender() is self._signals
+
+    @QtCore.pyqtSlot(object)
+    def _partial(self, item):
+        if self._current():
+            self.partial.emit(item)
+
+    @QtCore.pyqtSlot(object)
+    def _result(self, result):
+        if self._current():
+            self.result.emit(result)
+
+    @QtCore.pyqtSlot(int)
+    def _progress(self, value):
+        if self._current():
+            self.progress.emit(value)
+
+    @QtCore.pyqtSlot(tuple)
+    def _error(self, error):
+        if self._current():
+            self.error.emit(error)
+
+    @QtCore.pyqtSlot()
+    def _finished(self):
+        if self._current():
+            self._signals = None
+            self._token = None
+
+
+class DecimationScheduler(QtCore.QObject):
+    """
+    Runs the re-decimation of DataDisplayDownsamplers in a QThreadPool instead of the GUI thread
+
+    Only one decimation per downsampler runs at a time.  Requests that arrive while one
+    is running are coalesced so that only the newest one is run afterwards, and results
+    that are out of date by the time they arrive are dropped by the downsampler.  Every
+    canvas with updated lines gets a single draw_idle once the finished results are applied.
+    """
+    def __init__(self, threadpool=None):
+        """
+
+        Args:
+            threadpool (QtCore.QThreadPool, optional): pool to run the decimation in, a new one by default
+        """
+        super(DecimationScheduler, self).__init__()
+        self.threadpool = threadpool if threadpool is not None else QtCore.QThreadPool()
+        self._running = dict()  # downsampler -> Worker
+        self._pending = dict()  # downsampler -> (generation, xstart, xend)
+        self._canvases = set()
 
+    def submit(self, downsampler, generation, xstart, xend):
+        """
+        Queues a decimation of downsampler for the x range
+
+        Args:
+            downsampler (DataDisplayDownsampler): downsampler to run
+            generation (int): downsampler.generation this request belongs to
+            xstart (float): start of the view range
+            xend (float): end of the view range
+        """
+        if downsampler in self._running:
+            # replaces any older request that hasn't started yet
+            self._pending[downsampler] = (generation, xstart, xend)
+            return
+
+        worker = Worker(_decimate, downsampler, generation, xstart, xend)
+        worker.signals.result.connect(self._finished)
+        self._running[downsampler] = worker
+        self.threadpool.start(worker)
+
+    @QtCore.pyqtSlot(object)
+    def _finished(self, result):
+        downsampler, generation, results = result
+        self._running.pop(downsampler, None)
+
+        if results is not None and downsampler.apply(generation, results):
+            if not self._canvases:
+                QtCore.QTimer.singleShot(0, self._draw)
+            self._canvases.add(downsampler.ax.figure.canvas)
+
+        if downsampler in self._pending:
+            self.submit(downsampler, *self._pending.pop(downsampler))
+
+    def _draw(self):
+        canvases = self._canvases
+        self._canvases = set()
+        for canvas in canvases:
+            canvas.draw_idle()
+
+
+def _decimate(downsampler, generation, xstart, xend, progress_signal=None):
+    try:
+        return downsampler, generation, downsampler.decimate(xstart, xend)
+    except Exception:
+        traceback.print_exc()
+        return downsampler, generation, None
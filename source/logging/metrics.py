@@ -0,0 +1,311 @@
+from __future__ import division, print_function
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from .tracing import tracer
+import bisect
+import threading
+import timeit
+"""
+Module metrics
+==============
+Defines Histogram and MetricsRegistry, and the registry every part of PiScope records into, metrics.
+The stages of getting a shot on screen are timed into histograms (connect, open_tree, tdi_get,
+convert, decimate, artists, layout, draw and the per-signal, per-batch and per-shot totals) and
+the bytes and requests sent by the server are counted, so a slow shot can be pinned on the
+server, the network or matplotlib.  Options -> Performance shows them while PiScope runs.
+Every timed stage is also a span on the timeline of the tracer, see source.logging.tracing.
+"""
+
+# connecting to the server
+CONNECT = 'connect'
+# openTree on a new or reused connection
+OPEN_TREE = 'open_tree'
+# waiting for the server to evaluate and send a TDI expression (or a GetMany)
+GET = 'tdi_get'
+# turning MDSplus data into numpy arrays
+CONVERT = 'convert'
+# retrieving one signal, from asking for a connection to having its Data
+SIGNAL = 'signal'
+# retrieving a batch of signals with one GetMany, see the batch setting
+BATCH = 'batch'
+# retrieving one shot, from opening the tree to having every signal
+SHOT = 'shot'
+# decimating one line for display
+DECIMATE = 'decimate'
+# creating and updating lines, legends, labels and limits
+ARTISTS = 'artists'
+# tight_layout of the figure
+LAYOUT = 'layout'
+# rendering the canvas, or blitting the subplots that changed
+DRAW = 'draw'
+
+stages = (CONNECT, OPEN_TREE, GET, CONVERT, SIGNAL, BATCH, SHOT, DECIMATE, ARTISTS, LAYOUT, DRAW)
+
+# counters
+BYTES = 'bytes'
+REQUESTS = 'requests'
+
+HistogramSummary = namedtuple('HistogramSummary', ['count', 'total', 'mean', 'min', 'p50', 'p95', 'max'])
+Snapshot = namedtuple('Snapshot', ['histograms', 'counters', 'shot_number', 'shot'])
+
+
+class Histogram(object):
+    """
+    Distribution of durations in logarithmic buckets, from 10 us to 100 s with four buckets per decade
+
+    Percentiles are read off the buckets, so they are accurate to about a third of their value,
+    while recording stays constant time and memory however many samples there are.
+
+    Attributes:
+        count (int): number of samples
+        total (float): sum of the samples
+        min (float): smallest sample, None before the first
+        max (float): largest sample, None before the first
+        counts (list): samples in each bucket, the last one for anything above the top bound
+    """
+    bounds = [10.0 ** (k / 4.0) for k in range(-20, 9)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def percentile(self, q):
+        """
+        Returns:
+            float: upper bound of the bucket holding the q-th percentile (0 < q <= 100), None if empty
+        """
+        if self.count == 0:
+            return None
+
+        rank = q / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                bound = self.bounds[idx] if idx < len(self.bounds) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns:
+            HistogramSummary: count, total, mean, min, median, 95th percentile and max
+        """
+        mean = self.total / self.count if self.count else None
+        return HistogramSummary(self.count, self.total, mean, self.min, self.percentile(50),
+                                self.percentile(95), self.max)
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe collection of histograms and counters, with totals for the shot being shown
+
+    Everything recorded from begin_shot until end_shot is also added to the totals of that
+    shot, so the last shot can be broken down by stage.  Work done in the background (e.g.
+    prefetching other shots) runs inside background and only goes into the histograms and
+    counters, as does anything recorded after the shot is on screen.  The fetch of a shot is
+    wrapped with for_shot, so a fetch that was cancelled but is still finishing doesn't add to
+    the totals of the shot that replaced it.  Work a thread hands to other threads is wrapped
+    with carry to be recorded the same way.
+
+    Example::
+
+        from source.logging.metrics import metrics, GET
+        with metrics.timer(GET):
+            data = connection.get(expression)
+        p95 = metrics.snapshot().histograms[GET].p95
+
+    Attributes:
+        enabled (bool): while False nothing is recorded
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._histograms = dict()
+        self._counters = dict()
+        self._shot_number = None
+        self._shot = dict()  # name -> [count, total] between begin_shot and end_shot
+        self._shot_open = False
+        self._generation = 0  # incremented by begin_shot, see for_shot
+        self._local = threading.local()  # background and generation of the work on each thread
+
+    def observe(self, name, value):
+        """
+        Adds a sample to the histogram name
+
+        Args:
+            name (str): histogram, one of stages
+            value (float): duration in seconds
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name, None)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(value)
+            self._tally(name, value)
+
+    def count(self, name, value=1):
+        """
+        Adds value to the counter name
+
+        Args:
+            name (str): counter, e.g. BYTES or REQUESTS
+            value (int): amount to add
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+            self._tally(name, value)
+
+    @contextmanager
+    def timer(self, name, **args):
+        """
+        Context manager that observes how long its block took in the histogram name
+
+        The block is also recorded as a span named name while tracing is on.
+
+        Args:
+            name (str): histogram, one of stages
+            **args: shown with the span on the trace timeline, e.g. the signal name
+        """
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            duration = timeit.default_timer() - start
+            self.observe(name, duration)
+            if tracer.enabled:
+                tracer.add(name, 'stage', start, duration, args)
+
+    def timed(self, name):
+        """
+        Decorator that observes how long every call of the function took in the histogram name
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def background(self):
+        """
+        Context manager for work on the current thread that isn't part of the shot being shown
+        """
+        self._local.background = True
+        try:
+            yield
+        finally:
+            self._local.background = False
+
+    def carry(self, fn):
+        """
+        Wraps fn to be recorded like the calling thread, background or for a shot, on whichever thread it runs
+
+        Args:
+            fn (callable): work to hand to another thread, e.g. through an executor
+
+        Returns:
+            callable: fn wrapped
+        """
+        return self._bound(fn, getattr(self._local, 'background', False), getattr(self._local, 'generation', None))
+
+    def for_shot(self, fn):
+        """
+        Wraps fn, the fetch of the shot begun last, so that it stops adding to the totals once another shot is begun
+
+        Args:
+            fn (callable): fetch of the shot, the work it hands to other threads has to be wrapped with carry
+
+        Returns:
+            callable: fn wrapped
+        """
+        with self._lock:
+            generation = self._generation
+        return self._bound(fn, False, generation)
+
+    def begin_shot(self, shot_number):
+        """
+        Starts the totals of a new shot
+
+        Args:
+            shot_number (int): shot being fetched
+        """
+        with self._lock:
+            self._shot_number = shot_number
+            self._shot = dict()
+            self._shot_open = True
+            self._generation += 1
+
+    def end_shot(self):
+        """
+        Stops adding to the totals of the shot, once it is on screen
+        """
+        with self._lock:
+            self._shot_open = False
+
+    def snapshot(self):
+        """
+        Returns:
+            Snapshot: histogram names mapped to HistogramSummary, counter values, the shot the totals
+                are for and its names mapped to (count, total)
+        """
+        with self._lock:
+            histograms = dict((name, histogram.summary()) for name, histogram in self._histograms.items())
+            shot = dict((name, tuple(value)) for name, value in self._shot.items())
+            return Snapshot(histograms, dict(self._counters), self._shot_number, shot)
+
+    def reset(self):
+        """
+        Forgets everything recorded so far
+        """
+        with self._lock:
+            self._histograms = dict()
+            self._counters = dict()
+            self._shot = dict()
+
+    def _tally(self, name, value):
+        # called with the lock held
+        if not self._shot_open or getattr(self._local, 'background', False):
+            return
+        generation = getattr(self._local, 'generation', None)
+        if generation is not None and generation != self._generation:
+            # a fetch of an earlier shot that is still finishing
+            return
+        entry = self._shot.get(name, None)
+        if entry is None:
+            entry = self._shot[name] = [0, 0]
+        entry[0] += 1
+        entry[1] += value
+
+    def _bound(self, fn, background, generation):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            previous = (getattr(self._local, 'background', False), getattr(self._local, 'generation', None))
+            self._local.background, self._local.generation = background, generation
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.background, self._local.generation = previous
+        return wrapper
+
+
+# shared by the whole application
+metrics = MetricsRegistry()
@@ -0,0 +1,181 @@
+from __future__ import division, print_function
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+import threading
+import timeit
+"""
+Module tracing
+==============
+Defines one class, Tracer, and the tracer every part of PiScope records into, tracer.
+While tracing is on, the shot pipeline records a begin and end for every worker run, signal
+and batch retrieval, server request, decimation and canvas draw, tagged with the thread it
+ran on.  export writes them as Chrome trace events, which chrome://tracing or
+https://ui.perfetto.dev show as a timeline with one row per thread.
+"""
+
+
+class Tracer(object):
+    """
+    Thread-safe recorder of timed spans, exported in the Chrome trace event format
+
+    Spans are kept as complete ('X') events with the time they started and how long they took
+    in microseconds.  Only the last max_events are kept so a session left tracing can't run out
+    of memory.  While the tracer is off, span costs next to nothing and records nothing.
+
+    Example::
+
+        from source.logging.tracing import tracer
+        tracer.start()
+        with tracer.span('retrieve_signal', 'fetch', signal='ip'):
+            data = connection.get(expression)
+        tracer.export('piscope-trace.json')
+
+    Attributes:
+        enabled (bool): spans are only recorded while True
+        max_events (int): most spans kept
+    """
+
+    def __init__(self, max_events=500000):
+        self.enabled = False
+        self.max_events = max_events
+        self._events = deque(maxlen=max_events)
+        self._threads = dict()  # thread id -> name
+        self._lock = threading.Lock()
+        self._origin = timeit.default_timer()
+        self._pid = os.getpid()
+
+    def start(self):
+        """
+        Starts recording, keeping the spans recorded before
+        """
+        self.enabled = True
+
+    def stop(self):
+        """
+        Stops recording, the spans recorded so far can still be exported
+        """
+        self.enabled = False
+
+    def clear(self):
+        """
+        Forgets every span recorded so far
+        """
+        with self._lock:
+            self._events.clear()
+
+    def __len__(self):
+        return len(self._events)
+
+    @contextmanager
+    def span(self, name, category='piscope', **args):
+        """
+        Context manager that records its block as a span on the current thread
+
+        Args:
+            name (str): name shown on the timeline
+            category (str): category to filter on in the viewer
+            **args: shown with the span when it is selected, e.g. the signal name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, timeit.default_timer() - start, args)
+
+    def traced(self, name=None, category='piscope'):
+        """
+        Decorator that records every call of the function as a span, named after the function by default
+        """
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instant(self, name, category='piscope', **args):
+        """
+        Records a point in time on the current thread, e.g. an event coming in
+        """
+        if self.enabled:
+            self.add(name, category, timeit.default_timer(), None, args)
+
+    def add(self, name, category, start, duration, args=None):
+        """
+        Records a span that was timed elsewhere
+
+        Args:
+            name (str): name shown on the timeline
+            category (str): category to filter on in the viewer
+            start (float): timeit.default_timer() when it started
+            duration (float): seconds it took, None for an instant
+            args (dict, optional): shown with the span when it is selected
+        """
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': category, 'ts': (start - self._origin) * 1e6,
+                 'pid': self._pid, 'tid': thread.ident}
+        if duration is None:
+            event['ph'] = 'i'
+            event['s'] = 't'
+        else:
+            event['ph'] = 'X'
+            event['dur'] = duration * 1e6
+        if args:
+            event['args'] = dict((key, _jsonable(value)) for key, value in args.items())
+
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+            self._events.append(event)
+
+    def events(self):
+        """
+        Returns:
+            list: recorded spans as trace events, preceded by the names of the processes and threads
+        """
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'tid': 0, 'args': {'name': 'PiScope'}}]
+        for tid, thread_name in threads.items():
+            if tid == threading.main_thread().ident:
+                thread_name = 'GUI ({0})'.format(thread_name)
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+                             'args': {'name': thread_name}})
+        return metadata + events
+
+    def export(self, filename):
+        """
+        Writes the recorded spans to filename as a Chrome trace
+
+        Args:
+            filename (str): file to write, .json
+
+        Returns:
+            int: number of spans written
+        """
+        events = self.events()
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return sum(1 for event in events if event['ph'] != 'M')
+
+
+def _jsonable(value):
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+# shared by the whole application
+tracer = Tracer()
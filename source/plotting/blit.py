@@ -0,0 +1,91 @@
+from __future__ import division, print_function
+from .resample import get_downsampler
+"""
+Module blit
+===========
+Defines one class, BlitManager.
+A BlitManager redraws only the lines of a figure over a cached copy of everything
+else while the user drags the view around.  Axes, ticks, labels and legends are
+drawn once when the gesture starts and once when it ends.
+"""
+
+
+class BlitManager(object):
+    """
+    Draws the lines of a figure over a cached background for the duration of a gesture
+
+    While a gesture is active the lines are animated, so a full draw leaves them out and
+    the result is kept as the background.  Every update restores the background, draws
+    the lines and blits the figure.  Re-decimation of the lines is held back until the
+    gesture ends, when every axis is re-decimated once for its final limits.
+
+    Attributes:
+        canvas (FigureCanvas): canvas of the figure, has to support copy_from_bbox and blit
+        active (bool): True between start and finish
+    """
+
+    def __init__(self, canvas):
+        """
+        Args:
+            canvas (FigureCanvas): canvas to draw on
+        """
+        self.canvas = canvas
+        self.active = False
+        self._background = None
+        self._lines = []
+        self._down_samplers = []
+
+    def start(self):
+        """
+        Caches the background of the figure without its lines and starts drawing only the lines
+        """
+        if self.active:
+            return
+
+        figure = self.canvas.figure
+        self._lines = [line for ax in figure.axes for line in ax.get_lines() if not line.get_animated()]
+        self._down_samplers = [get_downsampler(ax) for ax in figure.axes]
+        self._down_samplers = [down_sampler for down_sampler in self._down_samplers if down_sampler is not None]
+        for down_sampler in self._down_samplers:
+            down_sampler.paused = True
+
+        for line in self._lines:
+            line.set_animated(True)
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(figure.bbox)
+        self.active = True
+        self.update()
+
+    def update(self):
+        """
+        Redraws the lines over the cached background
+        """
+        if not self.active:
+            return
+
+        self.canvas.restore_region(self._background)
+        for line in self._lines:
+            if line.axes is not None:
+                line.axes.draw_artist(line)
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def finish(self):
+        """
+        Stops drawing only the lines, re-decimates every axis once and schedules a full draw
+        """
+        if not self.active:
+            return
+
+        self.active = False
+        self._background = None
+        for line in self._lines:
+            line.set_animated(False)
+        self._lines = []
+
+        for down_sampler in self._down_samplers:
+            down_sampler.paused = False
+        for down_sampler in self._down_samplers:
+            down_sampler.refresh()
+        self._down_samplers = []
+
+        self.canvas.draw_idle()
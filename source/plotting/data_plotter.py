@@ -1,62 +1,199 @@
 from __future__ import division, print_function
 from distutils.util import strtobool
 from .resample import DataDisplayDownsampler
+from ..logging.metrics import metrics, ARTISTS, DRAW
 import numpy as np
 from ..gui.helpers import global_lcm
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 
-def plot_all_data(axs, locs, data, downsampling=10000):
+def plot_all_data(axs, locs, data, downsampling=10000, scheduler=None):
     # print('entered plot all data')
     down_samplers = []
     for idx, pos in enumerate(locs):
         i, j = (int(x) for x in pos)
-        down_samplers += [plot(axs[j][i], locs[pos], data[pos], downsampling=downsampling)]
+        down_samplers += [plot(axs[j][i], locs[pos], data[pos], downsampling=downsampling, scheduler=scheduler)]
 
     return down_samplers
 
 
-def plot(ax, info_dict, data, downsampling=10000):
+def plot(ax, info_dict, data, downsampling=10000, scheduler=None):
     if data is None:
         return
-    info_keys = info_dict.keys()
 
-    actual_data = []
-    xstart = np.inf
-    xend = -np.inf
+    down_sampler = start_plot(ax, info_dict, downsampling=downsampling, scheduler=scheduler)
     for d in data:
-        #if len(d.data) > 1:
-        if d:  # Data class is now Truthy
-            actual_data += [d]
+        add_to_plot(ax, info_dict, d, down_sampler)
+    finish_plot(ax, info_dict, down_sampler)
+
+    return down_sampler
+
+
+def start_all_plots(axs, locs, downsampling=10000, scheduler=None, previous=None, aligned=False):
+    """
+    Sets up every subplot for signals to be added one at a time as they are retrieved
+
+    Subplots in previous keep their lines, see start_plot.
+
+    Args:
+        axs (list): axes of the figure by column
+        locs (dict): subplot configuration by location
+        downsampling (int): number of points to display per signal
+        scheduler (DecimationScheduler, optional): runs re-decimation off the GUI thread
+        previous (dict, optional): subplot location to the DataDisplayDownsampler from the last finish_all_plots
+        aligned (bool): decimate the lines onto the pixel columns of their axis, for overlaid shots
+
+    Returns:
+        dict: subplot location to the DataDisplayDownsampler to pass to add_to_plot and finish_plot
+    """
+    if previous is None:
+        previous = dict()
+
+    down_samplers = dict()
+    for pos in locs:
+        i, j = (int(x) for x in pos)
+        down_samplers[pos] = start_plot(axs[j][i], locs[pos], downsampling=downsampling, scheduler=scheduler,
+                                        previous=previous.get(pos, None), aligned=aligned)
+
+    return down_samplers
+
+
+def finish_all_plots(locs, down_samplers):
+    """
+    Finishes every subplot started with start_all_plots once all signals have been added
+
+    Returns:
+        dict: subplot location to the DataDisplayDownsampler of every subplot
+    """
+    for pos in locs:
+        down_sampler = down_samplers[pos]
+        finish_plot(down_sampler.ax, locs[pos], down_sampler)
+
+    return down_samplers
+
+
+def start_plot(ax, info_dict, downsampling=10000, scheduler=None, previous=None, aligned=False):
+    """
+    Creates the DataDisplayDownsampler for a subplot before any signals are added
+
+    If previous is the downsampler of the last plot on the same axis, the axis is not cleared.
+    Its lines, legend and labels are kept and add_to_plot puts the new data on the line with the
+    same label.  Otherwise the axis is cleared.
+
+    Args:
+        ax (matplotlib.axes.Axes): subplot axis
+        info_dict (dict): subplot configuration
+        downsampling (int): number of points to display per signal
+        scheduler (DecimationScheduler, optional): runs re-decimation off the GUI thread
+        previous (DataDisplayDownsampler, optional): downsampler of the last plot on this axis
+        aligned (bool): decimate the lines onto the pixel columns of the axis, see DataDisplayDownsampler
+
+    Returns:
+        DataDisplayDownsampler
+    """
+    mode = info_dict.get('resample', 'stride')
+    if mode not in DataDisplayDownsampler.modes:
+        mode = 'stride'
+
+    if (previous is not None and previous.ax is ax and previous.mode == mode and previous.cid is not None
+            and not info_dict.get('noresample', False)):
+        previous.reuse(downsampling, scheduler=scheduler)
+        previous.aligned = aligned
+        return previous
+
+    ax.cla()
+    # delta is set once all signals are in, see finish_plot
+    down_sampler = DataDisplayDownsampler([], 0.0, ax, max_points=downsampling, mode=mode, scheduler=scheduler)
+    down_sampler.aligned = aligned
+    return down_sampler
 
-            # prep xstart and xend
-            if d.time[0] < xstart:
-                xstart = d.time[0]
 
-            if d.time[-1] > xend:
-                xend = d.time[-1]
+def add_to_plot(ax, info_dict, d, down_sampler):
+    """
+    Plots one signal on a subplot started with start_plot
+
+    Args:
+        ax (matplotlib.axes.Axes): subplot axis
+        info_dict (dict): subplot configuration
+        d (Data): signal to plot, skipped if it is None or empty
+        down_sampler (DataDisplayDownsampler): downsampler from start_plot
+
+    Returns:
+        matplotlib.lines.Line2D or None
+    """
     # Only include signals with data, no empty arrays
-    down_sampler = DataDisplayDownsampler(actual_data, xend - xstart, ax, max_points=downsampling)
+    if not d:  # Data class is now Truthy
+        return
+
+    idx = down_sampler.find_line(d.name)
+    if idx is not None:
+        down_sampler.replace(idx, d)
+        return down_sampler.lines[idx]
+
+    down_sampler.data.append(d)
+    down_sampler.changed = True
 
     try:
         noresample = info_dict['noresample']
     except KeyError:
         noresample = False
 
-    for d in actual_data:
-
-        if not noresample:
-            x, y = down_sampler.downsample(d, xstart, xend)
+    if not noresample:
+        x, y = down_sampler.downsample(d, d.time[0], d.time[-1])
+        with metrics.timer(ARTISTS):
             line, = ax.plot(x, y, label=d.name, color=d.color, lw=1)
-            down_sampler.lines.append(line)
-        else:
-            # print(d.name, "not resampling!")
-            x, y = d.time, d.data
+        down_sampler.lines.append(line)
+    else:
+        # print(d.name, "not resampling!")
+        x, y = d.time, d.data
+        with metrics.timer(ARTISTS):
             line, = ax.plot(x, y, label=d.name, color=d.color, lw=1)
 
-    lg = None
+    return line
+
+
+@metrics.timed(ARTISTS)
+def finish_plot(ax, info_dict, down_sampler):
+    """
+    Adds the legend, labels and limits to a subplot once all of its signals have been added
+
+    On a reused axis the lines that got no new data are removed, the limits are autoscaled
+    to the new data and the legend is only recreated if the lines changed.
+
+    Args:
+        ax (matplotlib.axes.Axes): subplot axis
+        info_dict (dict): subplot configuration
+        down_sampler (DataDisplayDownsampler): downsampler from start_plot
+    """
+    info_keys = info_dict.keys()
+
+    down_sampler.remove_stale()
+
+    if down_sampler.data:
+        xstart = min(d.time[0] for d in down_sampler.data)
+        xend = max(d.time[-1] for d in down_sampler.data)
+        down_sampler.delta = xend - xstart
+        down_sampler.interval = (xstart, xend)
+
+    # the lines are already decimated for the full range, don't redo it while setting the limits
+    down_sampler.paused = True
+    if down_sampler.cid is not None:
+        # autoscaling was turned off when this axis was first plotted
+        ax.set_autoscale_on(True)
+        ax.relim()
+        ax.autoscale_view()
+
+    lg = ax.get_legend()
     if 'legend' in info_keys and strtobool(info_dict['legend']):
-        lg = ax.legend()
+        labels = [line.get_label() for line in ax.get_lines()]
+        if lg is None or [text.get_text() for text in lg.get_texts()] != labels:
+            lg = ax.legend()
+            if hasattr(lg, 'set_draggable'):
+                lg.set_draggable(True)
+            else:
+                lg.draggable()
+    elif lg is not None:
+        lg.remove()
 
     if 'xlabel' in info_keys:
         ax.set_xlabel(info_dict['xlabel'])
@@ -64,9 +201,6 @@ def plot(ax, info_dict, data, downsampling=10000):
     if 'ylabel' in info_keys:
         ax.set_ylabel(info_dict['ylabel'])
 
-    if lg:
-        lg.draggable()
-
     if 'xlim' in info_keys:
         xlim = info_dict['xlim']
         xlim = [float(x) for x in xlim]
@@ -76,12 +210,45 @@ def plot(ax, info_dict, data, downsampling=10000):
         ylim = info_dict['ylim']
         ylim = [float(y) for y in ylim]
         ax.set_ylim(ylim)
+    down_sampler.paused = False
 
     if len(down_sampler.lines) > 0:
         ax.set_autoscale_on(False)
-        ax.callbacks.connect('xlim_changed', down_sampler.update)
+        if down_sampler.cid is None:
+            down_sampler.cid = ax.callbacks.connect('xlim_changed', down_sampler.update)
 
-    return down_sampler
+
+def view_limits(axs):
+    """
+    Returns:
+        list: ((xmin, xmax), (ymin, ymax)) of every axis in axs, a list of columns of axes
+    """
+    return [(tuple(ax.get_xlim()), tuple(ax.get_ylim())) for axes in axs for ax in axes]
+
+
+def redraw_changed(canvas, down_samplers):
+    """
+    Redraws only the inside of the subplots whose lines changed and blits them onto the canvas
+
+    This is only valid if nothing outside of the axes (limits, ticks, labels or layout)
+    changed since the last full draw.  The canvas is fully redrawn if it has never been drawn.
+
+    Args:
+        canvas (FigureCanvas): canvas holding the subplots
+        down_samplers (iterable): DataDisplayDownsampler of every subplot
+    """
+    changed = [down_sampler for down_sampler in down_samplers if down_sampler.changed]
+    try:
+        with metrics.timer(DRAW):
+            for down_sampler in changed:
+                down_sampler.ax.redraw_in_frame()
+                canvas.blit(down_sampler.ax.bbox)
+    except (AttributeError, RuntimeError):
+        # no renderer yet
+        canvas.draw_idle()
+
+    for down_sampler in changed:
+        down_sampler.changed = False
 
 
 def create_figure(column_setup):
@@ -1,35 +1,232 @@
 from __future__  import print_function, division
+from ..logging.metrics import metrics, DECIMATE, ARTISTS
 import numpy as np
+import weakref
+
+# axis -> the DataDisplayDownsampler plotting on it
+_downsamplers = weakref.WeakKeyDictionary()
+
+
+def get_downsampler(ax):
+    """
+    Returns the DataDisplayDownsampler last created for ax, or None if there isn't one
+    """
+    return _downsamplers.get(ax, None)
+
+
+def envelope(xdata, ydata, n_bins):
+    """
+    Min/max (M4) decimation that keeps the first, last, minimum and maximum point of each bin
+
+    Unlike a plain stride this never drops a spike, so the decimated line looks the
+    same as the full resolution one when drawn with about n_bins pixel columns.
+
+    Args:
+        xdata (np.ndarray): x values
+        ydata (np.ndarray): y values
+        n_bins (int): number of bins (pixel columns) to reduce to
+
+    Returns:
+        tuple: decimated (xdata, ydata) with at most 4 points per bin
+    """
+    n = len(ydata)
+    n_bins = max(int(n_bins), 1)
+    if n <= 4 * n_bins:
+        return xdata, ydata
+
+    bin_size = -(-n // n_bins)  # ceil
+    n_full = (n // bin_size) * bin_size
+
+    indices = _envelope_indices(ydata[:n_full].reshape(-1, bin_size), 0)
+    if n_full < n:
+        # leftover points that don't fill a whole bin
+        indices = np.concatenate([indices, _envelope_indices(ydata[n_full:].reshape(1, -1), n_full)])
+
+    return xdata[indices], ydata[indices]
+
+
+def _envelope_indices(bins, offset):
+    """
+    Indices of the first, min, max and last point of every row of bins, in increasing order
+    """
+    n_bins, bin_size = bins.shape
+    starts = offset + bin_size * np.arange(n_bins)
+    indices = np.stack([starts,
+                        starts + np.argmin(bins, axis=1),
+                        starts + np.argmax(bins, axis=1),
+                        starts + bin_size - 1], axis=1)
+    indices.sort(axis=1)
+    return indices.ravel()
+
+
+def pixel_envelope(xdata, ydata, edges, bins=None):
+    """
+    Min/max envelope on fixed x bins, e.g. the pixel columns of an axis
+
+    Every non-empty bin is reduced to its minimum and maximum, both placed at the center of
+    the bin.  Lines decimated with the same edges line up column for column, and each has at
+    most two points per bin however many samples it has.
+
+    Args:
+        xdata (np.ndarray): sorted x values
+        ydata (np.ndarray): y values
+        edges (np.ndarray): increasing bin edges
+        bins (np.ndarray, optional): np.searchsorted(xdata, edges), can be shared by lines with the same xdata
+
+    Returns:
+        tuple: decimated (xdata, ydata)
+    """
+    if bins is None:
+        bins = np.searchsorted(xdata, edges)
+
+    filled = np.diff(bins) > 0
+    starts = bins[:-1][filled]
+    if len(starts) == 0:
+        return xdata[:0], ydata[:0]
+
+    # only the samples inside the edges, so the last bin doesn't run on to the end of the record
+    inside = ydata[bins[0]:bins[-1]]
+    starts = starts - bins[0]
+    centers = 0.5 * (edges[:-1] + edges[1:])[filled]
+    ymin = np.minimum.reduceat(inside, starts)
+    ymax = np.maximum.reduceat(inside, starts)
+    return np.repeat(centers, 2), np.stack([ymin, ymax], axis=1).ravel()
+
+
+def visible_range(data, xstart, xend):
+    """
+    Returns the points of data between xstart and xend plus one point on either side
+
+    The extra points keep the line from being cut off at the edge of the view.  Time
+    bases from dim_of are sorted, so the range is found with a binary search and
+    returned as views.  Unsorted time bases fall back to masking.
+
+    Args:
+        data (Data): signal to look at
+        xstart (float): start of the view range
+        xend (float): end of the view range
+
+    Returns:
+        tuple: (xdata, ydata) in the view range
+    """
+    if data.monotonic:
+        i0 = max(np.searchsorted(data.time, xstart, side='right') - 1, 0)
+        i1 = min(np.searchsorted(data.time, xend, side='left') + 1, len(data.time))
+        return data.time[i0:i1], data.data[i0:i1]
+
+    # get the points in the view range
+    mask = (data.time > xstart) & (data.time < xend)
+
+    # dilate the mask by one to catch the points just outside
+    # of the view range to not truncate the line
+    mask = np.convolve([1, 1], mask, mode='same').astype(bool)
+
+    return data.time[mask], data.data[mask]
 
 
 class DataDisplayDownsampler(object):
-    def __init__(self, data_list, delta, ax, max_points=1000):
+    """
+    Decimates the lines on one axis to max_points points each, redoing it whenever the x limits change
+
+    A change of the x limits of one axis re-decimates it and every axis sharing x with it
+    once, without going through set_xlim on the siblings.
+
+    If a scheduler is given, the decimation after a change of the x limits is handed to it
+    so it can run off the GUI thread.  The scheduler calls decimate in a worker and apply
+    with the result back on the GUI thread.  Results that were overtaken by a newer
+    change of the x limits are dropped.
+
+    Signals that were only fetched in part (see Data.window) are refined when the view needs
+    more of them: if the view reaches past the fetched window or shows fewer than half of
+    max_points points of a server-decimated record, the view plus half its width on either side is
+    fetched at a step that gives about max_points points in view.  This happens in decimate,
+    so only with a scheduler, which keeps the fetch off the GUI thread.
+
+    With aligned set (e.g. when several shots are overlaid) every line is reduced to a min/max
+    envelope on the pixel columns of the axis, see pixel_envelope.  The lines line up column for
+    column, each costs at most two points per column to draw, and the bins of a time base are
+    only searched for once per decimation for all of the shots that share it.
+
+    Attributes:
+        max_points (int): number of points to display per line
+        mode (str): 'stride' to keep every n-th point, 'envelope' to keep the min/max envelope
+        scheduler (object): has a submit(downsampler, generation, xstart, xend) method, None to decimate in place
+        generation (int): incremented on every change of the x limits
+        delta (float): width of interval
+        interval (tuple): (xstart, xend) the lines are decimated for, None if unknown
+        changed (bool): set when lines were added, updated or removed since the last draw
+        paused (bool): while True, changes of the x limits are ignored
+        aligned (bool): decimate every line onto the pixel columns of the axis
+    """
+    modes = ('stride', 'envelope')
+    # how far (as a fraction of the view) the view may reach past a fetched window, e.g. the autoscale margins
+    refine_tolerance = 0.1
+
+    def __init__(self, data_list, delta, ax, max_points=1000, mode='stride', scheduler=None):
         if max_points < 1:
             self.max_points = 1000
         else:
             self.max_points = int(max_points)
 
+        if mode not in self.modes:
+            raise ValueError("mode must be one of %s, not %r" % (self.modes, mode))
+
+        self.mode = mode
         self.delta = delta
+        self.interval = None
         self.data = data_list
         self.lines = []
         self.ax = ax
+        self.scheduler = scheduler
+        self.generation = 0
+        self.changed = False
+        self.paused = False
+        self.aligned = False
+        self.cid = None  # xlim_changed callback id, the callback is connected once per axis
+        self.stale = set()  # indices of lines waiting for new data, see data_plotter.start_plot
+        self._refined = dict()  # line index -> (data, refined data) fetched for the view, see refined
+        _downsamplers[ax] = self
 
-    def downsample(self, data, xstart, xend):
-        # get the points in the view range
-        # mask = (self.origXData > xstart) & (self.origXData < xend)
-        mask = (data.time > xstart) & (data.time < xend)
+    @metrics.timed(DECIMATE)
+    def downsample(self, data, xstart, xend, bins=None):
+        """
+        Decimates one signal for the x range
 
-        # dilate the mask by one to catch the points just outside
-        # of the view range to not truncate the line
-        mask = np.convolve([1, 1], mask, mode='same').astype(bool)
-        # sort out how many points to drop
-        ratio = max(np.sum(mask) // self.max_points, 1)
+        Args:
+            data (Data): signal to decimate
+            xstart (float): start of the view range
+            xend (float): end of the view range
+            bins (dict, optional): pixel bins by time base, shared between the calls of one decimation when aligned
+
+        Returns:
+            tuple: decimated (xdata, ydata)
+        """
+        if self.aligned and data.monotonic and data.data.ndim == 1:
+            edges = self.pixel_edges(xstart, xend)
+            if data.pyramid is not None:
+                xdata, ydata = data.pyramid.view(xstart, xend, 4 * len(edges))
+                return pixel_envelope(xdata, ydata, edges)
+
+            if bins is None:
+                return pixel_envelope(data.time, data.data, edges)
+            # overlaid shots from the same digitizer share their time base, see TimebaseRegistry
+            key = id(data.time)
+            if key not in bins:
+                bins[key] = (data.time, np.searchsorted(data.time, edges))
+            return pixel_envelope(data.time, data.data, edges, bins=bins[key][1])
+
+        if self.mode == 'envelope' and data.pyramid is not None:
+            # only look at the visible part of a level close to the screen resolution
+            xdata, ydata = data.pyramid.view(xstart, xend, self.max_points)
+            return envelope(xdata, ydata, self.max_points // 4)
 
-        # mask data
-        # xdata = self.origXData[mask]
-        # ydata = self.origYData[mask]
-        xdata = data.time[mask]
-        ydata = data.data[mask]
+        xdata, ydata = visible_range(data, xstart, xend)
+
+        if self.mode == 'envelope':
+            return envelope(xdata, ydata, self.max_points // 4)
+
+        # sort out how many points to drop
+        ratio = max(len(xdata) // self.max_points, 1)
 
         # downsample data
         xdata = xdata[::ratio]
@@ -40,14 +237,219 @@ class DataDisplayDownsampler(object):
 
         return xdata, ydata
 
+    def decimate(self, xstart, xend, refine=True):
+        """
+        Decimates every line for the x range, safe to call from a worker thread
+
+        Args:
+            xstart (float): start of the view range
+            xend (float): end of the view range
+            refine (bool): fetch more of partially fetched signals if the view needs it, see refined
+
+        Returns:
+            list: (xdata, ydata) for every line
+        """
+        results = []
+        bins = dict()
+        for idx, data in enumerate(self.data[:len(self.lines)]):
+            if refine:
+                data = self.refined(idx, data, xstart, xend)
+            results.append(self.downsample(data, xstart, xend, bins=bins))
+        return results
+
+    def pixel_edges(self, xstart, xend):
+        """
+        Returns:
+            np.ndarray: edges of the pixel columns of the axis between xstart and xend, at most max_points // 2 columns
+        """
+        n_bins = self.max_points // 2
+        width = int(self.ax.bbox.width)
+        if width >= 1:
+            n_bins = min(n_bins, width)
+        return np.linspace(xstart, xend, max(n_bins, 1) + 1)
+
+    def refined(self, idx, data, xstart, xend):
+        """
+        Returns the data of line idx to decimate for the x range, fetching more of it if needed
+
+        Args:
+            idx (int): index of the line
+            data (Data): data of the line
+            xstart (float): start of the view range
+            xend (float): end of the view range
+
+        Returns:
+            Data: data, or a refined copy of it that covers the view
+        """
+        previous = self._refined.get(idx, None)
+        if previous is not None and previous[0] is data and not self.needs_refine(previous[1], xstart, xend):
+            return previous[1]
+
+        if data.refine is None or not self.needs_refine(data, xstart, xend):
+            return data
+
+        width = xend - xstart
+        span = data.time[-1] - data.time[0]
+        # points per unit of x in the full resolution record
+        rate = len(data) * data.window.step / span if span > 0 else 0.0
+        step = max(int(rate * width // self.max_points), 1)
+        refined = data.refine(xstart - 0.5 * width, xend + 0.5 * width, step)
+        if not refined:
+            return data
+
+        self._refined[idx] = (data, refined)
+        return refined
+
+    def needs_refine(self, data, xstart, xend):
+        """
+        Checks if a partially fetched signal is missing points that would show in the x range
+
+        Args:
+            data (Data): signal to check
+            xstart (float): start of the view range
+            xend (float): end of the view range
+
+        Returns:
+            bool: True if more of the record should be fetched
+        """
+        window = data.window
+        if window is None:
+            return False
+
+        tolerance = self.refine_tolerance * (xend - xstart)
+        if window.start is not None and xstart < window.start - tolerance:
+            return True
+        if window.end is not None and xend > window.end + tolerance:
+            return True
+
+        # some slack, so an estimate of the point density that is a bit off doesn't refetch on every pan
+        return window.step > 1 and len(visible_range(data, xstart, xend)[0]) < self.max_points // 2
+
+    def apply(self, generation, results):
+        """
+        Puts decimated data on the lines unless a newer decimation has been requested
+
+        Args:
+            generation (int): generation the results were computed for
+            results (list): (xdata, ydata) for every line
+
+        Returns:
+            bool: True if the lines were updated
+        """
+        if generation != self.generation:
+            return False
+
+        with metrics.timer(ARTISTS):
+            for line, (xdata, ydata) in zip(self.lines, results):
+                line.set_data(xdata, ydata)
+        return True
+
+    def redecimate(self, xstart, xend):
+        """
+        Decimates the lines for a new x range, in the scheduler if there is one
+
+        Args:
+            xstart (float): start of the view range
+            xend (float): end of the view range
+        """
+        self.generation += 1
+        if self.scheduler is None:
+            # fetching more of a signal would hold up the GUI thread
+            self.apply(self.generation, self.decimate(xstart, xend, refine=False))
+        else:
+            self.scheduler.submit(self, self.generation, xstart, xend)
+
+    def reuse(self, max_points, scheduler=None):
+        """
+        Keeps the lines on the axis for a new set of data
+
+        Every line waits for new data from replace.  Lines that get none are taken off
+        the axis by remove_stale.
+
+        Args:
+            max_points (int): number of points to display per line
+            scheduler (object, optional): replaces the scheduler
+        """
+        # drop decimations of the old data that are still in flight
+        self.generation += 1
+        if max_points >= 1:
+            self.max_points = int(max_points)
+        self.scheduler = scheduler
+        self.stale = set(range(len(self.lines)))
+
+    def replace(self, idx, data):
+        """
+        Puts data on an existing line, decimated over its full time range
+
+        Args:
+            idx (int): index of the line
+            data (Data): new data for the line
+        """
+        self.stale.discard(idx)
+        self.data[idx] = data
+        line = self.lines[idx]
+        xdata, ydata = self.downsample(data, data.time[0], data.time[-1])
+        with metrics.timer(ARTISTS):
+            line.set_data(xdata, ydata)
+            line.set_color(data.color)
+        self.changed = True
+
+    def find_line(self, name):
+        """
+        Returns the index of the line waiting for new data labeled name, or None if there isn't one
+        """
+        for idx in self.stale:
+            if self.lines[idx].get_label() == name:
+                return idx
+
+    def remove_stale(self):
+        """
+        Removes the lines that did not get new data from the axis
+
+        Returns:
+            bool: True if any line was removed
+        """
+        stale = sorted(self.stale, reverse=True)
+        for idx in stale:
+            self.lines.pop(idx).remove()
+            self.data.pop(idx)
+        self.stale = set()
+        if stale:
+            self.changed = True
+        return len(stale) > 0
+
+    def refresh(self, interval=None):
+        """
+        Re-decimates the lines if the x limits moved away from the interval they were decimated for
+
+        Args:
+            interval (tuple, optional): new (xstart, xend), the x limits of the axis by default
+
+        Returns:
+            bool: True if a decimation was started
+        """
+        if interval is None:
+            interval = self.ax.viewLim.intervalx
+        xstart, xend = interval
+        if self.interval is not None and max(abs(xstart - self.interval[0]), abs(xend - self.interval[1])) <= 1e-8:
+            return False
+
+        self.interval = (xstart, xend)
+        self.delta = xend - xstart
+        self.redecimate(xstart, xend)
+        return True
+
     def update(self, ax):
-        lims = ax.viewLim
-        if np.abs(lims.width - self.delta) > 1e-8:
-            self.delta = lims.width
-            xstart, xend = lims.intervalx
-            for idx, line in enumerate(self.lines):
-                line.set_data(*self.downsample(self.data[idx], xstart, xend))
-
-            for other in self.ax.get_shared_x_axes().get_siblings(self.ax):
-                if other is not self.ax:
-                    other.set_xlim(lims.intervalx, emit=True, auto=False)
+        """
+        xlim_changed callback, re-decimates this axis and the axes sharing x with it
+        """
+        if self.paused:
+            return
+
+        # matplotlib moves the limits of the siblings without calling their callbacks,
+        # and possibly only after this one returns
+        interval = tuple(ax.viewLim.intervalx)
+        for other in self.ax.get_shared_x_axes().get_siblings(self.ax):
+            down_sampler = self if other is self.ax else get_downsampler(other)
+            if down_sampler is not None and not down_sampler.paused:
+                down_sampler.refresh(interval)
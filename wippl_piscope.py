@@ -5,6 +5,7 @@ import argparse
 import source.gui.piscope as MyApp
 #import logging
 from source.logging.piscope_logging import create_logger, log
+from source.logging.tracing import tracer
 import os.path as path
 
 if __name__ == "__main__":
@@ -13,6 +14,12 @@ if __name__ == "__main__":
     parser.add_argument("--shot_number", "-s", type=int, default=None, help="Shot Number to Open at Start Up")
     parser.add_argument("--logging", "-L", type=str, default=None,
                         help="Log file name for debug logging")
+    parser.add_argument("--disk-cache", "-d", type=str, default=None,
+                        help="Directory for caching past shots on disk between sessions")
+    parser.add_argument("--disk-cache-size", type=float, default=10 * 1024,
+                        help="Size cap in MB for the disk cache")
+    parser.add_argument("--trace", "-t", type=str, default=None,
+                        help="Record a timeline of the session and write it to this file as a Chrome trace on exit")
     args = parser.parse_args()
 
 
@@ -37,6 +44,13 @@ if __name__ == "__main__":
     logger.debug("*****************************************")
     logger.debug("Starting up")
 
+    if args.trace:
+        tracer.start()
+
+    if args.disk_cache:
+        from source.data import mdsplus_helpers
+        mdsplus_helpers.configure_disk_cache(args.disk_cache, max_bytes=args.disk_cache_size * 1024**2)
+
     myapp = QApplication([])
     myapp.setWindowIcon(QIcon("Icons/application-wave.png"))
     print(args.config, type(args.config))
@@ -44,3 +58,6 @@ if __name__ == "__main__":
     print(os.path.dirname(os.path.realpath(__file__)))
     window = MyApp.PiScope(args.config, args.shot_number)
     myapp.exec_()
+
+    if args.trace:
+        print("Wrote %d spans to %s" % (tracer.export(args.trace), args.trace))